@@ -1,40 +1,143 @@
-import asyncio, os
+import asyncio, os, signal, time, traceback
+from collections  import deque
 import pendulum
 
 from argparse     import ArgumentParser
 from configparser import ConfigParser
-from dataclasses  import dataclass
+from dataclasses  import dataclass, replace
+from time         import monotonic
 from enum         import IntEnum
-from typing       import Dict, Iterable, List, Optional, Set, Tuple
+from typing       import (cast, Any, Awaitable, Deque, Dict, Iterable, List,
+    Mapping, Optional, Set, Tuple)
 
 from irctokens import build, Hostmask, Line
 from ircstates import Channel, User, ChannelUser
+from ircstates.names import Name
+from ircstates.casemap import casefold, CaseMap
 from ircrobots import Bot as BaseBot
 from ircrobots import Server as BaseServer
 from ircrobots import ConnectionParams, SASLUserPass
+from ircrobots.interface import IServer, SentLine, SendPriority
 
 from ircstates.numerics import *
 from ircrobots.glob     import compile as glob_compile
 from ircrobots.glob     import Glob
 from ircrobots.matching import Response, Responses, ANY, Folded, Nick, SELF
 
+from irctoolkit         import metrics
+from irctoolkit.log     import LineLog
+from irctoolkit.metrics import REGISTRY
+from irctoolkit.profile import LineProfiler
+
+from .api      import HistoryAPI
+from .commands import CommandError, CommandRouter, CommandTable
 from .utils    import from_pretty_time
-from .config   import BotConfig, ChannelConfig, ChannelConfigs
-from .database import BanDatabase
+from .config   import (BotConfig, ChannelConfig, ChannelConfigs,
+    NetworkConfig)
+from .database     import BanDatabase, EXPIRE_RESEND
+from .database.aio   import AsyncBanDatabase
+from .database.cache import ActiveBanCache
+from .expiry       import ExpiryScheduler
+from .modes        import ModeChange, pack_modes, prefix_length
+from .outbound     import Outbound
+from .resync       import ChannelResync
+from .masks    import CacheCounters, MaskIndex, TrackerUser
 
 class Types(IntEnum):
     BAN   = 1
     QUIET = 2
 
 DATA:         str
-DB:           BanDatabase
+DB:           AsyncBanDatabase
+EXPIRY:       ExpiryScheduler
 CONFIG:       BotConfig
-CHAN_CONFIGS: ChannelConfigs
+# network name: its channels' configs
+CHAN_CONFIGS: Dict[str, ChannelConfigs]
+LOG:          LineLog
+PROFILE:      LineProfiler
 
 CHANSERV = Nick("ChanServ")
 ENFORCE_REASON = "User is banned from this channel ({id})"
+# how long to wait before retrying expiries for channels we're not in
+EXPIRE_RETRY = 60
+# how long one network's expiries get before we give up on them until the
+# next retry (e.g. if we've been disconnected, or ChanServ won't op us)
+EXPIRE_TIMEOUT = 300
+# how many channels we'll be asking for ban lists of ourselves at once
+RESYNC_CONCURRENCY = 10
+# how long we'll wait for a channel's ban lists before giving up on it
+RESYNC_TIMEOUT     = 120
+# how long a network being removed gets to send its QUIT
+QUIT_TIMEOUT = 5
+
+COMMANDS = CommandTable()
+
+LINE_SECONDS    = REGISTRY.histogram(
+    "bantracker_line_seconds",
+    "Time taken handling each line we read, by command",
+    ["command"]
+)
+ENFORCE_SECONDS = REGISTRY.histogram(
+    "bantracker_enforce_seconds",
+    "Time from reading a MODE to having sent its KICKs and devoices"
+)
+ENFORCED        = REGISTRY.counter(
+    "bantracker_enforced_total",
+    "Users removed by new bans and quiets",
+    ["action"]
+)
+EXPIRY_LAG      = REGISTRY.histogram(
+    "bantracker_expiry_lag_seconds",
+    "How late we sent the removal of expired bans",
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+)
 
 class Server(BaseServer):
+    def __init__(self, bot: BaseBot, name: str):
+        super().__init__(bot, name)
+        # (kept, so a network removed by a reload can still wind down)
+        self.network      = CONFIG.networks[name]
+        self.chan_configs = CHAN_CONFIGS[name]
+
+        self._mask_indexes: Dict[str, MaskIndex] = {}
+        self.mask_cache  = CacheCounters()
+        self.active_bans = ActiveBanCache()
+
+        self._resyncs:      Dict[str, ChannelResync] = {}
+        self._resync_queue: Deque[str] = deque()
+        self._resync_querying = 0
+        # how long each channel's last JOIN resync took, in seconds
+        self.resync_timings: Dict[str, float] = {}
+
+        self.outbound = Outbound(
+            super().send,
+            self.casefold,
+            CONFIG.flood_burst,
+            CONFIG.flood_rate
+        )
+        self._commands = CommandRouter(
+            COMMANDS, self.chan_configs, self.network.trigger, self.casefold
+        )
+
+    def send(self,
+            line:     Line,
+            priority: int=SendPriority.DEFAULT
+            ) -> Awaitable[SentLine]:
+        # everything we send goes through our own flood-aware, prioritised
+        # queue before it reaches ircrobots'
+        return self.outbound.queue(line)
+
+    async def disconnect(self):
+        self.outbound.close()
+        await super().disconnect()
+
+    async def wait_for(self, *args: Any, **kwargs: Any) -> Line:
+        with PROFILE.waiting():
+            return await super().wait_for(*args, **kwargs)
+
+    def create_user(self, nickname: Name) -> TrackerUser:
+        return TrackerUser(nickname)
+
     async def _assure_op(self, channel: Channel) -> bool:
         channel_self = channel.users[self.nickname_lower]
         if not "o" in channel_self.modes:
@@ -48,101 +151,196 @@ class Server(BaseServer):
         else:
             return False
 
-    def _mode_batches(self,
-            chunk_n: int,
-            add:     bool,
-            modes:   str,
-            args:    List[str]
-            ) -> Iterable[Tuple[str, List[str]]]:
-
-        mod = "+" if add else "-"
-        for i in range(0, len(modes), chunk_n):
-            cur_slice = slice(i, i+chunk_n)
-            cur_modes = modes[cur_slice]
-            cur_args  =  args[cur_slice]
-            yield f"{mod}{modes[cur_slice]}", args[cur_slice]
-
     async def _remove_modes(self,
             channel:   Channel,
             modes:     str,
             args:      List[str],
             remove_op: bool):
 
+        changes: List[ModeChange] = [
+            (False, mode, arg) for mode, arg in zip(modes, args)
+        ]
+        last: Optional[ModeChange] = None
         if remove_op:
-            modes += "o"
-            args.append(self.nickname)
+            last = (False, "o", self.nickname)
 
-        batches = self._mode_batches(
-            self.isupport.modes, False, modes, args
+        prefix_len = prefix_length(
+            self.nickname, self.username, self.hostname
         )
-        for b_modes, b_args in batches:
+        lines = pack_modes(
+            channel.name, changes, self.isupport.modes, prefix_len, last
+        )
+        for b_modes, b_args in lines:
             await self.send(build("MODE", [channel.name, b_modes]+b_args))
 
-    async def _mode_list(self,
-            channel: str,
-            modes:   str
-            ) -> List[Tuple[int, str, str, int]]:
-
-        await self.send(build("MODE", [channel, f"+{modes}"]))
+    def _start_resync(self, channel_name: str):
+        modes  = "b" + (self.network.quiet or "")
+        resync = ChannelResync(modes)
+        self._resyncs[channel_name] = resync
+        # whatever we knew about this channel's bans before is stale
+        self.active_bans.forget(channel_name)
+        # ircrobots has already asked for the list of every list mode the
+        # server told us about; we only ask for any of ours it didn't
+        if self._unlisted(resync):
+            self._resync_queue.append(channel_name)
+
+        def _timeout():
+            if self._resyncs.get(channel_name) is resync:
+                LOG.warning(f"gave up resyncing {channel_name}", self.name)
+                self._end_resync(channel_name, resync)
+                asyncio.create_task(self._next_resyncs())
+        asyncio.get_running_loop().call_later(RESYNC_TIMEOUT, _timeout)
+
+    def _unlisted(self, resync: ChannelResync) -> str:
+        a_modes = self.isupport.chanmodes.a_modes
+        return "".join(m for m in sorted(resync.waiting) if not m in a_modes)
+
+    def _end_resync(self, channel_name: str, resync: ChannelResync):
+        del self._resyncs[channel_name]
+        if resync.queried is not None:
+            self._resync_querying -= 1
+        elif channel_name in self._resync_queue:
+            self._resync_queue.remove(channel_name)
+
+    async def _next_resyncs(self):
+        # pipeline our own list queries for as many channels as we're
+        # allowed to at once. replies (to ours and to ircrobots') are picked
+        # up in _resync_line, not waited for here
+        while (self._resync_queue and
+                self._resync_querying < RESYNC_CONCURRENCY):
+            channel_name = self._resync_queue.popleft()
+            resync = self._resyncs[channel_name]
+            modes  = self._unlisted(resync)
+            if not modes:
+                continue
+            resync.queried = monotonic()
+            self._resync_querying += 1
+
+            # (not awaited; that'd wait until it's through our send queue)
+            self.send(build("MODE", [channel_name, f"+{modes}"]))
+
+    async def _resync_line(self, line: Line):
+        channel_name = self.casefold(line.params[1])
+        if not channel_name in self._resyncs:
+            return
+        resync = self._resyncs[channel_name]
+
+        # :server 367 * #c mask set-by set-at
+        # :server 728 * #c q mask set-by set-at
+        if line.command in [RPL_BANLIST, RPL_QUIETLIST]:
+            offset = 0
+            type   = Types.BAN
+            if line.command == RPL_QUIETLIST:
+                offset += 1
+                type    = Types.QUIET
+
+            mask   = line.params[offset+2]
+            set_by = (line.params[offset+3:] or [""])[0]
+            set_at = int((line.params[offset+4:] or ["0"])[0])
+            resync.add(type, mask, set_by, set_at)
+            return
+
+        mode = "b"
+        if line.command == RPL_ENDOFQUIETLIST:
+            mode = self.network.quiet or "q"
+        if not resync.end(mode):
+            return
+
+        self._end_resync(channel_name, resync)
 
-        waiting = len(modes)
-
-        masks: List[Tuple[int, str, str, int]] = []
-        while True:
-            line = await self.wait_for(Responses([
-                RPL_BANLIST, RPL_ENDOFBANLIST,
-                RPL_QUIETLIST, RPL_ENDOFQUIETLIST
-            ], [ANY, Folded(channel)]))
-            if line.command in [RPL_ENDOFBANLIST, RPL_ENDOFQUIETLIST]:
-                waiting -= 1
-                if waiting == 0:
-                    break
-            else:
-                # :server 367 * #c mask set-by set-at
-                # :server 728 * q #c mask set-by set-at
-                offset = 0
-                type = Types.BAN
-                if line.command == RPL_QUIETLIST:
-                    offset += 1
-                    type = Types.QUIET
-
-                mask   = line.params[offset+2]
-                set_by = line.params[offset+3]
-                set_at = int(line.params[offset+4])
-                masks.append((type, mask, set_by, set_at))
-        return masks
-
-    async def _check_expires(self):
         now = int(pendulum.now("utc").timestamp())
+        removed, added, active = await DB.resync(
+            self.name, channel_name, resync.current(), now
+        )
+        for ban_id in removed:
+            EXPIRY.cancel(ban_id)
+        self.active_bans.hydrate(channel_name, active)
+        if CONFIG.cache_check:
+            await self._check_cache(channel_name)
+
+        took = monotonic()-resync.started
+        self.resync_timings[channel_name] = took
+        LOG.info(f"resynced {channel_name} in {took:.2f}s "
+            f"({len(resync.masks)} listed, "
+            f"{len(removed)} removed, {len(added)} added)", self.name)
+
+        await self._next_resyncs()
+
+    async def _check_expires(self, sent: Set[int], unremovable: Set[int]):
+        # adds the ban_ids we've sent removals for to `sent` as we go, so
+        # it's right even if we fail part way. those we can't ever send
+        # removals for are in both
+        now     = int(pendulum.now("utc").timestamp())
+        expired = await DB.take_expired(
+            now, self.name, list(self.channels.keys())
+        )
 
-        expired = DB.find_expired(now)
-        expired_groups: Dict[str, List[Tuple[int, str]]] = {}
-
-        for ban_id in expired:
-            channel_name, type, mask, *_ = DB.get_ban(ban_id)
+        expired_groups: Dict[str, List[Tuple[int, str, int]]] = {}
+        for channel_name, type, mask, ban_id in expired:
             if not channel_name in expired_groups:
                 expired_groups[channel_name] = []
-            expired_groups[channel_name].append((type, mask))
-
-        for channel_name, type_masks in expired_groups.items():
-            if channel_name in self.channels:
-                channel = self.channels[channel_name]
-                remove_op = False
-                if CONFIG.chanserv:
-                    remove_op = await self._assure_op(channel)
-
-                modes = ""
-                args: List[str] = []
-                for type, mask in type_masks:
-                    if   type == Types.BAN:
-                        modes += "b"
-                    elif type == Types.QUIET:
-                        if CONFIG.quiet is not None:
-                            modes += CONFIG.quiet
-                        else:
-                            continue
-                    args.append(mask)
-                await self._remove_modes(channel, modes, args, remove_op)
+            expired_groups[channel_name].append((type, mask, ban_id))
+
+        try:
+            for channel_name, type_masks in expired_groups.items():
+                if channel_name in self.channels:
+                    channel = self.channels[channel_name]
+                    remove_op = False
+                    if self.network.chanserv:
+                        remove_op = await self._assure_op(channel)
+
+                    modes = ""
+                    args: List[str] = []
+                    for type, mask, ban_id in type_masks:
+                        if   type == Types.BAN:
+                            modes += "b"
+                        elif type == Types.QUIET:
+                            if self.network.quiet is not None:
+                                modes += self.network.quiet
+                            else:
+                                # (we've no way to remove it; don't retry)
+                                sent.add(ban_id)
+                                unremovable.add(ban_id)
+                                continue
+                        args.append(mask)
+                    await self._remove_modes(channel, modes, args, remove_op)
+                    sent.update(ban_id for _, _, ban_id in type_masks)
+        finally:
+            # (so the next take_expired() sees them again)
+            unsent = [b for _, _, _, b in expired if not b in sent]
+            if unsent:
+                await DB.release_expired(unsent)
+
+    def _existing_ids(self,
+            channel_name: str,
+            changes:      List[Tuple[bool, int, str]]
+            ) -> Optional[List[Optional[int]]]:
+        # the active ban_id (or None) for each change's mask, or None if we
+        # can't know them without asking the database
+        if not self.active_bans.hydrated(channel_name):
+            return None
+
+        existing_ids: List[Optional[int]] = []
+        seen: Set[Tuple[int, str]] = set()
+        for add, type, mask in changes:
+            key = (type, mask)
+            if key in seen:
+                # same mask twice in one line; the second depends on what
+                # the first does, which only the database will know
+                return None
+            seen.add(key)
+            existing_ids.append(
+                self.active_bans.find(channel_name, type, mask)
+            )
+        return existing_ids
+
+    async def _check_cache(self, channel_name: str):
+        active = await DB.get_active(self.name, channel_name)
+        for diff in self.active_bans.verify(channel_name, active):
+            LOG.error(
+                f"active ban cache mismatch for {channel_name}: {diff}",
+                self.name
+            )
 
     def _has_permission(self,
             ban_id: int,
@@ -162,135 +360,200 @@ class Server(BaseServer):
                 return True
         return False
 
-    def _channel_masks(self,
-            users:   List[User],
-            extbans: List[str]
-            ) -> Iterable[Tuple[str, User]]:
-        for user in users:
-            # XXX or is for fixing an ircstates incorrect return hint
-            yield (user.hostmask() or "", user)
-
-            vars = {
-                "account":  user.account or "",
-                "hostmask": user.hostmask(),
-                "realname": user.realname
-            }
-            for extban in extbans:
-                formatted = extban.format(**vars)
-                yield (formatted, user)
+    def _user_masks(self, user: User) -> List[str]:
+        tuser = cast(TrackerUser, user)
+        return tuser.masks(self.network.extbans, self.mask_cache)
+
+    def _index_user(self, user: User):
+        if user.nickname_lower == self.nickname_lower:
+            return
+
+        masks = self._user_masks(user)
+        for channel_name in user.channels:
+            if channel_name in self._mask_indexes:
+                index = self._mask_indexes[channel_name]
+                index.add(user.nickname_lower, masks)
+
+    def _index_channel(self, channel: Channel):
+        if not channel.name_lower in self._mask_indexes:
+            self._mask_indexes[channel.name_lower] = MaskIndex()
+        index = self._mask_indexes[channel.name_lower]
+        index.clear()
+
+        for nickname in channel.users.keys():
+            if (not nickname == self.nickname_lower and
+                    nickname in self.users):
+                index.add(nickname, self._user_masks(self.users[nickname]))
+
+    def _update_indexes(self, line: Line):
+        # keep channel mask indexes in step with ircstates' view of users.
+        # this is called after ircstates has already processed `line`
+        if line.command in [RPL_ENDOFWHO, RPL_ENDOFNAMES]:
+            target = self.casefold(line.params[1])
+            if target in self.channels:
+                self._index_channel(self.channels[target])
+            elif target in self.users:
+                self._index_user(self.users[target])
+
+        elif line.source is None:
+            return
+
+        elif line.command == "NICK":
+            old_nick = self.casefold(line.hostmask.nickname)
+            for index in self._mask_indexes.values():
+                index.remove(old_nick)
+
+            new_nick = self.casefold(line.params[0])
+            if new_nick in self.users:
+                self._index_user(self.users[new_nick])
+
+        elif line.command in ["JOIN", "CHGHOST", "ACCOUNT", "SETNAME"]:
+            nickname = self.casefold(line.hostmask.nickname)
+            if nickname in self.users:
+                self._index_user(self.users[nickname])
+
+        elif line.command in ["PART", "KICK"]:
+            channel_name = self.casefold(line.params[0])
+            if line.command == "PART":
+                nickname = self.casefold(line.hostmask.nickname)
+            else:
+                nickname = self.casefold(line.params[1])
+
+            if nickname == self.nickname_lower:
+                self._mask_indexes.pop(channel_name, None)
+                self.active_bans.forget(channel_name)
+            elif channel_name in self._mask_indexes:
+                self._mask_indexes[channel_name].remove(nickname)
+
+        elif line.command == "QUIT":
+            nickname = self.casefold(line.hostmask.nickname)
+            for index in self._mask_indexes.values():
+                index.remove(nickname)
 
     async def line_read(self, line: Line):
+        start = monotonic()
+        try:
+            await PROFILE.dispatch(line, self._line_read)
+        finally:
+            LINE_SECONDS.labels(line.command).observe(monotonic()-start)
+
+    async def _line_read(self, line: Line):
+        self._update_indexes(line)
+
         if line.command == RPL_WELCOME:
+            # self.outbound does our throttling
+            self.set_throttle(100, 1)
+
             # we have successfully connected - join all our channels!
-            for i in range(0, len(CONFIG.channels), 10):
+            for i in range(0, len(self.network.channels), 10):
                 # (split our JOINs in to groups of 10)
-                channel_str = ",".join(CONFIG.channels[i:i+10])
+                channel_str = ",".join(self.network.channels[i:i+10])
                 await self.send(build("JOIN", [channel_str]))
 
-        elif line.command == "PONG" and line.params[-1] == "expirecheck":
-            await self._check_expires()
-
         elif (line.command == "JOIN" and
                 self.is_me(line.hostmask.nickname)):
-            channel = self.channels[self.casefold(line.params[0])]
-
-            tracked_masks = DB.get_active(channel.name_lower)
+            # reconcile what we've tracked with the channel's ban lists once
+            # they've arrived. this doesn't wait for them
+            self._start_resync(self.casefold(line.params[0]))
+            await self._next_resyncs()
 
-            mode_query = "b" + (CONFIG.quiet or "")
-            current_masks = list(await self._mode_list(
-                channel.name_lower, mode_query
-            ))
-
-            tracked_masks_set = set((m[1], m[2]) for m in tracked_masks)
-            current_masks_set = set((m[0], m[1]) for m in current_masks)
-
-            now = int(pendulum.now("utc").timestamp())
-
-            # which bans/quiets were removed while we weren't watching
-            for ban_id, type, mask in tracked_masks:
-                if not (type, mask) in current_masks_set:
-                    DB.set_removed(ban_id, None, now)
-            # which bans/quiets were added while we weren't watching
-            for type, mask, set_by, set_at in current_masks:
-                if not (type, mask) in tracked_masks_set:
-                    DB.add(channel.name_lower, type, mask, set_by, set_at)
+        elif line.command in [
+                RPL_BANLIST, RPL_ENDOFBANLIST,
+                RPL_QUIETLIST, RPL_ENDOFQUIETLIST]:
+            await self._resync_line(line)
 
         elif (line.command == "MODE" and
                 line.source is not None and
                 self.has_channel(line.params[0])):
-            channel = self.channels[self.casefold(line.params[0])]
+            mode_read = monotonic()
+            channel   = self.channels[self.casefold(line.params[0])]
 
             args = line.params[2:]
-            modes: List[Tuple[str, str]] = []
+            changes: List[Tuple[bool, int, str]] = []
             modifier = "+"
 
             watch_modes = "b"
-            if CONFIG.quiet is not None:
-                watch_modes += CONFIG.quiet
+            if self.network.quiet is not None:
+                watch_modes += self.network.quiet
 
             # tokenise out the MODE change....
             for c in str(line.params[1]):
                 if c in ["+", "-"]:
                     modifier = c
                 elif c in watch_modes and args:
-                    modes.append((f"{modifier}{c}", args.pop(0)))
+                    type = Types.BAN if c == "b" else Types.QUIET
+                    changes.append((modifier == "+", type, args.pop(0)))
 
+            # every change in this MODE line is written as one transaction
             now = int(pendulum.now("utc").timestamp())
-            maybe_enforce: List[Tuple[int, int, Glob]] = []
-            for mode, arg in modes:
-                type = Types.BAN if mode[1] == "b" else Types.QUIET
-                # this could be a +b or a -b for an existing mask.
-                # either way, we want to expire previous instances of it
-                existing_ban_id = DB.find(channel.name_lower, type, arg)
-                if existing_ban_id is not None:
-                    DB.set_removed(existing_ban_id, line.source, now)
-
-                if mode[0] == "+":
-                    # a new ban or quiet! lets track it
-                    ban_id = DB.add(
-                        channel.name_lower, type, arg, line.source, now
-                    )
-                    await self._notify(
-                        channel.name, line.hostmask.nickname, ban_id
-                    )
-
-                    compiled = glob_compile(arg)
-                    maybe_enforce.append((type, ban_id, compiled))
+            removed, added = await DB.apply_changes(
+                self.name,
+                channel.name_lower,
+                changes,
+                line.source,
+                now,
+                self._existing_ids(channel.name_lower, changes)
+            )
+            for ban_id in removed:
+                EXPIRY.cancel(ban_id)
+                self.active_bans.remove(ban_id)
+
+            if self.active_bans.hydrated(channel.name_lower):
+                added_changes = [c for c in changes if c[0]]
+                for (_, type, arg), ban_id in zip(added_changes, added):
+                    self.active_bans.add(channel.name_lower, ban_id, type, arg)
+                if CONFIG.cache_check:
+                    await self._check_cache(channel.name_lower)
+
+            # new bans or quiets! we're now tracking them
+            maybe_enforce: List[Tuple[int, int, str, Glob]] = []
+            added_changes = [c for c in changes if c[0]]
+            for (_, type, arg), ban_id in zip(added_changes, added):
+                compiled = glob_compile(arg)
+                maybe_enforce.append((type, ban_id, arg, compiled))
+
+            for _, ban_id, _, _ in maybe_enforce:
+                await self._notify(
+                    channel.name, line.hostmask.nickname, ban_id
+                )
 
             # whether or not to remove people affected by new bans
-            c_enforce = CHAN_CONFIGS.get(channel.name_lower)
-            if maybe_enforce and (
-                    (c_enforce is None and CONFIG.enforce) or c_enforce):
-
-                # all nicks in a channel
-                nicks = list(channel.users.keys())
-                # (except for me)
-                nicks.remove(self.nickname_lower)
-                # get all users and all their hostmasks (and extbans!)
-                users = [self.users[n] for n in nicks]
-                user_masks = self._channel_masks(users, CONFIG.extbans)
-
-                kicks:    List[Tuple[User, int]] = []
-                devoices: List[User] = []
-                # compile mask and test against each user
-                for user_mask, user in user_masks:
-                    cuser = channel.users[user.nickname_lower]
-                    for type, ban_id, compiled in maybe_enforce:
-                        if compiled.match(user_mask):
-                            if (type == Types.BAN and
-                                    not cuser.modes):
-                                kicks.append((user, ban_id))
-                            elif (type == Types.QUIET and
-                                    cuser.modes == ["v"]):
-                                devoices.append(user)
+            c_enforce = self.chan_configs.get(channel.name_lower).enforce
+            if c_enforce is None:
+                c_enforce = self.network.enforce
+            if maybe_enforce and c_enforce:
+
+                if not channel.name_lower in self._mask_indexes:
+                    self._index_channel(channel)
+                index = self._mask_indexes[channel.name_lower]
+
+                kicks:    Dict[str, Tuple[User, int]] = {}
+                devoices: Dict[str, User] = {}
+                # only users that a ban's literal parts could match are
+                # glob matched against it
+                for type, ban_id, mask, compiled in maybe_enforce:
+                    for nickname in index.match(mask, compiled):
+                        if not (nickname in channel.users and
+                                nickname in self.users):
+                            continue
+                        user  = self.users[nickname]
+                        cuser = channel.users[nickname]
+
+                        if (type == Types.BAN and
+                                not cuser.modes and
+                                not nickname in kicks):
+                            kicks[nickname] = (user, ban_id)
+                        elif (type == Types.QUIET and
+                                cuser.modes == ["v"]):
+                            devoices[nickname] = user
 
                 if kicks or devoices:
                     remove_op = False
-                    if CONFIG.chanserv:
+                    if self.network.chanserv:
                         remove_op = await self._assure_op(channel)
 
                     # non-status users covered by a new ban
-                    for user, ban_id in kicks:
+                    for user, ban_id in kicks.values():
                         reason = ENFORCE_REASON.format(id=ban_id)
                         await self.send(build(
                             "KICK", [channel.name, user.nickname, reason]
@@ -299,7 +562,7 @@ class Server(BaseServer):
                     # +v users covered by a new quiet
                     rem_modes = ""
                     rem_args: List[str] = []
-                    for user in devoices:
+                    for user in devoices.values():
                         rem_modes += "v"
                         rem_args.append(user.nickname)
 
@@ -307,156 +570,378 @@ class Server(BaseServer):
                         channel, rem_modes, rem_args, remove_op
                     )
 
+                    ENFORCED.labels("kick").inc(len(kicks))
+                    ENFORCED.labels("devoice").inc(len(devoices))
+                    ENFORCE_SECONDS.observe(monotonic()-mode_read)
+
         elif (line.command == "PRIVMSG" and
                 line.source is not None):
-            trigger = CONFIG.trigger
-            if self.is_channel(line.params[0]):
-                chan_config = CHAN_CONFIGS.get(self.casefold(line.params[0]))
-                if chan_config.trigger is not None:
-                    trigger = chan_config.trigger
-
-            message = line.params[1]
-            command, _, message = message.partition(" ")
-            command = command.lower()
-
-            if command == f"{trigger}set":
-                target = self.casefold(line.params[0])
-                if not target in self.channels:
-                    # this command must be used in-channel
-                    raise Exception()
-
-                channel  = self.channels[target]
-                nickname = self.casefold(line.hostmask.nickname)
-                cuser    = channel.users[nickname]
-                if not "o" in cuser.modes:
-                    # you do not have permission to do this
-                    raise Exception()
+            routed = self._commands.route(line.params[0], line.params[1])
+            if routed is not None:
+                handler, args = routed
+                try:
+                    await handler(self, line, args)
+                except CommandError as e:
+                    await self.send(build(
+                        "NOTICE", [line.hostmask.nickname, str(e)]
+                    ))
+
+    @COMMANDS.command("set")
+    async def _cmd_set(self, line: Line, message: str):
+        target = self.casefold(line.params[0])
+        if not target in self.channels:
+            raise CommandError("This command must be used in-channel")
+
+        channel  = self.channels[target]
+        nickname = self.casefold(line.hostmask.nickname)
+        cuser    = channel.users.get(nickname)
+        if cuser is None or not "o" in cuser.modes:
+            raise CommandError("You do not have permission to do this")
+
+        key, _, value = message.strip().partition(" ")
+        if not key or not value:
+            raise CommandError("Please provide a key and value")
+
+        chan_config = self.chan_configs.get(target)
+        try:
+            set_value = chan_config.set(key, value)
+        except KeyError:
+            raise CommandError(f"Unknown setting '{key}'")
+
+        self.chan_configs.set(target)
+        out = f"Set {key} '{set_value}' for {channel.name}"
+        await self.send(build("NOTICE", [line.hostmask.nickname, out]))
+
+    @COMMANDS.command("comment")
+    async def _cmd_comment(self, line: Line, message: str):
+        ban_id_s, _, message = message.partition(" ")
+        ban_id = -1
+        if ban_id_s == "^" and self.is_channel(line.params[0]):
+            channel_name = self.casefold(line.params[0])
+            if self.active_bans.hydrated(channel_name):
+                last_ban_id = self.active_bans.last(channel_name)
+            else:
+                last_ban_id = await DB.get_last(self.name, channel_name)
+            if last_ban_id is None:
+                raise CommandError(f"No last ban for {line.params[0]}")
+            ban_id = last_ban_id
+        elif not ban_id_s.isdigit():
+            raise CommandError("Please provide a numeric ban id")
+        else:
+            ban_id = int(ban_id_s)
 
-                key, _, value = message.strip().partition(" ")
-                if not key and value:
-                    # please provide a key and value
-                    raise Exception()
+        ban = await DB.get_ban(ban_id)
+        # (bans on other networks are none of this one's business)
+        if ban is None or not ban[7] == self.name:
+            raise CommandError(f"Ban {ban_id} does not exist")
+        ban_channel, type, mask, set_by, *_ = ban
 
-                chan_config = CHAN_CONFIGS.get(target)
-                try:
-                    set_value = chan_config.set(key, value)
-                except KeyError:
-                    # unknown setting
-                    raise Exception()
-
-                CHAN_CONFIGS.set(target)
-                out = f"Set {key} '{set_value}' for {channel.name}"
-                await self.send(build("NOTICE", [line.hostmask.nickname, out]))
-
-            elif command == f"{trigger}comment":
-                ban_id_s, _, message = message.partition(" ")
-                ban_id = -1
-                if ban_id_s == "^" and self.is_channel(line.params[0]):
-                    channel_name = self.casefold(line.params[0])
-                    last_ban_id = DB.get_last(channel_name)
-                    if last_ban_id is None:
-                        # no last ban id for channel
-                        raise Exception()
-                    ban_id = last_ban_id
-                elif not ban_id_s.isdigit():
-                    # please provide a numeric ban id
-                    raise Exception()
-                else:
-                    ban_id = int(ban_id_s)
-
-                    if not DB.ban_exists(ban_id):
-                        # ban does not exist
-                        raise Exception()
-
-                ban_channel, type, mask, set_by, *_ = DB.get_ban(ban_id)
-
-                if not self._has_permission(ban_id, set_by, ban_channel, line):
-                    # you do not have permission to do this
-                    raise Exception()
-
-                if not message.strip():
-                    # please provide duration or reason or both
-                    raise Exception()
-
-                duration = -1
-                if message[0] == "+":
-                    duration_s, _, message = message[1:].partition(" ")
-                    maybe_duration = from_pretty_time(duration_s)
-                    if maybe_duration is None:
-                        # invalid duration provided
-                        raise Exception()
-                    duration = maybe_duration
-                reason = message.strip()
-
-                now = int(pendulum.now("utc").timestamp())
-
-                outs: List[str] = []
-                if len(reason):
-                    DB.reasons.set(ban_id, line.source, now, reason)
-                    outs.append("reason")
-                if duration > -1:
-                    DB.expirations.set(ban_id, line.source, now, duration)
-                    outs.append("duration")
-
-                out = " and ".join(outs)
-                type_s = Types(type).name.lower()
-                out = f"Set {out} for {type_s} {ban_id} ({mask})"
-                await self.send(build("NOTICE", [line.hostmask.nickname, out]))
+        if not self._has_permission(ban_id, set_by, ban_channel, line):
+            raise CommandError("You do not have permission to do this")
+
+        if not message.strip():
+            raise CommandError("Please provide a duration, a reason or both")
+
+        duration = -1
+        if message[0] == "+":
+            duration_s, _, message = message[1:].partition(" ")
+            maybe_duration = from_pretty_time(duration_s)
+            if maybe_duration is None:
+                raise CommandError(f"Invalid duration '{duration_s}'")
+            duration = maybe_duration
+        reason = message.strip()
+
+        now = int(pendulum.now("utc").timestamp())
+
+        outs: List[str] = []
+        if len(reason):
+            outs.append("reason")
+        if duration > -1:
+            outs.append("duration")
+        expire = await DB.set_comment(
+            ban_id,
+            line.source,
+            now,
+            reason or None,
+            duration if duration > -1 else None
+        )
+        # (a removed ban has nothing left to expire)
+        if expire is not None and ban[6] is None:
+            EXPIRY.schedule(ban_id, expire, self.name)
+
+        out = " and ".join(outs)
+        type_s = Types(type).name.lower()
+        out = f"Set {out} for {type_s} {ban_id} ({mask})"
+        await self.send(build("NOTICE", [line.hostmask.nickname, out]))
+
+    @COMMANDS.command("profile")
+    async def _cmd_profile(self, line: Line, message: str):
+        if not any(glob_compile(m).match(line.source) for m in CONFIG.admins):
+            raise CommandError("You do not have permission to do this")
+
+        subcommand = message.strip().lower()
+        if subcommand in ["start", "stop"]:
+            if (subcommand == "start") == PROFILE.running:
+                raise CommandError(f"Profiling is already {subcommand}ed")
+            outs = [PROFILE.toggle()]
+        elif subcommand == "status" and PROFILE.running:
+            outs = PROFILE.summary() or ["Nothing profiled yet"]
+        elif subcommand == "status":
+            outs = ["Not profiling"]
+        else:
+            raise CommandError("Please provide start, stop or status")
+
+        for out in outs:
+            await self.send(build("NOTICE", [line.hostmask.nickname, out]))
 
     async def _notify(self, channel: str, set_by: str, ban_id: int):
         out = f"Ban {ban_id} added for {channel}"
         await self.send(build("NOTICE", [set_by, out]))
 
     def line_preread(self, line: Line):
-        print(f"{self.name} < {line.format()}")
+        LOG.line(self.name, "<", line)
     def line_presend(self, line: Line):
-        print(f"{self.name} > {line.format()}")
+        LOG.line(self.name, ">", line)
 
 class Bot(BaseBot):
     def create_server(self, name: str):
         return Server(self, name)
 
-async def main(
-        params: ConnectionParams,
-        config: BotConfig):
-    bot = Bot()
-    await bot.add_server(params.host, params)
+    async def disconnected(self, server: IServer):
+        # fail whatever's still queued to send; it never will be
+        cast(Server, server).outbound.close()
+        # don't reconnect a network a reload has removed, or replaced
+        if self.servers.get(server.name) is server:
+            await super().disconnected(server)
+
+def _register_metrics(bot: Bot):
+    # stats we already keep, read when we're scraped
+    def _servers() -> List[Server]:
+        return cast(List[Server], list(bot.servers.values()))
+
+    REGISTRY.callback(
+        "bantracker_mask_cache_total",
+        "Enforcement mask cache lookups",
+        "counter", ["server", "result"],
+        lambda: [
+            s for server in _servers() for s in [
+                ((server.name, "hit"),  server.mask_cache.hits),
+                ((server.name, "miss"), server.mask_cache.misses)
+            ]
+        ]
+    )
+    for name, attr, kind, help in [
+            ("sent_total",      "sent",        "counter", "Lines sent"),
+            ("coalesced_total", "coalesced",   "counter",
+                "Lines folded in to already queued lines"),
+            ("latency_seconds_total", "latency", "counter",
+                "Seconds lines spent queued"),
+            ("latency_max_seconds",   "latency_max", "gauge",
+                "Most seconds a line spent queued")]:
+        REGISTRY.callback(
+            f"bantracker_outbound_{name}",
+            f"{help}, by outbound lane",
+            kind, ["server", "lane"],
+            lambda attr=attr: [
+                ((server.name, lane.name.lower()), getattr(stats, attr))
+                for server in _servers()
+                for lane, stats in server.outbound.stats.items()
+            ]
+        )
+    REGISTRY.callback(
+        "bantracker_outbound_depth",
+        "Lines waiting in each outbound lane",
+        "gauge", ["server", "lane"],
+        lambda: [
+            ((server.name, lane.name.lower()), depth)
+            for server in _servers()
+            for lane, depth in server.outbound.depth().items()
+        ]
+    )
+    REGISTRY.callback(
+        "bantracker_resync_seconds",
+        "How long each channel's last ban list resync took",
+        "gauge", ["server", "channel"],
+        lambda: [
+            ((server.name, channel), took)
+            for server in _servers()
+            for channel, took in server.resync_timings.items()
+        ]
+    )
+    REGISTRY.callback(
+        "bantracker_expiries_scheduled",
+        "Active bans with an expiry still to come",
+        "gauge", [],
+        lambda: [((), len(EXPIRY))]
+    )
+
+def _chan_config_dir(config: BotConfig, network: str) -> str:
+    # (the default network's are where they were before we had networks)
+    if network == config.default_network:
+        return os.path.join(config.data, "channels")
+    return os.path.join(config.data, "channels", network)
+
+async def _add_network(bot: Bot, network: NetworkConfig):
+    CHAN_CONFIGS[network.name] = ChannelConfigs(
+        _chan_config_dir(CONFIG, network.name), LOG
+    )
+    # (ircrobots changes params as it goes, e.g. for STS, and we want to
+    # compare ours with the config file's on reload)
+    await bot.add_server(network.name, replace(network.params))
+
+async def _remove_network(bot: Bot, name: str):
+    server = cast(Optional[Server], bot.servers.get(name))
+    if server is not None:
+        try:
+            await asyncio.wait_for(
+                server.send(build("QUIT", ["Network removed"])), QUIT_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            pass
+        await bot.disconnect(server)
+    CHAN_CONFIGS.pop(name, None)
+
+async def _reload(bot: Bot, config_path: str):
+    # only networks come and go; everything else needs a restart
+    global CONFIG
+    try:
+        config = _read_config(config_path)
+    except Exception as e:
+        LOG.error(f"failed to reload {config_path}: {e!r}")
+        return
+
+    old = CONFIG.networks
+    new = config.networks
+    CONFIG = replace(CONFIG, networks=new)
+
+    for name in old.keys()-new.keys():
+        LOG.info(f"removing network {name}")
+        await _remove_network(bot, name)
+    for name in sorted(new.keys()):
+        if name in old and old[name] == new[name]:
+            continue
+        elif name in old:
+            LOG.info(f"reconnecting changed network {name}")
+            await _remove_network(bot, name)
+        else:
+            LOG.info(f"adding network {name}")
+        try:
+            await _add_network(bot, new[name])
+        except Exception as e:
+            # (ircrobots only retries servers that connected once)
+            bot.servers.pop(name, None)
+            LOG.error(f"failed to connect to {name}: {e!r}")
 
+async def main(
+        config:      BotConfig,
+        config_path: str):
     global CONFIG
     CONFIG = config
 
+    global LOG
+    LOG = LineLog.from_config("bantracker", config.log)
+
     global CHAN_CONFIGS
-    chan_config_dir = os.path.join(config.data, "channels")
-    CHAN_CONFIGS    = ChannelConfigs(chan_config_dir)
+    CHAN_CONFIGS = {}
 
     global DB
     db_file = os.path.join(config.data, "bantracker.db")
-    DB      = BanDatabase(db_file)
+    DB      = AsyncBanDatabase(db_file, log=LOG)
+    if config.default_network is not None:
+        claimed = await DB.claim_network(config.default_network)
+        if claimed:
+            LOG.info(f"{claimed} bans now belong to {config.default_network}")
+
+    global PROFILE
+    PROFILE = LineProfiler("bantracker", os.path.join(config.data, "profiles"))
+    # `kill -USR1` starts profiling, and then stops it and writes it out
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGUSR1, lambda: LOG.info(PROFILE.toggle())
+    )
+
+    global EXPIRY
+    EXPIRY = ExpiryScheduler()
+    for ban_id, expire, network in await DB.get_expiring():
+        EXPIRY.schedule(ban_id, expire, network)
+
+    # (servers read CONFIG et al. from the moment they're created)
+    bot = Bot()
+
+    if config.http is not None:
+        def _casefold(network: Optional[str], name: str) -> str:
+            # the network's casemapping, if we're connected to it
+            server = bot.servers.get(network or "")
+            if server is not None:
+                return server.casefold(name)
+            return casefold(CaseMap.RFC1459, name)
+
+        http_host, _, http_port = config.http.rpartition(":")
+        await HistoryAPI(DB, _casefold).start(
+            http_host or "127.0.0.1", int(http_port)
+        )
+
+    for network in config.networks.values():
+        await _add_network(bot, network)
+    # `kill -HUP` adds, removes and reconnects networks per the config file
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGHUP, lambda: asyncio.create_task(_reload(bot, config_path))
+    )
+
+    async def _expire_network(
+            network: str,
+            expired: List[int],
+            due:     int):
+        sent:        Set[int] = set()
+        unremovable: Set[int] = set()
+        server = cast(Optional[Server], bot.servers.get(network))
+        if server is not None:
+            try:
+                await asyncio.wait_for(
+                    server._check_expires(sent, unremovable), EXPIRE_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                LOG.warning("timed out expiring bans", network)
+            except Exception:
+                traceback.print_exc()
+
+        # whatever's left is for channels (or networks) we're not in (yet),
+        # unless it's been removed since
+        unsent = [ban_id for ban_id in expired if not ban_id in sent]
+        active = set(await DB.find_active(unsent))
+        retry  = int(pendulum.now("utc").timestamp())+EXPIRE_RETRY
+        for ban_id in unsent:
+            if ban_id in active:
+                EXPIRY.schedule(ban_id, retry, network)
+        # if the server doesn't take a removal, it's sent again. we stop
+        # waiting to see if it did when we see the ban removed
+        resend = int(pendulum.now("utc").timestamp())+EXPIRE_RESEND
+        for ban_id in sent-unremovable:
+            EXPIRY.schedule(ban_id, resend, network)
+        if sent:
+            EXPIRY_LAG.observe(time.time()-due)
 
     async def _expire_timer():
         while True:
-            now = pendulum.now("utc")
-            until_minute = 60-now.second
-            await asyncio.sleep(until_minute)
-
-            if bot.servers:
-                server = bot.servers[params.host]
-                await server.send(build("PING", ["expirecheck"]))
+            expired = await EXPIRY.wait()
+            due     = EXPIRY.due
+            # (one network waiting on ChanServ doesn't hold up the others)
+            await asyncio.gather(*(
+                _expire_network(network, ban_ids, due)
+                for network, ban_ids in expired.items()
+            ))
     asyncio.create_task(_expire_timer())
 
-    await bot.run()
-
-def _main():
-    parser = ArgumentParser(description="An IRC ban tracking bot")
-    parser.add_argument("config")
-    args = parser.parse_args()
+    _register_metrics(bot)
+    if config.metrics is not None:
+        await metrics.serve(config.metrics)
 
-    # read out the config file
-    config_obj = ConfigParser()
-    config_obj.read(args.config)
-    config = dict(config_obj["bot"])
+    await bot.run()
 
-    host, _, port_str   = config["host"].partition(":")
+def _network(
+        name:    str,
+        section: Mapping[str, str]
+        ) -> NetworkConfig:
+    host, _, port_str   = section["host"].partition(":")
     tls  = True
     port = 6697
     if port_str:
@@ -464,37 +949,77 @@ def _main():
         port = int(port)
         tls  = bool(tls_symbol)
 
-    tls_verify = config.get("tls_verify", "yes") == "yes"
-    bindhost   = config.get("bind", None)
+    tls_verify = section.get("tls_verify", "yes") == "yes"
+    bindhost   = section.get("bind", None)
 
     params = ConnectionParams(
-        config["nick"],
+        section["nick"],
         host,
         port,
         tls,
         tls_verify = tls_verify,
         bindhost   = bindhost
     )
-    if "sasl" in config:
-        sasl_user, _, sasl_pass = config["sasl"].partition(":")
+    if "sasl" in section:
+        sasl_user, _, sasl_pass = section["sasl"].partition(":")
         params.sasl = SASLUserPass(sasl_user, sasl_pass)
 
+    extbans_s = section.get("extbans", "")
+    extbans_l = [e.strip() for e in extbans_s.split(",")]
+    extbans = list(filter(bool, extbans_l))
+    return NetworkConfig(
+        name,
+        params,
+        [c.strip() for c in section["channels"].split(",")],
+        section.get("chanserv", "no") == "yes",
+        section.get("enforce", "no") == "yes",
+        extbans,
+        section.get("trigger", "!"),
+        section.get("quiet", None)
+    )
+
+def _read_config(path: str) -> BotConfig:
+    config_obj = ConfigParser()
+    if not config_obj.read(path):
+        raise FileNotFoundError(path)
+    config = dict(config_obj["bot"])
+
     data = os.path.expanduser(config["data"])
     if not os.path.isdir(data):
         os.makedirs(data)
 
-    extbans_s = config.get("extbans", "")
-    extbans_l = [e.strip() for e in extbans_s.split(",")]
-    extbans = list(filter(bool, extbans_l))
-    # grab db filename and list of channels to join
-    bot_config = BotConfig(
+    # [bot] is a network of its own if it says where to connect, and every
+    # [network:name] is one too. networks default to [bot]'s settings
+    networks: Dict[str, NetworkConfig] = {}
+    default_network: Optional[str] = None
+    if "host" in config:
+        default_network = config.get(
+            "network", config["host"].partition(":")[0]
+        )
+        networks[default_network] = _network(default_network, config)
+    for section_name in config_obj.sections():
+        if section_name.startswith("network:"):
+            name = section_name.split(":", 1)[1]
+            networks[name] = _network(
+                name, {**config, **config_obj[section_name]}
+            )
+
+    return BotConfig(
         data,
-        [c.strip() for c in config["channels"].split(",")],
-        config.get("chanserv", "no") == "yes",
-        config.get("enforce", "no") == "yes",
-        extbans,
-        config.get("trigger", "!"),
-        config.get("quiet", None)
+        networks,
+        default_network,
+        int(config.get("flood_burst", "5")),
+        float(config.get("flood_rate", "1")),
+        config.get("cache_check", "no") == "yes",
+        config.get("http", None),
+        config.get("metrics", None),
+        dict(config_obj["log"]) if "log" in config_obj else {},
+        [a.strip() for a in config.get("admins", "").split(",") if a.strip()]
     )
 
-    asyncio.run(main(params, bot_config))
+def _main():
+    parser = ArgumentParser(description="An IRC ban tracking bot")
+    parser.add_argument("config")
+    args = parser.parse_args()
+
+    asyncio.run(main(_read_config(args.config), args.config))
@@ -1,3 +1,8 @@
-from . import _main
+import sys
+
+if sys.argv[1:2] in [["import"], ["export"]]:
+    from .bulk import _main
+else:
+    from . import _main
 
 _main()
@@ -0,0 +1,149 @@
+import asyncio, json, traceback
+from typing       import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qsl, urlsplit
+
+from .bulk          import TYPE_NAMES
+from .database      import HISTORY_FIELDS
+from .database.aio  import AsyncBanDatabase
+
+LIMIT_DEFAULT = 100
+LIMIT_MAX     = 1000
+# how long a client gets to send us its request
+REQUEST_TIMEOUT = 10.0
+
+STATUSES = {
+    200: "OK",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error"
+}
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+
+def _ban(row: Tuple[Any, ...]) -> Dict[str, Any]:
+    ban = dict(zip(HISTORY_FIELDS, row))
+    ban["type"] = TYPE_NAMES.get(ban["type"], ban["type"])
+    return ban
+
+def _int(query: Dict[str, str], key: str) -> Optional[int]:
+    if not key in query:
+        return None
+    elif not query[key].isdigit():
+        raise HTTPError(400, f"{key} must be an integer")
+    return int(query[key])
+
+class HistoryAPI(object):
+    # read-only JSON over HTTP, on the bot's own event loop, for ban history
+    #   GET /bans?network=&channel=&set_by=&mask=&since=&until=&before=
+    #       &limit=
+    #   GET /bans/<ban_id>
+    def __init__(self,
+            db:       AsyncBanDatabase,
+            casefold: Callable[[Optional[str], str], str]):
+        self._db = db
+        # (network, name): name as it's stored for that network
+        self._casefold = casefold
+
+    async def start(self, host: str, port: int) -> asyncio.AbstractServer:
+        return await asyncio.start_server(self._client, host, port)
+
+    async def _find_bans(self, query: Dict[str, str]) -> Dict[str, Any]:
+        limit   = _int(query, "limit") or LIMIT_DEFAULT
+        network = query.get("network")
+        channel = query.get("channel")
+        if channel is not None:
+            channel = self._casefold(network, channel)
+        rows    = await self._db.history(
+            network,
+            channel,
+            query.get("set_by"),
+            query.get("mask"),
+            _int(query, "since"),
+            _int(query, "until"),
+            _int(query, "before"),
+            min(limit, LIMIT_MAX)
+        )
+        bans = [_ban(row) for row in rows]
+
+        # keyset pagination; `before` for the next page, if there is one
+        next: Optional[int] = None
+        if len(bans) == min(limit, LIMIT_MAX):
+            next = bans[-1]["ban_id"]
+        return {"bans": bans, "next": next}
+
+    async def _get_ban(self, ban_id: int) -> Dict[str, Any]:
+        history = await self._db.get_ban_history(ban_id)
+        if history is None:
+            raise HTTPError(404, f"no such ban {ban_id}")
+
+        ban, reasons, expirations = history
+        out = _ban((ban_id,)+tuple(ban[:7]))
+        out["network"] = ban[7]
+        out["reasons"] = [
+            {"reason": r, "set_by": by, "set_at": at}
+            for r, by, at in reasons
+        ]
+        out["expirations"] = [
+            {"expire": e, "set_by": by, "set_at": at}
+            for e, by, at in expirations
+        ]
+        return out
+
+    async def _route(self, method: str, target: str) -> Dict[str, Any]:
+        if not method == "GET":
+            raise HTTPError(405, f"{method} not allowed")
+
+        url   = urlsplit(target)
+        query = dict(parse_qsl(url.query))
+        parts = [p for p in url.path.split("/") if p]
+        if parts == ["bans"]:
+            return await self._find_bans(query)
+        elif len(parts) == 2 and parts[0] == "bans" and parts[1].isdigit():
+            return await self._get_ban(int(parts[1]))
+        raise HTTPError(404, f"no such path {url.path}")
+
+    async def _client(self,
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter):
+        status = 200
+        try:
+            try:
+                request = await asyncio.wait_for(
+                    self._request(reader), REQUEST_TIMEOUT
+                )
+            except (asyncio.TimeoutError, ValueError):
+                raise HTTPError(400, "bad request")
+            body = await self._route(*request)
+        except HTTPError as e:
+            status = e.status
+            body   = {"error": str(e)}
+        except Exception:
+            traceback.print_exc()
+            status = 500
+            body   = {"error": "internal error"}
+
+        data = json.dumps(body).encode("utf8")
+        writer.write((
+            f"HTTP/1.1 {status} {STATUSES[status]}\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n"
+            "\r\n"
+        ).encode("ascii")+data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    async def _request(self, reader: asyncio.StreamReader) -> List[str]:
+        request_line = (await reader.readline()).decode("latin-1")
+        method, target, _ = request_line.split(" ", 2)
+        # we've no use for headers, but they've still got to be read
+        while (await reader.readline()).strip():
+            pass
+        return [method, target]
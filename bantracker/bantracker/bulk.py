@@ -0,0 +1,162 @@
+import csv, json, os.path, sys, time
+from argparse     import ArgumentParser
+from configparser import ConfigParser
+from typing       import Any, Dict, IO, Iterator, List, Optional, Tuple
+
+from irctoolkit.log import LineLog
+
+from .database import BanDatabase, HISTORY_FIELDS as FIELDS
+
+INT_FIELDS = {
+    "ban_id", "set_at", "removed_at", "reason_set_at", "expire",
+    "expire_set_at"
+}
+TYPES = {"ban": 1, "quiet": 2}
+TYPE_NAMES = {v: k for k, v in TYPES.items()}
+
+CHUNK_SIZE = 50_000
+
+class BulkError(Exception):
+    pass
+
+def _format(path: str, format: Optional[str]) -> str:
+    if format is not None:
+        return format
+    elif path.endswith(".csv"):
+        return "csv"
+    return "jsonl"
+
+def _records(fd: IO[str], format: str) -> Iterator[Dict[str, Any]]:
+    if format == "csv":
+        for record in csv.DictReader(fd):
+            # csv has no null
+            yield {k: (v if v != "" else None) for k, v in record.items()}
+    else:
+        for line in fd:
+            if line.strip():
+                yield json.loads(line)
+
+def _row(record: Dict[str, Any]) -> Tuple[Any, ...]:
+    out: List[Any] = []
+    for field in FIELDS[1:]:
+        value = record.get(field)
+        if value is not None and field in INT_FIELDS:
+            value = int(value)
+        out.append(value)
+
+    channel, type, mask, set_by, set_at = out[:5]
+    if channel is None or mask is None or set_at is None:
+        raise ValueError("channel, mask and set_at are required")
+
+    if isinstance(type, str) and type.lower() in TYPES:
+        out[1] = TYPES[type.lower()]
+    elif type is None:
+        out[1] = TYPES["ban"]
+    else:
+        out[1] = int(type)
+    if set_by is None:
+        out[3] = ""
+
+    # a reason or expiry without a setter was set by whoever set the ban
+    if out[7] is not None:
+        out[8] = out[8] or out[3]
+        out[9] = out[9] or out[4]
+    if out[10] is not None:
+        out[11] = out[11] or out[3]
+        out[12] = out[12] or out[4]
+    return tuple(out)
+
+def import_bans(
+        db:     BanDatabase,
+        fd:     IO[str],
+        format: str,
+        chunk_size: int=CHUNK_SIZE
+        ) -> int:
+    count = 0
+    chunk: List[Tuple[Any, ...]] = []
+    with db.deferred_indexes():
+        try:
+            for record in _records(fd, format):
+                chunk.append(_row(record))
+                if len(chunk) == chunk_size:
+                    db.import_bans(chunk)
+                    count += len(chunk)
+                    chunk.clear()
+        except (TypeError, ValueError) as e:
+            raise BulkError(f"record {count+len(chunk)+1}: {e}")
+        db.import_bans(chunk)
+        count += len(chunk)
+    return count
+
+def export_bans(
+        db:     BanDatabase,
+        fd:     IO[str],
+        format: str,
+        chunk_size: int=CHUNK_SIZE
+        ) -> int:
+    count  = 0
+    writer = None
+    if format == "csv":
+        writer = csv.writer(fd)
+        writer.writerow(FIELDS)
+
+    for rows in db.export_bans(chunk_size):
+        for row in rows:
+            row = list(row)
+            row[2] = TYPE_NAMES.get(row[2], row[2])
+            if writer is not None:
+                writer.writerow(row)
+            else:
+                fd.write(json.dumps(dict(zip(FIELDS, row)))+"\n")
+        count += len(rows)
+    return count
+
+def _main():
+    parser = ArgumentParser(
+        prog="python3 -m bantracker",
+        description="Bulk import/export of bantracker's ban history"
+    )
+    parser.add_argument("action", choices=["import", "export"])
+    parser.add_argument("config")
+    parser.add_argument("file", help="path, or - for stdin/stdout")
+    parser.add_argument("--format", choices=["jsonl", "csv"])
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    config_obj = ConfigParser()
+    config_obj.read(args.config)
+    data = os.path.expanduser(config_obj["bot"]["data"])
+    if not os.path.isdir(data):
+        os.makedirs(data)
+    # (without a file, LineLog writes to stdout, which we might export to)
+    log: Optional[LineLog] = None
+    if "log" in config_obj and "file" in config_obj["log"]:
+        log = LineLog.from_config("bantracker", dict(config_obj["log"]))
+    db = BanDatabase(os.path.join(data, "bantracker.db"), log=log)
+
+    format = _format(args.file, args.format)
+    start  = time.monotonic()
+    if args.action == "import":
+        fd = sys.stdin
+        if not args.file == "-":
+            fd = open(args.file, newline="")
+        try:
+            count = import_bans(db, fd, format, args.chunk)
+        except BulkError as e:
+            # chunks before the bad record have already been committed
+            sys.exit(f"import stopped at {e}")
+        finally:
+            fd.close()
+    else:
+        fd = sys.stdout
+        if not args.file == "-":
+            fd = open(args.file, "w", newline="")
+        count = export_bans(db, fd, format, args.chunk)
+        fd.flush()
+        if not fd is sys.stdout:
+            fd.close()
+
+    elapsed = time.monotonic()-start
+    rate    = count/elapsed if elapsed else 0.0
+    print(f"{args.action}ed {count} bans in {elapsed:.1f}s "
+        f"({rate:.0f} rows/s)", file=sys.stderr)
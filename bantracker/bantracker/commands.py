@@ -0,0 +1,75 @@
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from irctokens import Line
+
+from .config import ChannelConfigs
+
+# (server, line, args)
+CommandHandler = Callable[[Any, Line, str], Awaitable[None]]
+
+class CommandError(Exception):
+    # what went wrong, to be NOTICEd back to whoever sent the command
+    pass
+
+class CommandTable(object):
+    def __init__(self):
+        self._handlers: Dict[str, CommandHandler] = {}
+
+    def command(self, name: str) -> Callable[[CommandHandler], CommandHandler]:
+        def _decorator(func: CommandHandler) -> CommandHandler:
+            self._handlers[name] = func
+            return func
+        return _decorator
+
+    def get(self, name: str) -> Optional[CommandHandler]:
+        return self._handlers.get(name)
+
+class CommandRouter(object):
+    # which trigger each channel uses, and the first characters of every
+    # trigger in use, so that almost all channel chatter is turned away
+    # after looking at one character
+    def __init__(self,
+            table:    CommandTable,
+            configs:  ChannelConfigs,
+            default:  str,
+            casefold: Callable[[str], str]):
+        self._table    = table
+        self._configs  = configs
+        self._default  = default
+        self._casefold = casefold
+
+        self._triggers: Dict[str, str] = {}
+        self._firsts:   Set[str] = set()
+        self._generation = -1
+
+    def _rebuild(self):
+        self._triggers = {
+            channel: config.trigger
+            for channel, config in self._configs.items()
+            if config.trigger
+        }
+        self._firsts = {t[0] for t in self._triggers.values()}
+        if self._default:
+            self._firsts.add(self._default[0])
+        self._generation = self._configs.generation
+
+    def route(self,
+            target:  str,
+            message: str
+            ) -> Optional[Tuple[CommandHandler, str]]:
+        self._configs.check()
+        if not self._configs.generation == self._generation:
+            self._rebuild()
+
+        if not message or not message[0] in self._firsts:
+            return None
+
+        trigger = self._triggers.get(self._casefold(target), self._default)
+        if not message.startswith(trigger):
+            return None
+
+        command, _, args = message[len(trigger):].partition(" ")
+        handler = self._table.get(command.lower())
+        if handler is None:
+            return None
+        return handler, args
@@ -1,11 +1,20 @@
-import os
-from configparser import ConfigParser
-from dataclasses  import dataclass
-from typing       import Any, Dict, List, Optional
+import os, tempfile
+from configparser import ConfigParser, Error as ConfigParserError
+from dataclasses  import dataclass, field
+from time         import monotonic
+from typing       import Any, Dict, ItemsView, List, Optional
+
+from ircrobots import ConnectionParams
+
+from irctoolkit.log import LineLog
+
+# how often, at most, we look for channel config files edited under us
+CHECK_INTERVAL = 5.0
 
 @dataclass
-class BotConfig(object):
-    data:     str
+class NetworkConfig(object):
+    name:     str
+    params:   ConnectionParams
     channels: List[str]
     chanserv: bool
     enforce:  bool
@@ -13,6 +22,26 @@ class BotConfig(object):
     trigger:  str
     quiet:    Optional[str]
 
+@dataclass
+class BotConfig(object):
+    data:     str
+    networks: Dict[str, NetworkConfig]
+    # the network bans from before we tracked more than one belong to
+    default_network: Optional[str]
+    # how many lines we can send at once, and then how many per second
+    flood_burst: int   = 5
+    flood_rate:  float = 1.0
+    # check the active ban cache against the database after every change
+    cache_check: bool  = False
+    # host:port for the read-only history API, if any
+    http: Optional[str] = None
+    # host:port to serve metrics on, if any
+    metrics: Optional[str] = None
+    # the [log] section; see irctoolkit.log.LineLog.from_config
+    log:  Dict[str, str] = field(default_factory=dict)
+    # hostmasks allowed to use admin commands (e.g. profile)
+    admins: List[str] = field(default_factory=list)
+
 def _yes_bool(s: str) -> bool:
     return s in ["yes", "on", "1"]
 def _yes_str(b: bool) -> str:
@@ -40,34 +69,94 @@ class ChannelConfig(object):
         return d
 
 class ChannelConfigs(object):
-    def __init__(self, location: str):
+    # every channel's config, read in one pass at startup and then served
+    # from memory. files that something other than us adds, edits or removes
+    # are picked up by mtime, checked at most every CHECK_INTERVAL seconds
+    def __init__(self,
+            location: str,
+            log:      Optional[LineLog]=None):
         self._location = location
+        self._log      = log
         self._channels: Dict[str, ChannelConfig] = {}
+        # filename: mtime, for every file we've read
+        self._mtimes:   Dict[str, float] = {}
+        self._checked = monotonic()
+        # bumped every time a channel's config changes
+        self.generation = 0
+        self._scan()
+
     def _filename(self, channel: str):
         return os.path.join(self._location, f"{channel}.conf")
 
+    def _read(self, filename: str) -> ChannelConfig:
+        config_obj = ConfigParser(interpolation=None)
+        with open(filename) as file_obj:
+            config_obj.read_file(file_obj)
+
+        config = ChannelConfig()
+        for key, value in dict(config_obj["channel"]).items():
+            config.set(key, value)
+        return config
+
+    def _scan(self):
+        mtimes: Dict[str, float] = {}
+        if os.path.isdir(self._location):
+            for entry in os.scandir(self._location):
+                if entry.name.endswith(".conf") and entry.is_file():
+                    mtimes[entry.name] = entry.stat().st_mtime
+
+        for name, mtime in mtimes.items():
+            if not self._mtimes.get(name) == mtime:
+                channel  = name[:-len(".conf")]
+                filename = os.path.join(self._location, name)
+                try:
+                    self._channels[channel] = self._read(filename)
+                    self.generation += 1
+                except (OSError, KeyError, ConfigParserError) as e:
+                    # keep what we had; it might be half way through an edit
+                    if self._log is not None:
+                        self._log.warning(f"failed to read {filename}: {e!r}")
+                    mtimes[name] = self._mtimes.get(name, 0.0)
+        for name in self._mtimes.keys()-mtimes.keys():
+            self._channels.pop(name[:-len(".conf")], None)
+            self.generation += 1
+
+        self._mtimes  = mtimes
+        self._checked = monotonic()
+
+    def check(self):
+        if monotonic()-self._checked >= CHECK_INTERVAL:
+            self._scan()
+
+    def items(self) -> ItemsView[str, ChannelConfig]:
+        return self._channels.items()
+
     def get(self, channel: str) -> ChannelConfig:
+        self.check()
         if not channel in self._channels:
             self._channels[channel] = ChannelConfig()
-            filename = self._filename(channel)
-            if os.path.isfile(filename):
-                config_obj = ConfigParser()
-                with open(filename) as file_obj:
-                    config_obj.read_file(file_obj)
-
-                config = self._channels[channel]
-                for key, value in dict(config_obj["channel"]).items():
-                    config.set(key, value)
         return self._channels[channel]
 
     def set(self, channel: str):
-        existing = self.get(channel)
-
-        if existing:
-            if not os.path.isdir(self._location):
-                os.mkdir(self._location)
-            filename   = os.path.join(self._location, f"{channel}.conf")
-            config_obj = ConfigParser()
-            config_obj.read_dict({"channel": existing.out()})
-            with open(filename, "w") as file_obj:
+        os.makedirs(self._location, exist_ok=True)
+        filename   = self._filename(channel)
+        config_obj = ConfigParser(interpolation=None)
+        # (not get(), which could reload over changes we've yet to write)
+        config     = self._channels.setdefault(channel, ChannelConfig())
+        config_obj.read_dict({"channel": config.out()})
+
+        # write a whole new file and swap it in, so that a crash can't
+        # leave a half written one behind
+        fd, temp = tempfile.mkstemp(dir=self._location, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file_obj:
                 config_obj.write(file_obj)
+                file_obj.flush()
+                os.fsync(file_obj.fileno())
+            os.replace(temp, filename)
+        except BaseException:
+            os.remove(temp)
+            raise
+        # we already know what's in it
+        self._mtimes[os.path.basename(filename)] = os.stat(filename).st_mtime
+        self.generation += 1
@@ -1,16 +1,122 @@
 import os.path, sqlite3
-from typing import List, Optional, Tuple
+from contextlib import contextmanager
+from typing     import Any, Dict, Iterator, List, Optional, Tuple
+
+from irctoolkit.log import LineLog
 
 from .reasons     import ReasonsTable
 from .expirations import ExpirationsTable
 
+# each entry takes the schema up one `PRAGMA user_version`. version 0 is the
+# tables as first created by BanDatabase, ReasonsTable and ExpirationsTable
+MIGRATIONS: List[List[str]] = [
+    [
+        # find()
+        """
+        CREATE INDEX bans_active ON bans (channel, type, mask)
+        WHERE removed_at IS NULL
+        """,
+        # get_active(), get_last()
+        """
+        CREATE INDEX bans_active_last ON bans (channel, ban_id)
+        WHERE removed_at IS NULL
+        """,
+        # get_expiring(), take_expired(): each active ban's latest expiry
+        "CREATE INDEX expirations_ban ON expirations (ban_id, expire_id)",
+        "CREATE INDEX reasons_ban ON reasons (ban_id, reason_id)"
+    ],
+    [
+        # when we sent the MODE to remove an expired ban
+        "ALTER TABLE bans ADD COLUMN expire_sent INTEGER"
+    ],
+    [
+        # history()
+        "CREATE INDEX bans_channel ON bans (channel, ban_id)",
+        "CREATE INDEX bans_set_by ON bans (set_by, ban_id)"
+    ],
+    [
+        # bans from before we tracked more than one network are claimed by
+        # one; see claim_network()
+        "ALTER TABLE bans ADD COLUMN network TEXT NOT NULL DEFAULT ''",
+        "DROP INDEX bans_active",
+        """
+        CREATE INDEX bans_active ON bans (network, channel, type, mask)
+        WHERE removed_at IS NULL
+        """,
+        "DROP INDEX bans_active_last",
+        """
+        CREATE INDEX bans_active_last ON bans (network, channel, ban_id)
+        WHERE removed_at IS NULL
+        """
+    ]
+]
+
+def _indexes() -> List[str]:
+    # every index the migrations leave us with, as its CREATE INDEX
+    indexes: Dict[str, str] = {}
+    for migration in MIGRATIONS:
+        for statement in migration:
+            words = statement.split()
+            if words[:2] == ["CREATE", "INDEX"]:
+                indexes[words[2]] = statement
+            elif words[:2] == ["DROP", "INDEX"]:
+                del indexes[words[2]]
+    return list(indexes.values())
+
+# a ban with its latest reason and expiry, as HISTORY_FIELDS
+HISTORY_FIELDS = [
+    "ban_id", "channel", "type", "mask", "set_by", "set_at",
+    "removed_by", "removed_at",
+    "reason", "reason_set_by", "reason_set_at",
+    "expire", "expire_set_by", "expire_set_at",
+    "network"
+]
+BAN_HISTORY = """
+    SELECT
+        bans.ban_id, channel, type, mask, set_by, set_at,
+        removed_by, removed_at,
+        reason, reason_set_by, reason_set_at,
+        expire, expire_set_by, expire_set_at,
+        network
+    FROM bans
+    LEFT JOIN reasons ON reasons.reason_id = (
+        SELECT max(reason_id) FROM reasons
+        WHERE reasons.ban_id = bans.ban_id
+    )
+    LEFT JOIN expirations ON expirations.expire_id = (
+        SELECT max(expire_id) FROM expirations
+        WHERE expirations.ban_id = bans.ban_id
+    )
+"""
+
+# seconds after we've sent an expired ban's removal that, if the ban's still
+# active (the server refused or lost the MODE), we send it again
+EXPIRE_RESEND = 300
+
+def _sql_glob(mask: str) -> str:
+    # IRC globs only have * and ?, but sqlite's GLOB also has [...]
+    return "".join(f"[{c}]" if c in "[]" else c for c in mask)
+
 class BanDatabase(object):
-    def __init__(self, location: str):
+    def __init__(self,
+            location: str,
+            readonly: bool=False,
+            log:      Optional[LineLog]=None):
+        self._log = log
+        if readonly:
+            # the database must already exist; see AsyncBanDatabase
+            self._db = sqlite3.connect(
+                f"file:{location}?mode=ro", uri=True, isolation_level=None
+            )
+            self.reasons = ReasonsTable(self._db, False)
+            self.expirations = ExpirationsTable(self._db, False)
+            return
+
         new = not os.path.isfile(location)
         self._db = sqlite3.connect(location, isolation_level=None)
         self._db.execute("PRAGMA journal_mode = WAL")
         if new:
-            print("we're new")
+            self._info(f"creating a new database at {location}")
             self._db.execute("""
                 CREATE TABLE bans (
                     ban_id INTEGER PRIMARY KEY,
@@ -27,27 +133,309 @@ class BanDatabase(object):
             """)
         self.reasons = ReasonsTable(self._db, new)
         self.expirations = ExpirationsTable(self._db, new)
+        self._migrate()
+
+    def _migrate(self):
+        cursor  = self._db.execute("PRAGMA user_version")
+        version = cursor.fetchone()[0]
+
+        for i, migration in enumerate(MIGRATIONS[version:], version+1):
+            self._info(f"migrating database to version {i}")
+            with self.batch():
+                for statement in migration:
+                    self._db.execute(statement)
+                # PRAGMA doesn't take bound parameters
+                self._db.execute(f"PRAGMA user_version = {i}")
+
+        # put back any index that's missing, e.g. if we were killed inside
+        # deferred_indexes()
+        with self.batch():
+            for statement in _indexes():
+                self._db.execute(statement.replace(
+                    "CREATE INDEX", "CREATE INDEX IF NOT EXISTS", 1
+                ))
+
+    def _info(self, message: str):
+        if self._log is not None:
+            self._log.info(message)
+
+    @contextmanager
+    def batch(self) -> Iterator[None]:
+        # run every write (including those to self.reasons and
+        # self.expirations) made inside this block as one transaction.
+        # nested batches join the outermost one
+        if self._db.in_transaction:
+            yield
+            return
+
+        self._db.execute("BEGIN")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        else:
+            self._db.execute("COMMIT")
+
+    @contextmanager
+    def deferred_indexes(self) -> Iterator[None]:
+        # drop every index for the duration of this block and build them
+        # again, once, at the end; much cheaper than updating them per row
+        cursor  = self._db.execute("""
+            SELECT name, sql FROM sqlite_master
+            WHERE type='index' AND sql IS NOT NULL
+        """)
+        indexes = cursor.fetchall()
+        with self.batch():
+            for name, _ in indexes:
+                self._db.execute(f"DROP INDEX {name}")
+        try:
+            yield
+        finally:
+            with self.batch():
+                for _, sql in indexes:
+                    self._db.execute(sql)
+            # so the planner knows what the indexes look like now
+            self._db.execute("ANALYZE")
+
+    def import_bans(self, bans: List[Tuple[Any, ...]]):
+        # (channel, type, mask, set_by, set_at, removed_by, removed_at,
+        #  reason, reason_set_by, reason_set_at,
+        #  expire, expire_set_by, expire_set_at, network) as one transaction
+        if not bans:
+            return
+
+        with self.batch():
+            self._db.executemany("""
+                INSERT INTO bans (
+                    channel, type, mask, set_by, set_at,
+                    removed_by, removed_at, network
+                )
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            """, [ban[:7]+(ban[13] or "",) for ban in bans])
+            cursor = self._db.execute("SELECT last_insert_rowid()")
+            first  = cursor.fetchone()[0]-len(bans)+1
+
+            # consecutive ban_ids; see add_many()
+            self._db.executemany("""
+                INSERT INTO reasons (
+                    ban_id, reason_set_by, reason_set_at, reason
+                )
+                VALUES (?, ?, ?, ?)
+            """, [
+                (first+i, ban[8], ban[9], ban[7])
+                for i, ban in enumerate(bans) if ban[7] is not None
+            ])
+            self._db.executemany("""
+                INSERT INTO expirations (
+                    ban_id, expire_set_by, expire_set_at, expire
+                )
+                VALUES (?, ?, ?, ?)
+            """, [
+                (first+i, ban[11], ban[12], ban[10])
+                for i, ban in enumerate(bans) if ban[10] is not None
+            ])
+
+    def export_bans(self,
+            chunk_size: int
+            ) -> Iterator[List[Tuple[Any, ...]]]:
+        # every ban, `chunk_size` at a time; see BAN_HISTORY
+        after = 0
+        while True:
+            cursor = self._db.execute(f"""
+                {BAN_HISTORY}
+                WHERE bans.ban_id > ?
+                ORDER BY bans.ban_id
+                LIMIT ?
+            """, [after, chunk_size])
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            yield rows
+            after = rows[-1][0]
+
+    def history(self,
+            network: Optional[str]=None,
+            channel: Optional[str]=None,
+            set_by:  Optional[str]=None,
+            mask:    Optional[str]=None,
+            since:   Optional[int]=None,
+            until:   Optional[int]=None,
+            before:  Optional[int]=None,
+            limit:   int=100
+            ) -> List[Tuple[Any, ...]]:
+        # newest first. pass the last ban_id of one page as `before` to get
+        # the next page; see BAN_HISTORY
+        where:  List[str] = []
+        params: List[Any] = []
+        for clause, value in [
+                ("network=?",        network),
+                ("channel=?",        channel),
+                ("set_by=?",         set_by),
+                ("mask GLOB ?",      mask and _sql_glob(mask)),
+                ("set_at>=?",        since),
+                ("set_at<?",         until),
+                ("bans.ban_id<?",    before)]:
+            if value is not None:
+                where.append(clause)
+                params.append(value)
+        where_s = " AND ".join(where) or "1"
+
+        cursor = self._db.execute(f"""
+            {BAN_HISTORY}
+            WHERE {where_s}
+            ORDER BY bans.ban_id DESC
+            LIMIT ?
+        """, params+[limit])
+        return cursor.fetchall()
+
+    def get_ban_history(self,
+            ban_id: int
+            ) -> Optional[Tuple[
+                Tuple[Any, ...],
+                List[Tuple[str, str, int]],
+                List[Tuple[int, str, int]]
+            ]]:
+        # a ban, every reason it's had and every expiry it's had
+        ban = self.get_ban(ban_id)
+        if ban is None:
+            return None
+        return (
+            ban,
+            self.reasons.get_all(ban_id),
+            self.expirations.get_all(ban_id)
+        )
+
+    def claim_network(self, network: str) -> int:
+        # bans tracked before we knew which network they were on
+        cursor = self._db.execute("""
+            UPDATE bans SET network=? WHERE network=''
+        """, [network])
+        return cursor.rowcount
 
     def add(self,
+            network: str,
             channel: str,
             type: int,
             mask: str,
             set_by: str,
             set_at: int) -> int:
-        self._db.execute("""
-            INSERT INTO bans (channel, type, mask, set_by, set_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, [channel, type, mask, set_by, set_at])
-        return self.get_last(channel)
+        cursor = self._db.execute("""
+            INSERT INTO bans (network, channel, type, mask, set_by, set_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [network, channel, type, mask, set_by, set_at])
+        return cursor.lastrowid
+
+    def add_many(self,
+            bans: List[Tuple[str, str, int, str, str, int]]
+            ) -> List[int]:
+        if not bans:
+            return []
+
+        with self.batch():
+            self._db.executemany("""
+                INSERT INTO bans (network, channel, type, mask, set_by, set_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, bans)
+            cursor = self._db.execute("SELECT last_insert_rowid()")
+            last   = cursor.fetchone()[0]
+        # we're the only writer and we're inside one transaction, so the
+        # rows got consecutive ban_ids ending at `last`
+        return list(range(last-len(bans)+1, last+1))
+
+    def apply_changes(self,
+            network: str,
+            channel: str,
+            changes: List[Tuple[bool, int, str]],
+            source:  str,
+            now:     int,
+            existing_ids: Optional[List[Optional[int]]]=None
+            ) -> Tuple[List[int], List[int]]:
+        # apply a MODE line's (add, type, mask) changes as one transaction.
+        # `existing_ids`, if we already know them, are the active ban_ids
+        # (or None) for each change's mask.
+        # returns the ban_ids that were removed and those that were added
+        removed: List[int] = []
+        added:   List[int] = []
+        with self.batch():
+            for i, (add, type, mask) in enumerate(changes):
+                # this could be a +b or a -b for an existing mask.
+                # either way, we want to expire previous instances of it
+                if existing_ids is not None:
+                    existing = existing_ids[i]
+                else:
+                    existing = self.find(network, channel, type, mask)
+                if existing is not None:
+                    self.set_removed(existing, source, now)
+                    removed.append(existing)
+                if add:
+                    added.append(
+                        self.add(network, channel, type, mask, source, now)
+                    )
+        return removed, added
+
+    def resync(self,
+            network: str,
+            channel: str,
+            current: List[Tuple[int, str, str, int]],
+            now:     int
+            ) -> Tuple[List[int], List[int], List[Tuple[int, int, str]]]:
+        # reconcile tracked bans with a channel's current (type, mask,
+        # set_by, set_at) list as one transaction. returns the ban_ids that
+        # were removed, those that were added and what's now active
+        with self.batch():
+            tracked = self.get_active(network, channel)
+
+            tracked_set = set((type, mask) for _, type, mask in tracked)
+            current_set = set((type, mask) for type, mask, _, _ in current)
+
+            # which bans/quiets were removed while we weren't watching
+            removed = [
+                ban_id for ban_id, type, mask in tracked
+                if not (type, mask) in current_set
+            ]
+            # which bans/quiets were added while we weren't watching
+            added = [
+                (network, channel, type, mask, set_by, set_at)
+                for type, mask, set_by, set_at in current
+                if not (type, mask) in tracked_set
+            ]
+            self.set_removed_many([(b, None, now) for b in removed])
+            added_ids = self.add_many(added)
+            return removed, added_ids, self.get_active(network, channel)
+
+    def set_comment(self,
+            ban_id:   int,
+            set_by:   str,
+            set_at:   int,
+            reason:   Optional[str],
+            duration: Optional[int]
+            ) -> Optional[int]:
+        # returns when the ban now expires, if a duration was given
+        expire: Optional[int] = None
+        with self.batch():
+            if reason is not None:
+                self.reasons.set(ban_id, set_by, set_at, reason)
+            if duration is not None:
+                expire = self.expirations.set(
+                    ban_id, set_by, set_at, duration
+                )
+                # a new expiry deserves a new removal
+                self._db.execute("""
+                    UPDATE bans SET expire_sent=NULL WHERE ban_id=?
+                """, [ban_id])
+        return expire
 
     def find(self,
+            network: str,
             channel: str,
             type:    int,
             mask:    str) -> Optional[int]:
         cursor = self._db.execute("""
             SELECT ban_id FROM bans
-            WHERE channel=? AND type=? AND mask=?
-        """, [channel, type, mask])
+            WHERE network=? AND channel=? AND type=? AND mask=?
+                AND removed_at IS NULL
+        """, [network, channel, type, mask])
         return (cursor.fetchone() or [None])[0]
 
     def set_removed(self,
@@ -60,49 +448,115 @@ class BanDatabase(object):
             WHERE ban_id=? AND removed_at IS NULL
         """, [removed_by, removed_at, ban_id])
 
-    def get_active(self, channel: str) -> List[Tuple[int, int, str]]:
+    def set_removed_many(self,
+            bans: List[Tuple[int, Optional[str], int]]):
+        with self.batch():
+            self._db.executemany("""
+                UPDATE bans
+                SET removed_by=?, removed_at=?
+                WHERE ban_id=? AND removed_at IS NULL
+            """, [(by, at, ban_id) for ban_id, by, at in bans])
+
+    def get_active(self,
+            network: str,
+            channel: str
+            ) -> List[Tuple[int, int, str]]:
         cursor = self._db.execute("""
             SELECT ban_id, type, mask FROM bans
-            WHERE channel=? AND removed_at IS NULL
-        """, [channel])
+            WHERE network=? AND channel=? AND removed_at IS NULL
+        """, [network, channel])
         return cursor.fetchall()
 
-    def get_last(self, channel: str):
+    def get_last(self, network: str, channel: str):
         cursor = self._db.execute("""
             SELECT ban_id FROM bans
-            WHERE channel=? AND removed_at IS NULL
+            WHERE network=? AND channel=? AND removed_at IS NULL
             ORDER BY ban_id DESC
             LIMIT 1
-        """, [channel])
+        """, [network, channel])
         ban_id = (cursor.fetchone() or [None])[0]
         return ban_id
 
     def get_ban(self,
             ban_id: int
-            ) -> Tuple[str, int, str, str, int, Optional[str], int]:
+            ) -> Tuple[str, int, str, str, int, Optional[str], int, str]:
         cursor = self._db.execute("""
             SELECT
-                channel, type, mask, set_by, set_at, removed_by, removed_at
+                channel, type, mask, set_by, set_at, removed_by, removed_at,
+                network
             FROM bans
             WHERE ban_id=?
         """, [ban_id])
         return (cursor.fetchall() or [None])[0]
 
-    def ban_exists(self, ban_id: int) -> bool:
+    def get_expiring(self) -> List[Tuple[int, int, str]]:
+        # (ban_id, expire, network) for every active ban that has an expiry.
+        # those we've sent a removal for are due again EXPIRE_RESEND after
         cursor = self._db.execute("""
-            SELECT '1' FROM bans
-            WHERE ban_id=?
-        """, [ban_id])
-        out = cursor.fetchone()
-        return (out or ["0"])[0] == "1"
+            SELECT
+                bans.ban_id,
+                max(expire, ifnull(expire_sent+?, expire)),
+                network
+            FROM bans
+            INNER JOIN expirations ON expirations.expire_id = (
+                SELECT max(expire_id) FROM expirations
+                WHERE expirations.ban_id = bans.ban_id
+            )
+            WHERE removed_at IS NULL
+        """, [EXPIRE_RESEND])
+        return cursor.fetchall()
 
-    def find_expired(self,
-            now: int
-            ) -> List[int]:
-        cursor = self._db.execute("""
-            SELECT expirations.ban_id, max(expire_id) FROM expirations
-            INNER JOIN bans ON bans.ban_id = expirations.ban_id
-            WHERE expire < ? AND removed_at IS NULL
-            GROUP BY expirations.ban_id
-        """, [now])
-        return [r[0] for r in cursor.fetchall()]
+    def take_expired(self,
+            now:      int,
+            network:  str,
+            channels: List[str]
+            ) -> List[Tuple[str, int, str, int]]:
+        # (channel, type, mask, ban_id) for every ban in `network`'s
+        # `channels` that's due to expire, ordered by channel. they're marked
+        # as sent in the same transaction, so that we don't send their
+        # removal again until EXPIRE_RESEND has passed without it working;
+        # release_expired() whatever then doesn't get sent
+        if not channels:
+            return []
+
+        channel_params = ", ".join("?" for _ in channels)
+        with self.batch():
+            cursor = self._db.execute(f"""
+                SELECT channel, type, mask, bans.ban_id
+                FROM bans
+                INNER JOIN expirations ON expirations.expire_id = (
+                    SELECT max(expire_id) FROM expirations
+                    WHERE expirations.ban_id = bans.ban_id
+                )
+                WHERE removed_at IS NULL
+                    AND (expire_sent IS NULL OR expire_sent <= ?)
+                    AND expire <= ? AND network = ?
+                    AND channel IN ({channel_params})
+                ORDER BY channel
+            """, [now-EXPIRE_RESEND, now, network]+channels)
+            expired = cursor.fetchall()
+
+            self._db.executemany("""
+                UPDATE bans SET expire_sent=? WHERE ban_id=?
+            """, [(now, ban_id) for _, _, _, ban_id in expired])
+        return expired
+
+    def find_active(self, ban_ids: List[int]) -> List[int]:
+        # which of `ban_ids` haven't been removed
+        active: List[int] = []
+        for i in range(0, len(ban_ids), 500):
+            chunk  = ban_ids[i:i+500]
+            params = ", ".join("?" for _ in chunk)
+            cursor = self._db.execute(f"""
+                SELECT ban_id FROM bans
+                WHERE ban_id IN ({params}) AND removed_at IS NULL
+            """, chunk)
+            active.extend(r[0] for r in cursor.fetchall())
+        return active
+
+    def release_expired(self, ban_ids: List[int]):
+        # taken by take_expired() but never sent; leave them for next time
+        with self.batch():
+            self._db.executemany("""
+                UPDATE bans SET expire_sent=NULL WHERE ban_id=?
+            """, [(ban_id,) for ban_id in ban_ids])
@@ -0,0 +1,231 @@
+import asyncio, queue, threading
+from concurrent.futures import ThreadPoolExecutor
+from time   import monotonic
+from typing import Any, Callable, List, Optional, Tuple, TypeVar
+
+from irctoolkit.log     import LineLog
+from irctoolkit.metrics import REGISTRY
+from . import BanDatabase
+
+QUERY_SECONDS = REGISTRY.histogram(
+    "bantracker_db_seconds",
+    "Time from asking for a database read or write to having its result",
+    ["kind", "query"]
+)
+
+T = TypeVar("T")
+_Job = Tuple[asyncio.AbstractEventLoop, "asyncio.Future[Any]",
+    Callable[..., Any], Tuple[Any, ...]]
+
+def _resolve(future: "asyncio.Future[Any]",
+        result: Any,
+        error:  Optional[BaseException]):
+    if not future.cancelled():
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+class AsyncBanDatabase(object):
+    # BanDatabase, but awaitable and off the event loop. writes go, in order,
+    # through one writer thread (so ban_ids are handed out in the order we
+    # saw things happen) and reads go to a small pool of read-only
+    # connections, which WAL lets run alongside the writer
+    def __init__(self,
+            location:   str,
+            readers:    int=4,
+            queue_size: int=1024,
+            log:        Optional[LineLog]=None):
+        self._location = location
+        self._log      = log
+
+        self._writes: "queue.Queue[Optional[_Job]]" = queue.Queue()
+        self._write_slots = asyncio.Semaphore(queue_size)
+
+        ready = threading.Event()
+        self._open_error: Optional[BaseException] = None
+        self._writer = threading.Thread(
+            target=self._write_loop,
+            args=(ready,),
+            name="bantracker-db-writer",
+            daemon=True
+        )
+        self._writer.start()
+        # readers open read-only, so the writer has to have created the
+        # database before any of them can
+        ready.wait()
+        if self._open_error is not None:
+            raise self._open_error
+
+        self._local   = threading.local()
+        self._readers = ThreadPoolExecutor(
+            readers, thread_name_prefix="bantracker-db-reader"
+        )
+
+    def _write_loop(self, ready: threading.Event):
+        try:
+            db = BanDatabase(self._location, log=self._log)
+        except BaseException as e:
+            # (for __init__ to raise, rather than wait on us forever)
+            self._open_error = e
+            return
+        finally:
+            ready.set()
+
+        while True:
+            job = self._writes.get()
+            if job is None:
+                break
+
+            loop, future, func, args = job
+            result: Any = None
+            error:  Optional[BaseException] = None
+            try:
+                result = func(db, *args)
+            except BaseException as e:
+                error = e
+            loop.call_soon_threadsafe(_resolve, future, result, error)
+
+    def _read(self, func: Callable[..., T], args: Tuple[Any, ...]) -> T:
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = self._local.db = BanDatabase(self._location, readonly=True)
+        return func(db, *args)
+
+    async def write(self, func: Callable[..., T], *args: Any) -> T:
+        # a full queue makes us wait here rather than block the event loop
+        start = monotonic()
+        async with self._write_slots:
+            loop   = asyncio.get_running_loop()
+            future = loop.create_future()
+            self._writes.put((loop, future, func, args))
+            try:
+                return await future
+            finally:
+                QUERY_SECONDS.labels("write", func.__name__).observe(
+                    monotonic()-start
+                )
+
+    async def read(self, func: Callable[..., T], *args: Any) -> T:
+        start = monotonic()
+        loop  = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(
+                self._readers, self._read, func, args
+            )
+        finally:
+            QUERY_SECONDS.labels("read", func.__name__).observe(
+                monotonic()-start
+            )
+
+    def close(self):
+        self._writes.put(None)
+        self._writer.join()
+        self._readers.shutdown()
+
+    # reads
+    async def find(self,
+            network: str,
+            channel: str,
+            type:    int,
+            mask:    str) -> Optional[int]:
+        return await self.read(
+            BanDatabase.find, network, channel, type, mask
+        )
+    async def get_active(self,
+            network: str,
+            channel: str
+            ) -> List[Tuple[int, int, str]]:
+        return await self.read(BanDatabase.get_active, network, channel)
+    async def get_last(self, network: str, channel: str) -> Optional[int]:
+        return await self.read(BanDatabase.get_last, network, channel)
+    async def get_ban(self,
+            ban_id: int
+            ) -> Tuple[str, int, str, str, int, Optional[str], int, str]:
+        return await self.read(BanDatabase.get_ban, ban_id)
+    async def get_expiring(self) -> List[Tuple[int, int, str]]:
+        return await self.read(BanDatabase.get_expiring)
+    async def find_active(self, ban_ids: List[int]) -> List[int]:
+        return await self.read(BanDatabase.find_active, ban_ids)
+    async def history(self,
+            network: Optional[str]=None,
+            channel: Optional[str]=None,
+            set_by:  Optional[str]=None,
+            mask:    Optional[str]=None,
+            since:   Optional[int]=None,
+            until:   Optional[int]=None,
+            before:  Optional[int]=None,
+            limit:   int=100
+            ) -> List[Tuple[Any, ...]]:
+        return await self.read(
+            BanDatabase.history,
+            network, channel, set_by, mask, since, until, before, limit
+        )
+    async def get_ban_history(self,
+            ban_id: int
+            ) -> Optional[Tuple[
+                Tuple[Any, ...],
+                List[Tuple[str, str, int]],
+                List[Tuple[int, str, int]]
+            ]]:
+        return await self.read(BanDatabase.get_ban_history, ban_id)
+
+    # writes
+    async def claim_network(self, network: str) -> int:
+        return await self.write(BanDatabase.claim_network, network)
+    async def add(self,
+            network: str,
+            channel: str,
+            type:    int,
+            mask:    str,
+            set_by:  str,
+            set_at:  int) -> int:
+        return await self.write(
+            BanDatabase.add, network, channel, type, mask, set_by, set_at
+        )
+    async def set_removed(self,
+            ban_id:     int,
+            removed_by: Optional[str],
+            removed_at: int):
+        await self.write(BanDatabase.set_removed, ban_id, removed_by, removed_at)
+    async def apply_changes(self,
+            network: str,
+            channel: str,
+            changes: List[Tuple[bool, int, str]],
+            source:  str,
+            now:     int,
+            existing_ids: Optional[List[Optional[int]]]=None
+            ) -> Tuple[List[int], List[int]]:
+        return await self.write(
+            BanDatabase.apply_changes,
+            network, channel, changes, source, now, existing_ids
+        )
+    async def resync(self,
+            network: str,
+            channel: str,
+            current: List[Tuple[int, str, str, int]],
+            now:     int
+            ) -> Tuple[List[int], List[int], List[Tuple[int, int, str]]]:
+        return await self.write(
+            BanDatabase.resync, network, channel, current, now
+        )
+    async def take_expired(self,
+            now:      int,
+            network:  str,
+            channels: List[str]
+            ) -> List[Tuple[str, int, str, int]]:
+        return await self.write(
+            BanDatabase.take_expired, now, network, channels
+        )
+    async def release_expired(self, ban_ids: List[int]):
+        await self.write(BanDatabase.release_expired, ban_ids)
+    async def set_comment(self,
+            ban_id:   int,
+            set_by:   str,
+            set_at:   int,
+            reason:   Optional[str],
+            duration: Optional[int]
+            ) -> Optional[int]:
+        return await self.write(
+            BanDatabase.set_comment, ban_id, set_by, set_at, reason, duration
+        )
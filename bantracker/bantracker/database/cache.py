@@ -0,0 +1,70 @@
+from typing import Dict, List, Optional, Tuple
+
+class ActiveBanCache(object):
+    # active bans per channel, keyed by (type, mask), with masks compared
+    # exactly, as the database compares them. we're the only thing writing
+    # to the database, so once a channel has been hydrated from it, keeping
+    # this in step with our own writes keeps it correct
+    def __init__(self):
+        self._channels: Dict[str, Dict[Tuple[int, str], int]] = {}
+        self._ban_keys: Dict[int, Tuple[str, Tuple[int, str]]] = {}
+
+    def hydrated(self, channel: str) -> bool:
+        return channel in self._channels
+
+    def hydrate(self, channel: str, active: List[Tuple[int, int, str]]):
+        self.forget(channel)
+        self._channels[channel] = {}
+        for ban_id, type, mask in active:
+            self.add(channel, ban_id, type, mask)
+
+    def forget(self, channel: str):
+        for ban_id in self._channels.pop(channel, {}).values():
+            del self._ban_keys[ban_id]
+
+    def find(self, channel: str, type: int, mask: str) -> Optional[int]:
+        return self._channels[channel].get((type, mask))
+
+    def add(self, channel: str, ban_id: int, type: int, mask: str):
+        key = (type, mask)
+        replaced = self._channels[channel].get(key)
+        if replaced is not None:
+            # the same mask active twice
+            del self._ban_keys[replaced]
+        self._channels[channel][key] = ban_id
+        self._ban_keys[ban_id] = (channel, key)
+
+    def remove(self, ban_id: int):
+        if ban_id in self._ban_keys:
+            channel, key = self._ban_keys.pop(ban_id)
+            del self._channels[channel][key]
+
+    def last(self, channel: str) -> Optional[int]:
+        return max(self._channels[channel].values(), default=None)
+
+    def verify(self,
+            channel: str,
+            active:  List[Tuple[int, int, str]]
+            ) -> List[str]:
+        # compare what we've cached for `channel` with what the database
+        # says is active there. returns a description of each difference
+        cached = {
+            ban_id: key for key, ban_id in self._channels[channel].items()
+        }
+        stored = {
+            ban_id: (type, mask)
+            for ban_id, type, mask in active
+        }
+
+        diffs: List[str] = []
+        for ban_id in sorted(set(cached) | set(stored)):
+            if not ban_id in stored:
+                diffs.append(f"{ban_id} cached but not active")
+            elif not ban_id in cached:
+                diffs.append(f"{ban_id} active but not cached")
+            elif not cached[ban_id] == stored[ban_id]:
+                diffs.append(
+                    f"{ban_id} cached as {cached[ban_id]}, "
+                    f"stored as {stored[ban_id]}"
+                )
+        return diffs
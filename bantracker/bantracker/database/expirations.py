@@ -22,7 +22,7 @@ class ExpirationsTable(object):
             ban_id: int,
             expire_set_by: str,
             expire_set_at: int,
-            duration: int):
+            duration: int) -> int:
         cursor = self._db.execute("""
             SELECT set_at FROM bans
             WHERE ban_id=?
@@ -36,6 +36,7 @@ class ExpirationsTable(object):
             )
             VALUES (?, ?, ?, ?)
         """, [ban_id, expire_set_by, expire_set_at, expire])
+        return expire
 
     def get(self, ban_id: int) -> Optional[Tuple[str, str, int]]:
         cursor = self._db.execute("""
@@ -46,10 +47,10 @@ class ExpirationsTable(object):
         """, [ban_id])
         return cursor.fetchone()
 
-    def get_all(self, ban_id: int) -> List[Tuple[str, str, int]]:
+    def get_all(self, ban_id: int) -> List[Tuple[int, str, int]]:
         cursor = self._db.execute("""
             SELECT expire, expire_set_by, expire_set_at FROM expirations
             WHERE ban_id=?
             ORDER BY expire_id
         """, [ban_id])
-        return cursor.fetchone()
+        return cursor.fetchall()
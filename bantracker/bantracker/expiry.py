@@ -0,0 +1,78 @@
+import asyncio, heapq, time
+from typing import Dict, List, Optional, Tuple
+
+class ExpiryScheduler(object):
+    # a min-heap of (expire, ban_id). rescheduled and cancelled bans are left
+    # in the heap and skipped when they reach the top, as _expires only holds
+    # each ban's current expiry. one for every network; due bans come out
+    # grouped by the network they're on
+    def __init__(self):
+        self._heap:    List[Tuple[int, int]] = []
+        self._expires: Dict[int, int] = {}
+        self._networks: Dict[int, str] = {}
+        self._changed = asyncio.Event()
+        # when the soonest of what wait() last returned was due
+        self.due = 0
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def schedule(self, ban_id: int, expire: int, network: str):
+        self._expires[ban_id]  = expire
+        self._networks[ban_id] = network
+        heapq.heappush(self._heap, (expire, ban_id))
+        if self._heap[0] == (expire, ban_id):
+            # we've a new soonest expiry; wake wait() up to sleep less
+            self._changed.set()
+
+        if len(self._heap) > (len(self._expires)*2)+64:
+            self._heap = [(e, b) for b, e in self._expires.items()]
+            heapq.heapify(self._heap)
+
+    def cancel(self, ban_id: int):
+        self._expires.pop(ban_id, None)
+        self._networks.pop(ban_id, None)
+
+    def _prune(self):
+        while self._heap:
+            expire, ban_id = self._heap[0]
+            if self._expires.get(ban_id) == expire:
+                break
+            heapq.heappop(self._heap)
+
+    def next(self) -> Optional[int]:
+        self._prune()
+        if self._heap:
+            return self._heap[0][0]
+        return None
+
+    def pop_due(self, now: int) -> Dict[str, List[int]]:
+        due: Dict[str, List[int]] = {}
+        while True:
+            expire = self.next()
+            if expire is None or expire > now:
+                break
+            _, ban_id = heapq.heappop(self._heap)
+            del self._expires[ban_id]
+            network = self._networks.pop(ban_id)
+            due.setdefault(network, []).append(ban_id)
+        return due
+
+    async def wait(self) -> Dict[str, List[int]]:
+        # sleep until the soonest expiry, then return every ban that's due
+        while True:
+            self._changed.clear()
+
+            timeout: Optional[float] = None
+            expire = self.next()
+            if expire is not None:
+                now = time.time()
+                if expire <= now:
+                    self.due = expire
+                    return self.pop_due(int(now))
+                timeout = expire-now
+
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,138 @@
+from dataclasses import dataclass
+from typing      import Dict, Iterable, List, Optional, Set, Tuple
+
+from ircstates       import User
+from ircstates.names import Name
+from ircrobots.glob  import Glob
+
+# how many literal characters a mask is bucketed on
+KEY_LEN   = 3
+WILDCARDS = "*?"
+
+def _literal_prefix(pattern: str) -> str:
+    for i, c in enumerate(pattern):
+        if c in WILDCARDS:
+            return pattern[:i]
+    return pattern
+def _literal_suffix(pattern: str) -> str:
+    for i in range(len(pattern)-1, -1, -1):
+        if pattern[i] in WILDCARDS:
+            return pattern[i+1:]
+    return pattern
+
+@dataclass
+class CacheCounters(object):
+    hits:   int = 0
+    misses: int = 0
+
+class TrackerUser(User):
+    def __init__(self, nickname: Name):
+        super().__init__(nickname)
+        self._masks_key: Optional[Tuple[Optional[str], ...]] = None
+        self._masks:     List[str] = []
+
+    def masks(self,
+            extbans:  List[str],
+            counters: CacheCounters
+            ) -> List[str]:
+        # only re-format our enforcement masks when something they could be
+        # formatted from has changed since last time
+        key = (
+            self.nickname,
+            self.username,
+            self.hostname,
+            self.account,
+            self.realname
+        )
+        if key == self._masks_key:
+            counters.hits += 1
+            return self._masks
+        counters.misses += 1
+
+        hostmask = self.hostmask()
+        vars = {
+            "account":  self.account or "",
+            "hostmask": hostmask,
+            "realname": self.realname
+        }
+        masks = [hostmask]
+        for extban in extbans:
+            masks.append(extban.format(**vars))
+
+        self._masks_key = key
+        self._masks     = masks
+        return masks
+
+class MaskIndex(object):
+    # a channel's users' enforcement masks, bucketed by their first and last
+    # KEY_LEN characters so that a new ban only has to be glob matched
+    # against users its literal prefix or suffix could match
+    def __init__(self):
+        self._masks:    Dict[str, List[str]] = {}
+        self._prefixes: Dict[str, Set[str]]  = {}
+        self._suffixes: Dict[str, Set[str]]  = {}
+
+    def __len__(self) -> int:
+        return len(self._masks)
+    def __contains__(self, nickname: str) -> bool:
+        return nickname in self._masks
+
+    def add(self, nickname: str, masks: List[str]):
+        if self._masks.get(nickname) is masks:
+            # same (cached) list we already have indexed
+            return
+        self.remove(nickname)
+        self._masks[nickname] = masks
+        for mask in masks:
+            if len(mask) >= KEY_LEN:
+                prefix = mask[:KEY_LEN]
+                suffix = mask[-KEY_LEN:]
+                self._prefixes.setdefault(prefix, set()).add(nickname)
+                self._suffixes.setdefault(suffix, set()).add(nickname)
+
+    def remove(self, nickname: str):
+        masks = self._masks.pop(nickname, None)
+        if masks is None:
+            return
+
+        for mask in masks:
+            if len(mask) >= KEY_LEN:
+                for key, buckets in [
+                        (mask[:KEY_LEN],  self._prefixes),
+                        (mask[-KEY_LEN:], self._suffixes)]:
+                    bucket = buckets.get(key)
+                    if bucket is not None:
+                        bucket.discard(nickname)
+                        if not bucket:
+                            del buckets[key]
+
+    def clear(self):
+        self._masks.clear()
+        self._prefixes.clear()
+        self._suffixes.clear()
+
+    def _candidates(self, pattern: str) -> Iterable[str]:
+        candidates: Iterable[str] = self._masks.keys()
+        best = len(self._masks)
+
+        prefix = _literal_prefix(pattern)
+        if len(prefix) >= KEY_LEN:
+            bucket = self._prefixes.get(prefix[:KEY_LEN], set())
+            if len(bucket) < best:
+                candidates, best = bucket, len(bucket)
+
+        suffix = _literal_suffix(pattern)
+        if len(suffix) >= KEY_LEN:
+            bucket = self._suffixes.get(suffix[-KEY_LEN:], set())
+            if len(bucket) < best:
+                candidates, best = bucket, len(bucket)
+        return candidates
+
+    def match(self, pattern: str, compiled: Glob) -> List[str]:
+        matches: List[str] = []
+        for nickname in self._candidates(pattern):
+            for mask in self._masks[nickname]:
+                if compiled.match(mask):
+                    matches.append(nickname)
+                    break
+        return matches
@@ -0,0 +1,103 @@
+from typing import List, Optional, Tuple
+
+# RFC1459 line limit, including the trailing \r\n
+LINE_MAX = 512
+# what we assume our username and hostname are when we don't know them yet,
+# as the server will prefix our MODE lines with them when relaying them
+USERNAME_MAX = 10
+HOSTNAME_MAX = 63
+
+# (add, mode, arg)
+ModeChange = Tuple[bool, str, Optional[str]]
+
+class _Line(object):
+    def __init__(self):
+        self.adds:    List[ModeChange] = []
+        self.removes: List[ModeChange] = []
+        self.size = 0
+
+    def __len__(self) -> int:
+        return len(self.adds)+len(self.removes)
+
+    def cost(self, change: ModeChange) -> int:
+        add, _, arg = change
+        # the mode char, a " " before its arg, the arg
+        cost = 1
+        if arg is not None:
+            cost += 1+len(arg)
+        # and "+"/"-" if it's the first of its kind in this line
+        if not (self.adds if add else self.removes):
+            cost += 1
+        return cost
+
+    def append(self, change: ModeChange):
+        self.size += self.cost(change)
+        if change[0]:
+            self.adds.append(change)
+        else:
+            self.removes.append(change)
+
+    def out(self) -> Tuple[str, List[str]]:
+        modes = ""
+        args:  List[str] = []
+        for sign, changes in [("+", self.adds), ("-", self.removes)]:
+            if changes:
+                modes += sign
+                for _, mode, arg in changes:
+                    modes += mode
+                    if arg is not None:
+                        args.append(arg)
+        return modes, args
+
+def prefix_length(
+        nickname: str,
+        username: Optional[str],
+        hostname: Optional[str]
+        ) -> int:
+    username_len = USERNAME_MAX if username is None else len(username)
+    hostname_len = HOSTNAME_MAX if hostname is None else len(hostname)
+    return len(nickname)+1+username_len+1+hostname_len
+
+def pack_modes(
+        target:     str,
+        changes:    List[ModeChange],
+        max_modes:  int,
+        prefix_len: int,
+        last:       Optional[ModeChange]=None
+        ) -> List[Tuple[str, List[str]]]:
+    # pack `changes` in to as few MODE lines as we can, keeping each line to
+    # at most `max_modes` modes (ISUPPORT MODES=) and to within LINE_MAX once
+    # the server has prefixed it with our hostmask. `last` (e.g. "-o" for
+    # ourselves) is guaranteed to be in the last line returned.
+    #
+    # ":{prefix} MODE {target} {modes} {args}\r\n", with a byte spare in case
+    # the last arg needs a ":"
+    budget = LINE_MAX-len(f": MODE {target} \r\n")-prefix_len-1
+    if max_modes < 0:
+        # MODES= without a value; no limit other than line length
+        max_modes = len(changes)+1
+    lines: List[_Line] = []
+
+    def _fit(change: ModeChange) -> _Line:
+        for line in lines:
+            if (len(line) < max_modes and
+                    line.size+line.cost(change) <= budget):
+                return line
+        # a change too long for any line still gets a line of its own
+        line = _Line()
+        lines.append(line)
+        return line
+
+    # first-fit decreasing; place the longest args first, while there's the
+    # most room left for them
+    ordered = sorted(changes, key=lambda c: len(c[2] or ""), reverse=True)
+    for change in ordered:
+        _fit(change).append(change)
+
+    if last is not None:
+        line = _fit(last)
+        line.append(last)
+        lines.remove(line)
+        lines.append(line)
+
+    return [line.out() for line in lines]
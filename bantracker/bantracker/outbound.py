@@ -0,0 +1,214 @@
+import asyncio
+from collections import deque
+from enum        import IntEnum
+from time        import monotonic
+from typing      import (Any, Awaitable, Callable, Deque, Dict, Hashable,
+    Optional)
+
+from irctokens import Line
+
+class Lane(IntEnum):
+    KEEPALIVE = 0
+    # ChanServ OP requests, JOINs, list queries
+    CONTROL   = 1
+    KICK      = 2
+    MODE      = 3
+    NOTICE    = 4
+
+KEEPALIVE_COMMANDS = {
+    "PING", "PONG", "QUIT", "CAP", "AUTHENTICATE", "NICK", "USER", "PASS"
+}
+# longer lines cost more flood penalty; roughly how most ircds charge
+PENALTY_BYTES = 256
+
+def _lane(line: Line) -> Lane:
+    if line.command in KEEPALIVE_COMMANDS:
+        return Lane.KEEPALIVE
+    elif line.command == "KICK":
+        return Lane.KICK
+    elif line.command == "MODE" and len(line.params) > 2:
+        return Lane.MODE
+    elif (line.command in ["NOTICE", "PRIVMSG"] and
+            not line.params[0].lower() == "chanserv"):
+        return Lane.NOTICE
+    return Lane.CONTROL
+
+def _penalty(line: Line) -> float:
+    return 1+len(line.format())//PENALTY_BYTES
+
+class TokenBucket(object):
+    def __init__(self, burst: int, rate: float):
+        self._burst  = burst
+        self._rate   = rate
+        self._tokens = float(burst)
+        self._last   = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(
+            self._burst, self._tokens+(now-self._last)*self._rate
+        )
+        self._last = now
+
+    def delay(self, cost: float) -> float:
+        # how long until we can afford `cost`
+        self._refill()
+        return max(0.0, (min(cost, self._burst)-self._tokens)/self._rate)
+
+    def take(self, cost: float):
+        self._refill()
+        self._tokens -= cost
+
+class _Queued(object):
+    def __init__(self,
+            line:   Line,
+            lane:   Lane,
+            key:    Optional[Hashable],
+            future: "asyncio.Future[Any]"):
+        self.line      = line
+        self.lane      = lane
+        self.key       = key
+        self.future    = future
+        self.queued_at = monotonic()
+
+class LaneStats(object):
+    def __init__(self):
+        self.sent        = 0
+        self.coalesced   = 0
+        # total and worst seconds between being queued and being sent
+        self.latency     = 0.0
+        self.latency_max = 0.0
+
+class Outbound(object):
+    # a priority queue per Lane in front of the server's own send queue,
+    # only letting lines through as fast as the ircd's flood control would
+    # let us, and folding lines that a queued line already covers in to it
+    def __init__(self,
+            send:     Callable[[Line], Awaitable[Any]],
+            casefold: Callable[[str], str],
+            burst:    int,
+            rate:     float):
+        self._send     = send
+        self._casefold = casefold
+        self._bucket   = TokenBucket(burst, rate)
+
+        self._lanes: Dict[Lane, Deque[_Queued]] = {l: deque() for l in Lane}
+        self._keys:  Dict[Hashable, _Queued] = {}
+        self._wake = asyncio.Event()
+        self._task: Optional["asyncio.Task[None]"] = None
+        # taken off its lane and not yet through the server's send queue
+        self._sending: Optional[_Queued] = None
+        self._closed = False
+
+        self.stats: Dict[Lane, LaneStats] = {l: LaneStats() for l in Lane}
+
+    def depth(self) -> Dict[Lane, int]:
+        return {lane: len(queue) for lane, queue in self._lanes.items()}
+
+    def _key(self, line: Line) -> Optional[Hashable]:
+        # lines with the same key do the same thing; a newer one supersedes
+        # an older one that's still queued
+        params = line.params
+        if line.command == "KICK" and len(params) > 1:
+            # (don't care about reason)
+            return ("KICK",
+                self._casefold(params[0]), self._casefold(params[1]))
+        elif line.command == "MODE" and len(params) > 2:
+            return ("MODE", self._casefold(params[0]), *params[1:])
+        elif line.command in ["PRIVMSG", "NOTICE"] and len(params) > 1:
+            return (line.command, self._casefold(params[0]), params[1])
+        return None
+
+    def queue(self, line: Line) -> "asyncio.Future[Any]":
+        if self._closed:
+            future = asyncio.get_running_loop().create_future()
+            future.set_exception(ConnectionError("disconnected"))
+            return future
+
+        lane = _lane(line)
+        key  = self._key(line)
+
+        if key is not None and key in self._keys:
+            queued = self._keys[key]
+            queued.line = line
+            self.stats[lane].coalesced += 1
+            return queued.future
+
+        future = asyncio.get_running_loop().create_future()
+        queued = _Queued(line, lane, key, future)
+        self._lanes[lane].append(queued)
+        if key is not None:
+            self._keys[key] = queued
+
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        self._wake.set()
+        return future
+
+    def _peek(self) -> Optional[_Queued]:
+        for lane in Lane:
+            if self._lanes[lane]:
+                return self._lanes[lane][0]
+        return None
+
+    async def _run(self):
+        while True:
+            queued = self._peek()
+            if queued is None:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+
+            cost  = _penalty(queued.line)
+            delay = self._bucket.delay(cost)
+            if delay > 0:
+                # something more urgent might be queued while we wait
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            self._lanes[queued.lane].popleft()
+            if queued.key is not None:
+                del self._keys[queued.key]
+            self._bucket.take(cost)
+
+            self._sending = queued
+            try:
+                sent = await self._send(queued.line)
+            except Exception as e:
+                if not queued.future.done():
+                    queued.future.set_exception(e)
+                continue
+            finally:
+                self._sending = None
+
+            latency = monotonic()-queued.queued_at
+            stats   = self.stats[queued.lane]
+            stats.sent    += 1
+            stats.latency += latency
+            stats.latency_max = max(stats.latency_max, latency)
+
+            if not queued.future.done():
+                queued.future.set_result(sent)
+
+    def close(self):
+        # we're disconnected; nothing queued is ever going to be sent, so
+        # fail it, rather than leave whoever's awaiting it waiting forever
+        self._closed = True
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        queued = [q for lane in self._lanes.values() for q in lane]
+        if self._sending is not None:
+            queued.append(self._sending)
+            self._sending = None
+        for lane in self._lanes.values():
+            lane.clear()
+        self._keys.clear()
+        for q in queued:
+            if not q.future.done():
+                q.future.set_exception(ConnectionError("disconnected"))
@@ -0,0 +1,29 @@
+from time   import monotonic
+from typing import Dict, List, Optional, Set, Tuple
+
+class ChannelResync(object):
+    # a channel's ban/quiet lists, collected as their numerics come in after
+    # we've joined it
+    def __init__(self, modes: str):
+        self.waiting: Set[str] = set(modes)
+        self.masks:   Dict[Tuple[int, str], Tuple[str, int]] = {}
+
+        self.started = monotonic()
+        # when we sent our own list query, if we have yet
+        self.queried: Optional[float] = None
+
+    def add(self, type: int, mask: str, set_by: str, set_at: int):
+        # we might see a list twice (if someone else asked too); first wins
+        if not (type, mask) in self.masks:
+            self.masks[(type, mask)] = (set_by, set_at)
+
+    def end(self, mode: str) -> bool:
+        # returns whether we've now seen the end of every list we wanted
+        self.waiting.discard(mode)
+        return not self.waiting
+
+    def current(self) -> List[Tuple[int, str, str, int]]:
+        return [
+            (type, mask, set_by, set_at)
+            for (type, mask), (set_by, set_at) in self.masks.items()
+        ]
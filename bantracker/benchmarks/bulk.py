@@ -0,0 +1,100 @@
+# bulk import/export throughput in rows per second, against adding the same
+# bans one BanDatabase.add()/ReasonsTable.set() at a time.
+#
+# from bantracker/, with the repo's root on PYTHONPATH (for irctoolkit):
+#   $ PYTHONPATH=.. python3 -m benchmarks.bulk --rows 1000000
+
+import json, os, random, tempfile, time
+from argparse import ArgumentParser
+from typing   import Any, Dict, Iterator
+
+from bantracker.bulk     import export_bans, import_bans, CHUNK_SIZE
+from bantracker.database import BanDatabase
+
+CHANNELS = 500
+ACTIVE   = 0.05 # fraction of bans that are still set
+REASONED = 0.50 # fraction of bans with a reason
+EXPIRING = 0.20 # fraction of bans with an expiry
+
+def _records(rows: int) -> Iterator[Dict[str, Any]]:
+    rand = random.Random(1)
+    now  = int(time.time())
+    for i in range(rows):
+        set_at = now-rows+i
+        record: Dict[str, Any] = {
+            "channel": f"#chan{rand.randrange(CHANNELS)}",
+            "type":    rand.choice(["ban", "quiet"]),
+            "mask":    f"*!*@host{i}.example",
+            "set_by":  "someop",
+            "set_at":  set_at
+        }
+        if rand.random() >= ACTIVE:
+            record["removed_by"] = "someop"
+            record["removed_at"] = set_at+60
+        if rand.random() < REASONED:
+            record["reason"] = "spam"
+        if rand.random() < EXPIRING:
+            record["expire"] = set_at+rand.randrange(86400*7)
+        yield record
+
+def _per_row(db: BanDatabase, rows: int):
+    for record in _records(rows):
+        ban_id = db.add(
+            "",
+            record["channel"],
+            1 if record["type"] == "ban" else 2,
+            record["mask"],
+            record["set_by"],
+            record["set_at"]
+        )
+        if "removed_at" in record:
+            db.set_removed(ban_id, record["removed_by"], record["removed_at"])
+        if "reason" in record:
+            db.reasons.set(
+                ban_id, record["set_by"], record["set_at"], record["reason"]
+            )
+
+def _report(label: str, rows: int, elapsed: float):
+    print(f"  {label:<9} {rows:>9} rows {elapsed:7.2f}s "
+        f"{rows/elapsed:>10.0f} rows/s")
+
+def _main():
+    parser = ArgumentParser()
+    parser.add_argument("--rows",    type=int, default=1_000_000)
+    parser.add_argument("--per-row", type=int, default=10_000,
+        help="rows to add one at a time, for comparison")
+    parser.add_argument("--chunk",   type=int, default=CHUNK_SIZE)
+    args = parser.parse_args()
+
+    tmp  = tempfile.mkdtemp()
+    path = os.path.join(tmp, "bans.jsonl")
+    with open(path, "w") as fd:
+        for record in _records(args.rows):
+            fd.write(json.dumps(record)+"\n")
+
+    location = os.path.join(tmp, "per_row.db")
+    db = BanDatabase(location)
+    start = time.perf_counter()
+    _per_row(db, args.per_row)
+    _report("per-row", args.per_row, time.perf_counter()-start)
+    os.remove(location)
+
+    location = os.path.join(tmp, "bulk.db")
+    db = BanDatabase(location)
+    with open(path) as fd:
+        start = time.perf_counter()
+        count = import_bans(db, fd, "jsonl", args.chunk)
+        _report("import", count, time.perf_counter()-start)
+
+    out_path = os.path.join(tmp, "export.jsonl")
+    with open(out_path, "w") as fd:
+        start = time.perf_counter()
+        count = export_bans(db, fd, "jsonl", args.chunk)
+        _report("export", count, time.perf_counter()-start)
+
+    for name in os.listdir(tmp):
+        os.remove(os.path.join(tmp, name))
+    os.rmdir(tmp)
+
+if __name__ == "__main__":
+    _main()
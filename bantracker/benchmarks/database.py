@@ -0,0 +1,117 @@
+# query latency for BanDatabase's hot queries on a large history, without and
+# with the indexes the schema migrations add. (the columns those migrations
+# add are there both times; the queries look at them)
+#
+# from bantracker/, with the repo's root on PYTHONPATH (for irctoolkit):
+#   $ PYTHONPATH=.. python3 -m benchmarks.database --rows 1000000
+
+import os, random, sqlite3, tempfile, time
+from argparse import ArgumentParser
+from typing   import Callable, List, Tuple
+
+from bantracker.database import BanDatabase, MIGRATIONS
+
+CHANNELS    = 500
+ACTIVE      = 0.05 # fraction of bans that are still set
+EXPIRING    = 0.20 # fraction of bans with an expiry
+QUERY_COUNT = 200
+
+def _fill(db: BanDatabase, rows: int):
+    rand = random.Random(1)
+    now  = int(time.time())
+
+    bans: List[Tuple[str, int, str, str, int, object, object]] = []
+    for i in range(rows):
+        set_at = now-rows+i
+        if rand.random() < ACTIVE:
+            removed_by, removed_at = None, None
+        else:
+            removed_by, removed_at = "someop", set_at+60
+        bans.append((
+            f"#chan{rand.randrange(CHANNELS)}",
+            rand.choice([1, 2]),
+            f"*!*@host{i}.example",
+            "someop",
+            set_at,
+            removed_by,
+            removed_at
+        ))
+    expirations = [
+        (i+1, "someop", ban[4], ban[4]+rand.randrange(86400*7))
+        for i, ban in enumerate(bans) if rand.random() < EXPIRING
+    ]
+
+    with db.batch():
+        db._db.executemany("""
+            INSERT INTO bans (
+                channel, type, mask, set_by, set_at, removed_by, removed_at
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, bans)
+        db._db.executemany("""
+            INSERT INTO expirations (
+                ban_id, expire_set_by, expire_set_at, expire
+            )
+            VALUES (?, ?, ?, ?)
+        """, expirations)
+
+def _time(func: Callable[[int], object], count: int=QUERY_COUNT) -> float:
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter()-start)/count*1000
+
+def _report(label: str, db: BanDatabase, rows: int, indexed: bool):
+    print(label)
+    for name, func in [
+            ("find",         lambda i: db.find(
+                "", f"#chan{i%CHANNELS}", 1, f"*!*@host{i*7%rows}.example")),
+            ("get_active",   lambda i: db.get_active(
+                "", f"#chan{i%CHANNELS}")),
+            ("get_last",     lambda i: db.get_last(
+                "", f"#chan{i%CHANNELS}"))]:
+        print(f"  {name:<13} {_time(func):9.3f}ms")
+
+    # (once, at startup. without expirations_ban, it reads every
+    # expiration for every active ban, which takes too long to wait for)
+    if indexed:
+        took = _time(lambda i: db.get_expiring(), 5)
+        print(f"  {'get_expiring':<13} {took:9.3f}ms")
+    else:
+        print(f"  {'get_expiring':<13} {'skipped':>9}")
+
+def _main():
+    parser = ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    location = os.path.join(tempfile.mkdtemp(), "bench.db")
+    db = BanDatabase(location)
+
+    # without indexes, as far as the schema goes like version 0
+    cursor  = db._db.execute("""
+        SELECT name, sql FROM sqlite_master
+        WHERE type='index' AND sql IS NOT NULL
+    """)
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        db._db.execute(f"DROP INDEX {name}")
+
+    start = time.perf_counter()
+    _fill(db, args.rows)
+    print(f"filled {args.rows} rows in {time.perf_counter()-start:.1f}s")
+    _report("no indexes", db, args.rows, False)
+
+    # and index it, as the migrations would
+    start = time.perf_counter()
+    with db.batch():
+        for _, sql in indexes:
+            db._db.execute(sql)
+    print(f"indexed in {time.perf_counter()-start:.1f}s")
+    _report(f"version {len(MIGRATIONS)}", db, args.rows, True)
+    db._db.close()
+
+    os.remove(location)
+
+if __name__ == "__main__":
+    _main()
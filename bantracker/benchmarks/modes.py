@@ -0,0 +1,82 @@
+# MODE lines sent to remove a large wave of expired bans and quiets: the old
+# MODES= slicing versus pack_modes(), against a lower bound on how few lines
+# could possibly do it.
+#
+# from bantracker/, with the repo's root on PYTHONPATH (for irctoolkit):
+#   $ PYTHONPATH=.. python3 -m benchmarks.modes --masks 500
+
+import math, random
+from argparse import ArgumentParser
+from typing   import List, Tuple
+
+from bantracker.modes import LINE_MAX, ModeChange, pack_modes, prefix_length
+
+CHANNEL   = "##some-channel"
+NICKNAME  = "bantracker"
+USERNAME  = "~bantracker"
+HOSTNAME  = "services.example.net"
+
+def _wave(rand: random.Random, count: int) -> List[ModeChange]:
+    changes: List[ModeChange] = []
+    for i in range(count):
+        roll = rand.random()
+        if roll < 0.6:
+            mask = f"*!*@{rand.randrange(256)}.{rand.randrange(256)}.*"
+        elif roll < 0.8:
+            mask = f"$a:account{i}"
+        else:
+            # long extbans, e.g. $x:nick!user@host#realname
+            length = rand.randrange(20, 120)
+            mask   = "$x:*!*@*#" + "".join(
+                rand.choice("abcdefghij*") for _ in range(length)
+            )
+        changes.append((False, rand.choice("bq"), mask))
+    return changes
+
+def _sliced(changes: List[ModeChange], max_modes: int
+        ) -> List[Tuple[str, List[str]]]:
+    # what _mode_batches did: slice by MODES= alone
+    out: List[Tuple[str, List[str]]] = []
+    for i in range(0, len(changes), max_modes):
+        chunk = changes[i:i+max_modes]
+        out.append((
+            "-"+"".join(m for _, m, _ in chunk),
+            [a or "" for _, _, a in chunk]
+        ))
+    return out
+
+def _line_len(modes: str, args: List[str], prefix_len: int) -> int:
+    return len(f":{'x'*prefix_len} MODE {CHANNEL} {modes} {' '.join(args)}\r\n")
+
+def _main():
+    parser = ArgumentParser()
+    parser.add_argument("--masks", type=int, default=500)
+    parser.add_argument("--max-modes", type=int, default=4)
+    args = parser.parse_args()
+
+    rand       = random.Random(1)
+    changes    = _wave(rand, args.masks)
+    prefix_len = prefix_length(NICKNAME, USERNAME, HOSTNAME)
+
+    budget = LINE_MAX-len(f": MODE {CHANNEL} \r\n")-prefix_len-1
+    bound  = max(
+        math.ceil(len(changes)/args.max_modes),
+        math.ceil(sum(len(a or "")+2 for _, _, a in changes)/budget)
+    )
+    print(f"{len(changes)} masks, MODES={args.max_modes}, "
+        f"lower bound {bound} lines")
+
+    runs = [("packed", pack_modes(
+        CHANNEL, changes, args.max_modes, prefix_len
+    ))]
+    if args.max_modes > 0:
+        runs.insert(0, ("sliced", _sliced(changes, args.max_modes)))
+
+    for name, lines in runs:
+        too_long = sum(
+            1 for m, a in lines if _line_len(m, a, prefix_len) > LINE_MAX
+        )
+        print(f"  {name}: {len(lines)} lines, {too_long} over {LINE_MAX} bytes")
+
+if __name__ == "__main__":
+    _main()
@@ -11,10 +11,13 @@ from ircstates.numerics import *
 from ircrobots.matching import (Response, Responses, ANY, SELF, Folded, Regex,
     Formatless, Nick)
 
+from irctoolkit.log import LineLog
+
 NICK = ""
 CHAN = ""
 FILE = ""
 NONEXISTENT_ONLY = False
+LOG: LineLog
 
 NICKSERV = Nick("NickServ")
 RESP_REG   = Response("NOTICE", [SELF, Regex("^Information on ")],
@@ -117,9 +120,9 @@ class Server(BaseServer):
             sys.exit()
 
     def line_preread(self, line: Line):
-        print(f"{self.name} < {line.format()}")
+        LOG.line(self.name, "<", line)
     def line_presend(self, line: Line):
-        print(f"{self.name} > {line.format()}")
+        LOG.line(self.name, ">", line)
 
 class Bot(BaseBot):
     def create_server(self, name: str):
@@ -140,6 +143,9 @@ async def main(
     global NONEXISTENT_ONLY
     NONEXISTENT_ONLY = nonexistent_only
 
+    global LOG
+    LOG = LineLog("aban_check")
+
     bot = Bot()
     params = ConnectionParams(NICK, "chat.freenode.net", 6697, True)
     server = await bot.add_server("freenode", params)
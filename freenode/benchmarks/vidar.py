@@ -0,0 +1,134 @@
+# matching joining users against vidar's watch masks: a Glob.match per
+# watch mask per user mask, versus one substring index of every mask
+# (GlobIndex), versus WatchIndex (by extban type, literals looked up). 1k
+# joins a minute against 10k watch masks, e.g., from freenode/ with the
+# repo's root on PYTHONPATH (for irctoolkit):
+#
+#   $ PYTHONPATH=.. python3 -m benchmarks.vidar --masks 10000 --joins 1000
+
+import random, time
+from argparse import ArgumentParser
+from typing   import Callable, List, Set
+
+from ircrobots.glob    import compile as gcompile
+from ircstates         import User
+from ircstates.casemap import CaseMap
+from ircstates.names   import Name
+
+from vidar       import _masks
+from vidar.watch import GlobIndex, WatchIndex
+
+CASEMAPPING = CaseMap.RFC1459
+WORDS = [
+    "alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf",
+    "hotel", "india", "juliet", "kilo", "lima", "mike", "november"
+]
+
+def _ip(rand: random.Random) -> str:
+    return ".".join(str(rand.randrange(256)) for _ in range(4))
+
+def _watch_masks(rand: random.Random, count: int) -> List[str]:
+    masks: List[str] = []
+    for i in range(count):
+        roll = rand.random()
+        if roll < 0.4:
+            ip = _ip(rand).rsplit(".", 1)[0]
+            masks.append(f"$m:*!*@{ip}.*")
+        elif roll < 0.6:
+            masks.append(f"$m:*!*@user/{rand.choice(WORDS)}{i}")
+        elif roll < 0.75:
+            masks.append(f"$m:{rand.choice(WORDS)}{i}*!*@*")
+        elif roll < 0.85:
+            masks.append(f"$r:*{rand.choice(WORDS)}{i}*")
+        elif roll < 0.95:
+            masks.append(f"$a:{rand.choice(WORDS)}{i}")
+        else:
+            masks.append(f"$x:*!~{rand.choice(WORDS)}{i}@*#*")
+    return masks
+
+def _users(
+        rand:  random.Random,
+        count: int,
+        watch: List[str]
+        ) -> List[User]:
+    # some of whom are on an IP, or logged in to an account, that's watched
+    ips      = [m[7:-2] for m in watch if m.endswith(".*")]
+    accounts = [m[3:] for m in watch if m.startswith("$a:")]
+    users: List[User] = []
+    for i in range(count):
+        nickname = f"{rand.choice(WORDS)}_{i}"
+        user = User(Name(nickname, nickname.lower()))
+        user.username = f"~{rand.choice(WORDS)}"
+        user.realname = f"{rand.choice(WORDS)} {rand.choice(WORDS)}"
+        user.ip       = _ip(rand)
+        if rand.random() < 0.02:
+            user.ip = f"{rand.choice(ips)}.{rand.randrange(256)}"
+        if rand.random() < 0.5:
+            user.hostname = user.ip
+        else:
+            user.hostname = f"host-{i}.isp.example"
+        if rand.random() < 0.02:
+            user.account = rand.choice(accounts)
+        elif rand.random() < 0.3:
+            user.account = f"{rand.choice(WORDS)}{i}"
+        users.append(user)
+    return users
+
+def _main():
+    parser = ArgumentParser()
+    parser.add_argument("--masks", type=int, default=10_000)
+    parser.add_argument("--joins", type=int, default=1000,
+        help="users checked (think: per minute)")
+    parser.add_argument("--linear", type=int, default=50,
+        help="how many of those to also check the slow way")
+    args = parser.parse_args()
+
+    rand  = random.Random(1)
+    watch = _watch_masks(rand, args.masks)
+    users = [_masks(CASEMAPPING, u) for u in _users(rand, args.joins, watch)]
+
+    globs = [gcompile(m) for m in watch]
+    start = time.monotonic()
+    whole = GlobIndex()
+    for i, (mask, glob) in enumerate(zip(watch, globs)):
+        whole.add(i, mask, glob)
+    whole_built = time.monotonic()-start
+
+    start = time.monotonic()
+    typed = WatchIndex()
+    for i, mask in enumerate(watch):
+        typed.add(i, mask)
+    typed_built = time.monotonic()-start
+    print(f"{args.masks} watch masks, {args.joins} users (indexes built in "
+        f"{whole_built*1000:.1f}ms and {typed_built*1000:.1f}ms)")
+
+    def _run(
+            name:  str,
+            users: List[List[str]],
+            match: Callable[[List[str]], Set[int]]
+            ) -> List[Set[int]]:
+        # (seconds a minute of joins would take, from the per-user average)
+        out: List[Set[int]] = []
+        start = time.monotonic()
+        for masks in users:
+            out.append(match(masks))
+        took = (time.monotonic()-start)/max(len(users), 1)
+        print(f"  {name+':':8} {took*1000:.3f}ms per user, "
+            f"{took*args.joins:.2f}s a minute")
+        return out
+
+    linear = _run("linear", users[:args.linear], lambda masks: {
+        i for i, glob in enumerate(globs)
+        if any(glob.match(mask) for mask in masks)
+    })
+    indexed = _run("whole", users, whole.match)
+    bytype  = _run("by type", users, typed.match)
+
+    matches = sum(len(m) for m in bytype)
+    same = (linear == indexed[:len(linear)] == bytype[:len(linear)] and
+        indexed == bytype)
+    print(f"  {matches} matches, "
+        f"{'same' if same else 'DIFFERENT'} results every way")
+
+if __name__ == "__main__":
+    _main()
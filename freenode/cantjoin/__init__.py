@@ -13,6 +13,25 @@ from ircrobots.matching import Responses, SELF, Folded
 
 from ircrobots.glob import compile as glob_compile
 
+from irctoolkit         import metrics
+from irctoolkit.log     import LineLog
+from irctoolkit.metrics import REGISTRY
+
+LOG: LineLog
+KNOWN_COMMANDS = {"CANTJOIN", "DUPES"}
+
+COMMANDS        = REGISTRY.counter(
+    "cantjoin_commands_total",
+    "Commands we've been sent, by command",
+    ["command"]
+)
+COMMAND_SECONDS = REGISTRY.histogram(
+    "cantjoin_command_seconds",
+    "Time taken answering a command, by command",
+    ["command"],
+    buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+)
+
 class Type(IntEnum):
     BAN   = 1
     QUIET = 2
@@ -143,125 +162,132 @@ class Server(BaseServer):
         return bool(sep), ext + sep + self.casefold(mask)
 
     async def line_read(self, line: Line):
-        print(f"< {line.format()}")
+        LOG.line(self.name, "<", line)
 
         if (line.command == "PRIVMSG" and
                 self.is_me(line.params[0]) and
                 not self.is_me(line.hostmask.nickname)):
-
-            argv    = list(filter(bool, line.params[1].split(" ")))
-            command = argv.pop(0).upper()
-            sender  = line.hostmask.nickname
-
-            if command == "CANTJOIN":
-                if not len(argv) > 1:
-                    await self.send(build(
-                        "NOTICE", [sender, "not enough params"]
-                    ))
-                    return
-
-                nick      = argv[0]
-                nick_info = await self._find_user(nick)
-                if nick_info is None:
-                    await self.send(build(
-                        "NOTICE", [sender, f"user {nick} not found"]
-                    ))
-                    return
-
-                chan      = argv[1]
-                chan_bans = await self._ban_list(chan, "b")
-                if chan_bans is None:
-                    await self.send(build(
-                        "NOTICE", [sender, f"channel {chan} not found"]
-                    ))
-                    return
-
-                cased_nick, user, host, real, acc = nick_info
-                user_masks = self._masks(nick, user, host, real, acc)
-
-                reasons = []
-
-                cmodes = await self._cmodes(chan)
-                if cmodes is not None:
-                    if "r" in cmodes and acc is None:
-                        reasons.append("cmode +r")
-
-                for _, mask_tree, set_by, set_at in chan_bans:
-                    raw_mask          = mask_tree[0]
-                    chan_extban, mask = self._prepare_mask(raw_mask)
-
-                    glob = glob_compile(mask)
-
-                    for user_extban, user_mask in user_masks:
-                        if (chan_extban == user_extban and
-                                glob.match(user_mask)):
-                            reason = f"ban on {raw_mask}"
-                            if mask_tree[1:]:
-                                reason += f" ({mask_tree[1]})"
-                            reasons.append(reason)
-
-                if reasons:
-                    out = f"{cased_nick} cannot join {chan} because: "
-                    out += ", ".join(reasons)
-                    await self.send(build("NOTICE", [sender, out]))
+            command = line.params[1].split(" ", 1)[0].upper()
+            # (don't let people make up metric labels)
+            label = command if command in KNOWN_COMMANDS else "OTHER"
+            COMMANDS.labels(label).inc()
+            with COMMAND_SECONDS.labels(label).time():
+                await self._handle_command(line)
+
+    async def _handle_command(self, line: Line):
+        argv    = list(filter(bool, line.params[1].split(" ")))
+        command = argv.pop(0).upper()
+        sender  = line.hostmask.nickname
+
+        if command == "CANTJOIN":
+            if not len(argv) > 1:
+                await self.send(build(
+                    "NOTICE", [sender, "not enough params"]
+                ))
+                return
+
+            nick      = argv[0]
+            nick_info = await self._find_user(nick)
+            if nick_info is None:
+                await self.send(build(
+                    "NOTICE", [sender, f"user {nick} not found"]
+                ))
+                return
+
+            chan      = argv[1]
+            chan_bans = await self._ban_list(chan, "b")
+            if chan_bans is None:
+                await self.send(build(
+                    "NOTICE", [sender, f"channel {chan} not found"]
+                ))
+                return
+
+            cased_nick, user, host, real, acc = nick_info
+            user_masks = self._masks(nick, user, host, real, acc)
+
+            reasons = []
+
+            cmodes = await self._cmodes(chan)
+            if cmodes is not None:
+                if "r" in cmodes and acc is None:
+                    reasons.append("cmode +r")
+
+            for _, mask_tree, set_by, set_at in chan_bans:
+                raw_mask          = mask_tree[0]
+                chan_extban, mask = self._prepare_mask(raw_mask)
+
+                glob = glob_compile(mask)
+
+                for user_extban, user_mask in user_masks:
+                    if (chan_extban == user_extban and
+                            glob.match(user_mask)):
+                        reason = f"ban on {raw_mask}"
+                        if mask_tree[1:]:
+                            reason += f" ({mask_tree[1]})"
+                        reasons.append(reason)
+
+            if reasons:
+                out = f"{cased_nick} cannot join {chan} because: "
+                out += ", ".join(reasons)
+                await self.send(build("NOTICE", [sender, out]))
+            else:
+                await self.send(build("NOTICE", [sender, "idk"]))
+        elif command == "DUPES":
+            if not len(argv) > 0:
+                await self.send(build(
+                    "NOTICE", [sender, "not enough params"]
+                ))
+                return
+
+            query     = "bq"
+            chan      = argv[0]
+            chan_bans = await self._ban_list(chan, query)
+            if chan_bans is None:
+                await self.send(build(
+                    "NOTICE", [sender, f"channel {chan} not found"]
+                ))
+                return
+
+            seen:       Set[Tuple[Type, str]] = set()
+            duplicates: List[Tuple[Type, List[str]]] = []
+            for type, mask_tree, set_by, set_at in chan_bans:
+                raw_mask     = mask_tree[0]
+                extban, mask = self._prepare_mask(raw_mask)
+
+                key = (type, mask)
+                if key in seen:
+                    duplicates.append((type, mask_tree))
                 else:
-                    await self.send(build("NOTICE", [sender, "idk"]))
-            elif command == "DUPES":
-                if not len(argv) > 0:
-                    await self.send(build(
-                        "NOTICE", [sender, "not enough params"]
-                    ))
-                    return
-
-                query     = "bq"
-                chan      = argv[0]
-                chan_bans = await self._ban_list(chan, query)
-                if chan_bans is None:
-                    await self.send(build(
-                        "NOTICE", [sender, f"channel {chan} not found"]
-                    ))
-                    return
-
-                seen:       Set[Tuple[Type, str]] = set()
-                duplicates: List[Tuple[Type, List[str]]] = []
-                for type, mask_tree, set_by, set_at in chan_bans:
-                    raw_mask     = mask_tree[0]
-                    extban, mask = self._prepare_mask(raw_mask)
-
-                    key = (type, mask)
-                    if key in seen:
-                        duplicates.append((type, mask_tree))
-                    else:
-                        seen.add(key)
-
-                if duplicates:
-                    outs: List[str] = [f"duplicates on {chan}: "]
-                    for type, mask_tree in duplicates:
-                        mode = ""
-                        if len(query) > 1:
-                            if type == Type.QUIET:
-                                mode = "+q "
-                            else:
-                                mode = "+b "
-
-                        out = f"{mode}{mask_tree[0]} ({mask_tree[1]}), "
-                        if (len(outs[-1])+len(out)) > 400:
-                            outs[-1] = outs[-1][:-1]
-                            outs.append(out)
+                    seen.add(key)
+
+            if duplicates:
+                outs: List[str] = [f"duplicates on {chan}: "]
+                for type, mask_tree in duplicates:
+                    mode = ""
+                    if len(query) > 1:
+                        if type == Type.QUIET:
+                            mode = "+q "
                         else:
-                            outs[-1] = outs[-1] + out
-                    outs[-1] = outs[-1][:-2]
+                            mode = "+b "
 
-                    for out in outs:
-                        await self.send(build("NOTICE", [sender, out]))
-                else:
-                    await self.send(build(
-                        "NOTICE", [sender, f"no duplicates found for {chan}"]
-                    ))
-                    return
+                    out = f"{mode}{mask_tree[0]} ({mask_tree[1]}), "
+                    if (len(outs[-1])+len(out)) > 400:
+                        outs[-1] = outs[-1][:-1]
+                        outs.append(out)
+                    else:
+                        outs[-1] = outs[-1] + out
+                outs[-1] = outs[-1][:-2]
+
+                for out in outs:
+                    await self.send(build("NOTICE", [sender, out]))
+            else:
+                await self.send(build(
+                    "NOTICE", [sender, f"no duplicates found for {chan}"]
+                ))
+                return
 
     async def line_send(self, line: Line):
-        print(f"> {line.format()}")
+        LOG.line(self.name, ">", line)
 
 
 class Bot(BaseBot):
@@ -271,7 +297,14 @@ class Bot(BaseBot):
 
 async def main(
         nick: str,
-        sasl: Optional[str]=None):
+        sasl: Optional[str]=None,
+        log:  Optional[LineLog]=None,
+        metrics_at: Optional[str]=None):
+    global LOG
+    LOG = log or LineLog("cantjoin")
+
+    if metrics_at is not None:
+        await metrics.serve(metrics_at)
 
     bot = Bot()
 
@@ -1,6 +1,8 @@
 from argparse     import ArgumentParser
 from asyncio      import run
 from configparser import ConfigParser
+
+from irctoolkit.log import LineLog
 from . import main
 
 if __name__ == '__main__':
@@ -15,5 +17,10 @@ if __name__ == '__main__':
 
     nickname = config["bot"]["nickname"]
     sasl     = config["bot"]["sasl"]
+    log      = LineLog.from_config(
+        "cantjoin", config["log"] if "log" in config else {}
+    )
+
+    metrics  = config["bot"].get("metrics", None)
 
-    run(main(nickname, sasl))
+    run(main(nickname, sasl, log, metrics))
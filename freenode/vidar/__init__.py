@@ -1,9 +1,11 @@
-import asyncio, os
-from typing import cast, Dict, List, Optional, Set
+import asyncio, os, resource, signal, sys
+from time   import monotonic
+from typing import cast, Any, Dict, List, Optional, Set
 
 from irctokens import build, Line
 from ircstates import User, casefold
 from ircstates.names import Name
+from ircstates.server import WHO_TYPE
 from ircrobots import Bot as BaseBot
 from ircrobots import Server as BaseServer
 from ircrobots import ConnectionParams, SASLUserPass
@@ -12,9 +14,30 @@ from ircstates.numerics import *
 from ircrobots.matching import Response, Responses, Folded, Nick, SELF
 from ircrobots.glob     import Glob, collapse as gcollapse, compile as gcompile
 
+from irctoolkit         import metrics
+from irctoolkit.log     import LineLog
+from irctoolkit.metrics import REGISTRY
+from irctoolkit.profile import LineProfiler
+from irctoolkit.whox    import WhoxBatcher
+from irctoolkit.whox    import LIMIT as WHOX_LIMIT, TIMEOUT as WHOX_TIMEOUT
+
 from .database import MaskDatabase
+from .watch    import WatchList, WatchMask
 
 TRIGGER = "!"
+LOG: LineLog
+PROFILE: LineProfiler
+
+CHECK_SECONDS = REGISTRY.histogram(
+    "vidar_check_seconds",
+    "Time taken matching a user against every watch mask, by cause",
+    ["cause"]
+)
+MATCHES = REGISTRY.counter(
+    "vidar_matches_total",
+    "Watch mask matches, by cause",
+    ["cause"]
+)
 
 ADMINS_S = [
     "*!*@bitbot/jess"
@@ -69,57 +92,70 @@ def _is_admin(hostmask: str) -> bool:
 class VidarUser(User):
     def __init__(self, name: Name):
         super().__init__(name)
-        self.caught: Set[int] = set()
+        # a bit per WatchMask.slot that's caught them, so most people (who
+        # are caught by nothing) cost nothing
+        self.caught = 0
 
 class Server(BaseServer):
     def __init__(self,
             bot:  BaseBot,
             name: str,
-            database:   MaskDatabase,
+            watch:      WatchList,
             log_chan:   str,
-            watch_chan: str):
+            watch_chan: str,
+            whox_limit:   int,
+            whox_timeout: float):
         super().__init__(bot, name)
 
-        self._database   = database
+        self._watch      = watch
         self._log_chan   = log_chan
         self._watch_chan = watch_chan
 
-        self._new_users: Set[str] = set()
-
-        self._watch_masks: Dict[int, Glob] = {}
-        for mask_id, mask in self._database.get_all():
-            self._watch_masks[mask_id] = gcompile(mask)
+        # (with ircstates' WHOX token, so it keeps our users up to date)
+        self._whox = WhoxBatcher(self, "vidar", WHO_TYPE, "n%afhinrstu",
+            timeout=whox_timeout, limit=whox_limit)
 
     def create_user(self, nickname: Name) -> VidarUser:
         return VidarUser(nickname)
 
     def line_preread(self, line: Line):
-        print(f"{self.name} < {line.format()}")
+        LOG.line(self.name, "<", line)
     def line_presend(self, line: Line):
-        print(f"{self.name} > {line.format()}")
+        LOG.line(self.name, ">", line)
+    async def line_send(self, line: Line):
+        self._whox.sent(line)
+
+    async def wait_for(self, *args: Any, **kwargs: Any) -> Line:
+        with PROFILE.waiting():
+            return await super().wait_for(*args, **kwargs)
 
     async def _check_user(self, user: User, cause: str):
+        start = monotonic()
         muser = cast(VidarUser, user)
         masks = _masks(self.isupport.casemapping, user)
-        for mask_id, watch_glob in self._watch_masks.items():
-            watch_mask    = self._database.get(mask_id)
-            watch_comment = self._database.get_comment(mask_id)
-            if mask_id in muser.caught:
-                continue
-
-            for mask in masks:
-                if watch_glob.match(mask):
-                    out = (f"[{cause}] "
-                        f"mask match ({watch_mask}) "
-                        f"for {user.hostmask()}")
-                    if watch_comment is not None:
-                        out += f": {watch_comment}"
-                    await self._log(out)
-
-                    muser.caught.add(mask_id)
-                    break
+
+        caught: List[WatchMask] = []
+        for mask_id in self._watch.match(masks):
+            watch_mask = self._watch.get(mask_id)
+            bit        = 1 << watch_mask.slot
+            if not muser.caught & bit:
+                muser.caught |= bit
+                caught.append(watch_mask)
+        CHECK_SECONDS.labels(cause).observe(monotonic()-start)
+
+        for watch_mask in caught:
+            out = (f"[{cause}] "
+                f"mask match ({watch_mask.mask}) "
+                f"for {user.hostmask()}")
+            if watch_mask.comment is not None:
+                out += f": {watch_mask.comment}"
+            MATCHES.labels(cause).inc()
+            await self._log(out)
 
     async def line_read(self, line: Line):
+        await PROFILE.dispatch(line, self._line_read)
+
+    async def _line_read(self, line: Line):
         if line.command == "001":
             await self.send(build(
                 "JOIN", [f"{self._log_chan},{self._watch_chan}"]
@@ -130,16 +166,16 @@ class Server(BaseServer):
                 self.casefold(line.params[0]) == self._watch_chan):
             folded = self.casefold(line.hostmask.nickname)
             if not folded == self.nickname_lower:
-                self._new_users.add(folded)
-                await self.send(self.prepare_whox(line.hostmask.nickname))
+                self._whox.add(folded, self._watch_chan)
 
         elif line.command == RPL_WHOSPCRPL:
-            folded = self.casefold(line.params[6])
-            if folded in self._new_users:
-                self._new_users.remove(folded)
-                if folded in self.users:
-                    user  = self.users[folded]
-                    await self._check_user(user, "JOINX")
+            request = self._whox.answer(line)
+            if request is not None and request.nickname in self.users:
+                user = self.users[request.nickname]
+                await self._check_user(user, "JOINX")
+
+        elif line.command == RPL_ENDOFWHO:
+            self._whox.end(line)
 
         elif line.command in ["ACCOUNT", "CHGHOST", "NICK"]:
             folded = self.casefold(line.hostmask.nickname)
@@ -182,25 +218,25 @@ class Server(BaseServer):
                     if argc > 2:
                         comment = " ".join(argv[2:])
 
-                    existing = self._database.find(mask)
+                    existing = self._watch.find(mask)
 
                     if subcommand == "add":
                         if existing is None:
-                            mask_id = self._database.add(mask, comment)
-                            self._watch_masks[mask_id] = gcompile(mask)
+                            mask_id = self._watch.add(mask, comment)
 
                             out = f"now watching {mask} ({mask_id})"
                             await self.send(build(
                                 reply_method, [reply_target, out]
                             ))
                         else:
-                            print("it exists!!!")
+                            LOG.debug("it exists!!!", self.name)
                             # error message
                             pass
                     elif subcommand == "remove":
                         if existing is not None:
-                            self._database.remove(existing)
-                            del self._watch_masks[existing]
+                            slot = self._watch.remove(existing)
+                            for user in self.users.values():
+                                cast(VidarUser, user).caught &= ~(1 << slot)
 
                             out = f"no longer watching {mask}"
                             await self.send(build(
@@ -208,11 +244,11 @@ class Server(BaseServer):
                             ))
                         else:
                             # error message
-                            print("it does not exist!!")
+                            LOG.debug("it does not exist!!", self.name)
                     elif subcommand == "comment":
                         if existing is not None:
-                            existing_mask = self._database.get(existing)
-                            self._database.set_comment(existing, comment)
+                            existing_mask = self._watch.get(existing).mask
+                            self._watch.set_comment(existing, comment)
 
                             if comment is not None:
                                 out = f"set comment for {existing_mask}"
@@ -222,7 +258,54 @@ class Server(BaseServer):
                                 reply_method, [reply_target, out]
                             ))
                         else:
-                            print("it does not exist!!")
+                            LOG.debug("it does not exist!!", self.name)
+
+                elif command == "memory":
+                    for out in self._memory():
+                        await self.send(build(
+                            reply_method, [reply_target, out]
+                        ))
+
+                elif command == "profile" and argc > 0:
+                    subcommand = argv[0].lower()
+                    outs: List[str] = []
+                    if subcommand in ["start", "stop"]:
+                        if (subcommand == "start") == PROFILE.running:
+                            outs.append(f"profiling already {subcommand}ed")
+                        else:
+                            outs.append(PROFILE.toggle())
+                    elif subcommand == "status":
+                        if PROFILE.running:
+                            outs = PROFILE.summary() or ["nothing yet"]
+                        else:
+                            outs.append("not profiling")
+
+                    for out in outs:
+                        await self.send(build(
+                            reply_method, [reply_target, out]
+                        ))
+
+    def _memory(self) -> List[str]:
+        watch  = self._watch.sizes()
+        caught = [
+            cast(VidarUser, u).caught for u in self.users.values()
+            if cast(VidarUser, u).caught
+        ]
+        whox   = self._whox.sizes()
+        # (KiB, on linux)
+        rss    = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return [
+            f"watching {watch['masks']} masks: {watch['literal']} looked "
+            f"up, {watch['by type']} by type under {watch['substrings']} "
+            f"substrings, {watch['any type']} tried against everything",
+            f"{len(self.users)} users, {len(caught)} caught by something "
+            f"({sum(bin(c).count('1') for c in caught)} catches, "
+            f"{sum(sys.getsizeof(c) for c in caught)} bytes)",
+            f"whox: {whox['queued']} queued, {whox['sent']} waiting on an "
+            f"answer in {whox['batches']} batches "
+            f"(limit {self._whox.limit})",
+            f"peak rss {rss/1024:.1f}MiB"
+        ]
 
     async def _log(self, line: str):
         await self.send(build("NOTICE", [self._log_chan, line]))
@@ -231,31 +314,53 @@ class Bot(BaseBot):
     def __init__(self,
             database:   str,
             log_chan:   str,
-            watch_chan: str):
+            watch_chan: str,
+            whox_limit:   int=WHOX_LIMIT,
+            whox_timeout: float=WHOX_TIMEOUT):
         super().__init__()
-        self._database   = MaskDatabase(database)
+        self._watch      = WatchList(MaskDatabase(database))
         self._log_chan   = log_chan
         self._watch_chan = watch_chan
+        self._whox_limit   = whox_limit
+        self._whox_timeout = whox_timeout
 
     def create_server(self, name: str):
         return Server(self,
             name,
-            self._database,
+            self._watch,
             self._log_chan,
-            self._watch_chan)
+            self._watch_chan,
+            self._whox_limit,
+            self._whox_timeout)
 
 async def main(
         database:   str,
         nickname:   str,
         sasl:       Optional[str],
         log_chan:   str,
-        watch_chan: str):
+        watch_chan: str,
+        log:        LineLog,
+        metrics_at: Optional[str]=None,
+        whox_limit:   int=WHOX_LIMIT,
+        whox_timeout: float=WHOX_TIMEOUT):
+    global LOG
+    LOG = log
+
+    if metrics_at is not None:
+        await metrics.serve(metrics_at)
 
     db_dir = os.path.dirname(os.path.abspath(database))
     if not os.path.isdir(db_dir):
         os.makedirs(db_dir)
 
-    bot = Bot(database, log_chan, watch_chan)
+    global PROFILE
+    PROFILE = LineProfiler("vidar", os.path.join(db_dir, "profiles"))
+    # `kill -USR1` starts profiling, and then stops it and writes it out
+    asyncio.get_running_loop().add_signal_handler(
+        signal.SIGUSR1, lambda: LOG.info(PROFILE.toggle())
+    )
+
+    bot = Bot(database, log_chan, watch_chan, whox_limit, whox_timeout)
     params = ConnectionParams(
         nickname,
         "chat.freenode.net",
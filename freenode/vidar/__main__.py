@@ -2,6 +2,8 @@ from argparse     import ArgumentParser
 from asyncio      import run
 from configparser import ConfigParser
 from os.path      import expanduser
+
+from irctoolkit.log import LineLog
 from . import main
 
 if __name__ == '__main__':
@@ -19,5 +21,14 @@ if __name__ == '__main__':
     database   = expanduser(config["bot"]["database"])
     log_chan   = config["bot"]["log-chan"]
     watch_chan = config["bot"]["watch-chan"]
+    log        = LineLog.from_config(
+        "vidar", config["log"] if "log" in config else {}
+    )
+
+    metrics    = config["bot"].get("metrics", None)
+    # people waiting on a WHOX at once, and seconds we'll wait on one
+    whox_limit   = int(config["bot"].get("whox-limit", "10000"))
+    whox_timeout = float(config["bot"].get("whox-timeout", "60"))
 
-    run(main(database, nickname, sasl, log_chan, watch_chan))
+    run(main(database, nickname, sasl, log_chan, watch_chan, log, metrics,
+        whox_limit, whox_timeout))
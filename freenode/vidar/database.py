@@ -34,9 +34,9 @@ class MaskDatabase(object):
         """, [mask, comment])
         return self.get_last()
 
-    def get_all(self) -> List[Tuple[int, str]]:
+    def get_all(self) -> List[Tuple[int, str, Optional[str]]]:
         cursor = self._db.execute("""
-            SELECT mask_id, mask
+            SELECT mask_id, mask, comment
             FROM  masks
             WHERE removed = 0
         """)
@@ -0,0 +1,235 @@
+import heapq
+from dataclasses import dataclass
+from typing      import Dict, ItemsView, Iterable, List, Optional, Set
+
+from ircrobots.glob import Glob, compile as gcompile
+
+from .database import MaskDatabase
+
+@dataclass
+class WatchMask(object):
+    mask:    str
+    comment: Optional[str]
+    glob:    Glob
+    # this mask's bit in who it's caught (see VidarUser.caught). slots of
+    # removed masks are reused, so bits stay as few as masks we're watching
+    slot:    int
+
+# every glob that matches a string has each of its runs of literal
+# characters somewhere in it, so a glob only needs trying against strings
+# that have some substring of those runs in them. longer substrings are
+# shared by fewer globs (IP masks are mostly digits and dots)
+MIN_GRAM = 3
+MAX_GRAM = 6
+
+def _grams(pattern: str) -> Set[str]:
+    literals = pattern.replace("?", "*").split("*")
+    length   = min(max(len(l) for l in literals), MAX_GRAM)
+    grams: Set[str] = set()
+    if length >= MIN_GRAM:
+        for literal in literals:
+            for i in range(len(literal)-length+1):
+                grams.add(literal[i:i+length])
+    return grams
+
+class GlobIndex(object):
+    # globs filed under one substring of their literals (whichever the
+    # fewest other globs are filed under when they're added), so matching a
+    # string is a dict lookup per substring of it and a Glob.match per glob
+    # that might match, rather than a Glob.match per glob
+    def __init__(self):
+        self._globs:   Dict[int, Glob] = {}
+        self._grams:   Dict[str, Set[int]] = {}
+        self._filed:   Dict[int, str] = {}
+        # how many globs are filed under substrings of each length
+        self._lengths: Dict[int, int] = {}
+        # too few literals to file; these are tried against everything
+        self._anywhere: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._globs)
+    def substrings(self) -> int:
+        return len(self._grams)
+
+    def add(self, glob_id: int, pattern: str, glob: Glob):
+        self._globs[glob_id] = glob
+        grams = _grams(pattern)
+        if not grams:
+            self._anywhere.add(glob_id)
+            return
+
+        gram = min(
+            sorted(grams), key=lambda g: len(self._grams.get(g, ()))
+        )
+        self._grams.setdefault(gram, set()).add(glob_id)
+        self._filed[glob_id] = gram
+        self._lengths[len(gram)] = self._lengths.get(len(gram), 0)+1
+
+    def remove(self, glob_id: int):
+        del self._globs[glob_id]
+        gram = self._filed.pop(glob_id, None)
+        if gram is None:
+            self._anywhere.discard(glob_id)
+            return
+
+        filed = self._grams[gram]
+        filed.discard(glob_id)
+        if not filed:
+            del self._grams[gram]
+        self._lengths[len(gram)] -= 1
+        if not self._lengths[len(gram)]:
+            del self._lengths[len(gram)]
+
+    def match(self, strings: Iterable[str]) -> Set[int]:
+        # ids of every glob that matches any of `strings`
+        matched: Set[int] = set()
+        grams = self._grams
+        for s in strings:
+            maybe = set(self._anywhere)
+            for length in self._lengths:
+                for i in range(len(s)-length+1):
+                    filed = grams.get(s[i:i+length])
+                    if filed is not None:
+                        maybe |= filed
+            maybe -= matched
+
+            for glob_id in maybe:
+                if self._globs[glob_id].match(s):
+                    matched.add(glob_id)
+        return matched
+
+def _wild(s: str) -> bool:
+    return "*" in s or "?" in s
+
+class WatchIndex(object):
+    # watch masks split by extban type, so e.g. `$a:foo*` is only tried
+    # against `$a:` masks (and then only against what's after the `$a:`).
+    # masks without wildcards, including bare ones like `$a` and `$~a`, are
+    # just looked up
+    def __init__(self):
+        self._literals: Dict[str, Set[int]] = {}
+        self._types:    Dict[str, GlobIndex] = {}
+        # wildcards in their extban type (e.g. `$*`); tried against whole
+        # masks, whatever their type
+        self._anytype = GlobIndex()
+        self._added:  Dict[int, str] = {}
+
+    def add(self, mask_id: int, mask: str):
+        self._added[mask_id] = mask
+        type, sep, text = mask.partition(":")
+        if not _wild(mask):
+            self._literals.setdefault(mask, set()).add(mask_id)
+        elif sep and not _wild(type):
+            index = self._types.get(type)
+            if index is None:
+                index = self._types[type] = GlobIndex()
+            index.add(mask_id, text, gcompile(text))
+        else:
+            self._anytype.add(mask_id, mask, gcompile(mask))
+
+    def remove(self, mask_id: int):
+        mask = self._added.pop(mask_id)
+        type, sep, text = mask.partition(":")
+        if not _wild(mask):
+            literal = self._literals[mask]
+            literal.discard(mask_id)
+            if not literal:
+                del self._literals[mask]
+        elif sep and not _wild(type):
+            self._types[type].remove(mask_id)
+        else:
+            self._anytype.remove(mask_id)
+
+    def sizes(self) -> Dict[str, int]:
+        indexes = [*self._types.values(), self._anytype]
+        return {
+            "literal":    sum(len(i) for i in self._literals.values()),
+            "by type":    sum(len(i) for i in self._types.values()),
+            "any type":   len(self._anytype),
+            "substrings": sum(i.substrings() for i in indexes)
+        }
+
+    def match(self, masks: List[str]) -> Set[int]:
+        # ids of every watch mask that matches any of `masks`
+        matched: Set[int] = set()
+        for mask in masks:
+            literal = self._literals.get(mask)
+            if literal is not None:
+                matched |= literal
+
+            type, sep, text = mask.partition(":")
+            index = self._types.get(type)
+            if sep and index is not None:
+                matched |= index.match([text])
+        matched |= self._anytype.match(masks)
+        return matched
+
+class WatchList(object):
+    # every mask we're watching for, kept in memory so checking a user never
+    # has to ask the database anything. changes go to both
+    def __init__(self, database: MaskDatabase):
+        self._database = database
+        self._masks: Dict[int, WatchMask] = {}
+        self._ids:   Dict[str, int] = {}
+        self._index  = WatchIndex()
+        self._slots: List[int] = []
+        self._next_slot = 0
+
+        for mask_id, mask, comment in database.get_all():
+            self._load(mask_id, mask, comment)
+
+    def _load(self,
+            mask_id: int,
+            mask:    str,
+            comment: Optional[str]):
+        if self._slots:
+            slot = heapq.heappop(self._slots)
+        else:
+            slot = self._next_slot
+            self._next_slot += 1
+        self._masks[mask_id] = WatchMask(
+            mask, comment, gcompile(mask), slot
+        )
+        self._ids[mask]      = mask_id
+        self._index.add(mask_id, mask)
+
+    def __len__(self) -> int:
+        return len(self._masks)
+
+    def items(self) -> ItemsView[int, WatchMask]:
+        return self._masks.items()
+
+    def sizes(self) -> Dict[str, int]:
+        return {"masks": len(self._masks), **self._index.sizes()}
+
+    def match(self, masks: List[str]) -> List[int]:
+        # ids of watch masks that match any of `masks`, oldest first
+        return sorted(self._index.match(masks))
+
+    def find(self, mask: str) -> Optional[int]:
+        return self._ids.get(mask)
+    def get(self, mask_id: int) -> WatchMask:
+        return self._masks[mask_id]
+
+    def add(self,
+            mask:    str,
+            comment: Optional[str]) -> int:
+        mask_id = self._database.add(mask, comment)
+        self._load(mask_id, mask, comment)
+        return mask_id
+
+    def remove(self, mask_id: int) -> int:
+        # returns the removed mask's slot; forget who it caught before
+        # adding another mask, which might be given the same one
+        self._database.remove(mask_id)
+        watch_mask = self._masks.pop(mask_id)
+        del self._ids[watch_mask.mask]
+        self._index.remove(mask_id)
+        heapq.heappush(self._slots, watch_mask.slot)
+        return watch_mask.slot
+
+    def set_comment(self,
+            mask_id: int,
+            comment: Optional[str]):
+        self._database.set_comment(mask_id, comment)
+        self._masks[mask_id].comment = comment
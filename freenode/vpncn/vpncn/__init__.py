@@ -9,18 +9,23 @@ from ircrobots import ConnectionParams, SASLUserPass
 from ircstates.numerics import *
 from ircrobots.matching import ANY, Folded, Nick, Response, SELF
 
+from irctoolkit      import metrics
+from irctoolkit.log  import LineLog
+from irctoolkit.whox import WhoxBatcher
+
 from .config   import Config, load_config
 from .scanners import CertScanner
 
 CONFIG:      Config
 CONFIG_PATH: str
+LOG:         LineLog
 
 CHANSERV = Nick("ChanServ")
 
 class Server(BaseServer):
     def __init__(self, bot: BaseBot, name: str):
         super().__init__(bot, name)
-        self._whox: Dict[str, List[str]] = {}
+        self._whox = WhoxBatcher(self, "vpncn", "111", "%int")
 
     async def _cs_op(self, channel: Channel) -> bool:
         await self.send(build(
@@ -107,7 +112,7 @@ class Server(BaseServer):
 
     async def line_read(self, line: Line):
         global CONFIG
-        print(f"{self.name} < {line.format()}")
+        LOG.line(self.name, "<", line)
         if   line.command == "001":
             chans = list(CONFIG.channels.keys())
             await self.send(build("JOIN", [",".join(chans)]))
@@ -116,34 +121,26 @@ class Server(BaseServer):
                 not self.is_me(line.hostmask.nickname)):
             nick = self.casefold(line.hostmask.nickname)
             chan = self.casefold(line.params[0])
+            self._whox.add(nick, chan)
 
-            if not nick in self._whox:
-                self._whox[nick] = []
-            self._whox[nick].append(chan)
-
-            await self.send(build("WHO", [nick, "%int,111"]))
+        elif line.command == RPL_WHOSPCRPL:
+            request = self._whox.answer(line)
+            if request is not None:
+                LOG.debug(f"whox {request.nickname}", self.name)
 
-        elif (line.command == RPL_WHOSPCRPL and
-                line.params[1] == "111"):
-            nick = self.casefold(line.params[3])
-            print("whox", nick)
-
-            if nick in self.users:
-                user = self.users[nick]
-                chan = self.channels[self._whox[nick][0]]
+            if request is not None and request.nickname in self.users:
+                user = self.users[request.nickname]
                 host = line.params[2]
                 if host == "255.255.255.255":
                     host = user.hostname
 
-                await self._scan(user, chan, host)
+                for chan_name in request.channels:
+                    if chan_name in self.channels:
+                        chan = self.channels[chan_name]
+                        await self._scan(user, chan, host)
 
         elif line.command == RPL_ENDOFWHO:
-            nick = self.casefold(line.params[1])
-            if nick in self._whox:
-                print("popping", nick, self._whox[nick].pop(0))
-                if not self._whox[nick]:
-                    print("removing", nick)
-                    del self._whox[nick]
+            self._whox.end(line)
 
         elif (line.command == "JOIN" and
                 self.is_me(line.hostmask.nickname)):
@@ -164,11 +161,12 @@ class Server(BaseServer):
             for admin_mask in CONFIG.admins:
                 if admin_mask.match(userhost):
                     CONFIG = load_config(CONFIG_PATH)
-                    print("rehashed")
+                    LOG.info("rehashed", self.name)
                     break
 
     async def line_send(self, line: Line):
-        print(f"{self.name} > {line.format()}")
+        LOG.line(self.name, ">", line)
+        self._whox.sent(line)
 
 class Bot(BaseBot):
     def create_server(self, name: str):
@@ -180,6 +178,11 @@ async def main(config_path: str):
     config      = load_config(config_path)
     CONFIG      = config
 
+    global LOG
+    LOG = LineLog.from_config("vpncn", config.log)
+    if config.metrics is not None:
+        await metrics.serve(config.metrics)
+
     bot = Bot()
     params = ConnectionParams(
         config.nickname,
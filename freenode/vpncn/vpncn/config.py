@@ -1,6 +1,6 @@
 import yaml, re
 from dataclasses import dataclass
-from typing      import Dict, List, Optional, Pattern, Tuple
+from typing      import Any, Dict, List, Optional, Pattern, Tuple
 
 from ircrobots.glob import Glob, compile as glob_compile
 
@@ -20,6 +20,8 @@ class Config(object):
     act_defaults:  List[str]
     channels:      Dict[str, Optional[List[str]]]
     bad:           Dict[int, List[CertPattern]]
+    log:           Dict[str, Any]
+    metrics:       Optional[str]
 
 def load_config(path: str) -> Config:
     with open(path) as f:
@@ -59,5 +61,7 @@ def load_config(path: str) -> Config:
         config["act-sets"],
         config["act-default"],
         chans,
-        bad
+        bad,
+        config.get("log", None) or {},
+        config.get("metrics", None)
     )
@@ -1,11 +1,24 @@
 import asyncio, ssl, traceback
+from time   import monotonic
 from typing import Dict, List, Optional, Tuple
 
 from async_timeout import timeout as timeout_
 from OpenSSL       import crypto
 
+from irctoolkit.metrics import REGISTRY
 from .config       import CertPattern
 
+SCAN_SECONDS = REGISTRY.histogram(
+    "vpncn_scan_seconds",
+    "Time taken scanning every bad port on an IP, by result",
+    ["result"]
+)
+PORT_SCANS   = REGISTRY.counter(
+    "vpncn_port_scans_total",
+    "Certificates fetched (or not) from a port, by result",
+    ["result"]
+)
+
 CERT_KEYS = [
     ("CN", "cn"),
     ("O",  "on")
@@ -60,10 +73,14 @@ class CertScanner(object):
         try:
             async with timeout_(self._timeout):
                 values_t = await self._values(ip, port)
-        except (asyncio.TimeoutError,
-                ConnectionError):
-            pass
+        except asyncio.TimeoutError:
+            PORT_SCANS.labels("timeout").inc()
+        except ConnectionError:
+            PORT_SCANS.labels("refused").inc()
+        except ssl.SSLError:
+            PORT_SCANS.labels("tls_error").inc()
         except Exception as e:
+            PORT_SCANS.labels("error").inc()
             traceback.print_exc()
         else:
             values = [f"{k}:{v}" for k, v in values_t]
@@ -71,13 +88,26 @@ class CertScanner(object):
                 for pattern in cert.find:
                     for value in values:
                         if pattern.fullmatch(value):
+                            PORT_SCANS.labels("match").inc()
                             return f"{value} (:{port} {cert.name})"
+            PORT_SCANS.labels("clean").inc()
         return None
 
     async def scan(self,
             ip:  str,
             bad: Dict[int, List[CertPattern]]
             ) -> Optional[str]:
+        start  = monotonic()
+        result = await self._scan(ip, bad)
+        SCAN_SECONDS.labels("clean" if result is None else "match").observe(
+            monotonic()-start
+        )
+        return result
+
+    async def _scan(self,
+            ip:  str,
+            bad: Dict[int, List[CertPattern]]
+            ) -> Optional[str]:
         coros = [self._match(ip, p, c) for p, c in bad.items()]
         tasks = set(asyncio.ensure_future(c) for c in coros)
         while tasks:
@@ -0,0 +1,201 @@
+import atexit, json, os, queue, random, sys, threading, time
+from enum   import IntEnum
+from typing import Any, Dict, IO, List, Mapping, Optional, Tuple
+
+from irctokens import Line
+
+class Level(IntEnum):
+    DEBUG   = 10
+    INFO    = 20
+    WARNING = 30
+    ERROR   = 40
+    OFF     = 100
+
+# raw lines are logged at this level, unless a command says otherwise
+LINE_LEVEL = Level.DEBUG
+QUEUE_SIZE = 10_000
+MAX_BYTES  = 10*1024*1024
+BACKUPS    = 5
+
+# (time, level, server, direction, line or message)
+_Record = Tuple[float, Level, Optional[str], Optional[str], Any]
+
+def _level(s: str) -> Level:
+    return Level[s.strip().upper()]
+
+def _per_command(s: str) -> Dict[str, str]:
+    # "PRIVMSG:off, PING:info" -> {"PRIVMSG": "off", "PING": "info"}
+    out: Dict[str, str] = {}
+    for item in filter(bool, (i.strip() for i in s.split(","))):
+        command, _, value = item.partition(":")
+        out[command.strip().upper()] = value.strip()
+    return out
+
+class LineLog(object):
+    # raw IRC lines and bot messages, as JSON, written out by a background
+    # thread. whether a line is logged at all is decided before it's
+    # formatted; when the queue is full, records are dropped (and counted)
+    # rather than holding up the bot
+    def __init__(self,
+            name:      str,
+            file:      Optional[str]=None,
+            level:     Level=Level.DEBUG,
+            commands:  Dict[str, Level]={},
+            samples:   Dict[str, float]={},
+            max_bytes: int=MAX_BYTES,
+            backups:   int=BACKUPS,
+            queue_size: int=QUEUE_SIZE):
+        self._name      = name
+        self._file      = file
+        self._max_bytes = max_bytes
+        self._backups   = backups
+
+        self.level     = level
+        self._commands = dict(commands)
+        self._samples  = dict(samples)
+
+        self.dropped  = 0
+        self._records: "queue.Queue[Optional[_Record]]" = queue.Queue(
+            queue_size
+        )
+        self._writer = threading.Thread(
+            target=self._write_loop,
+            name=f"{name}-log-writer",
+            daemon=True
+        )
+        self._writer.start()
+        atexit.register(self.close)
+
+    @classmethod
+    def from_config(cls, name: str, config: Mapping[str, Any]) -> "LineLog":
+        # e.g. a bot's [log] config section
+        options = {k.replace("_", "-"): str(v) for k, v in config.items()}
+        file = options.get("file")
+        if file is not None:
+            file = os.path.expanduser(file)
+        return cls(
+            name,
+            file,
+            _level(options.get("level", "debug")),
+            {
+                command: _level(level) for command, level in
+                _per_command(options.get("commands", "")).items()
+            },
+            {
+                command: float(rate) for command, rate in
+                _per_command(options.get("sample", "")).items()
+            },
+            int(options.get("max-bytes", MAX_BYTES)),
+            int(options.get("backups", BACKUPS))
+        )
+
+    def _put(self, record: _Record):
+        try:
+            self._records.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def wants(self, command: str) -> Optional[Level]:
+        # the level a line of this command would be logged at, or None
+        level = self._commands.get(command, LINE_LEVEL)
+        if level < self.level or level == Level.OFF:
+            return None
+        sample = self._samples.get(command)
+        if sample is not None and random.random() >= sample:
+            return None
+        return level
+
+    def line(self, server: str, direction: str, line: Line):
+        level = self.wants(line.command)
+        if level is not None:
+            # (formatted on the writer thread)
+            self._put((time.time(), level, server, direction, line))
+
+    def log(self, level: Level, message: str, server: Optional[str]=None):
+        if level >= self.level:
+            self._put((time.time(), level, server, None, message))
+    def debug(self, message: str, server: Optional[str]=None):
+        self.log(Level.DEBUG, message, server)
+    def info(self, message: str, server: Optional[str]=None):
+        self.log(Level.INFO, message, server)
+    def warning(self, message: str, server: Optional[str]=None):
+        self.log(Level.WARNING, message, server)
+    def error(self, message: str, server: Optional[str]=None):
+        self.log(Level.ERROR, message, server)
+
+    def _format(self, record: _Record) -> str:
+        at, level, server, direction, body = record
+        out: Dict[str, Any] = {
+            "time":  round(at, 6),
+            "level": level.name.lower(),
+            "bot":   self._name
+        }
+        if server is not None:
+            out["server"] = server
+        if direction is not None:
+            out["direction"] = direction
+            out["line"]      = body.format()
+        else:
+            out["message"]   = body
+        return json.dumps(out)
+
+    def _open(self) -> Tuple[IO[str], int]:
+        if self._file is None:
+            return sys.stdout, 0
+        fd = open(self._file, "a")
+        return fd, fd.tell()
+
+    def _rotate(self, fd: IO[str]) -> Tuple[IO[str], int]:
+        # bot.log -> bot.log.1 -> ... -> bot.log.{backups}
+        fd.close()
+        for i in range(self._backups-1, 0, -1):
+            source = f"{self._file}.{i}"
+            if os.path.exists(source):
+                os.replace(source, f"{self._file}.{i+1}")
+        if self._backups > 0:
+            os.replace(self._file, f"{self._file}.1")
+        else:
+            os.remove(self._file)
+        return self._open()
+
+    def _write_loop(self):
+        fd, size = self._open()
+        reported = 0
+        running  = True
+        while running:
+            batch: List[Optional[_Record]] = [self._records.get()]
+            # take everything else that's queued up, for one flush
+            while True:
+                try:
+                    batch.append(self._records.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines: List[str] = []
+            for record in batch:
+                if record is None:
+                    running = False
+                    break
+                lines.append(self._format(record))
+            if self.dropped > reported:
+                lines.append(self._format((
+                    time.time(), Level.WARNING, None, None,
+                    f"dropped {self.dropped-reported} log records"
+                )))
+                reported = self.dropped
+
+            for line in lines:
+                if (self._file is not None and size > 0 and
+                        size+len(line)+1 > self._max_bytes):
+                    fd, size = self._rotate(fd)
+                fd.write(line+"\n")
+                size += len(line)+1
+            fd.flush()
+
+        if not fd is sys.stdout:
+            fd.close()
+
+    def close(self):
+        if self._writer.is_alive():
+            self._records.put(None)
+            self._writer.join()
@@ -0,0 +1,232 @@
+import asyncio, bisect
+from abc        import ABC, abstractmethod
+from contextlib import contextmanager
+from time       import monotonic
+from typing     import (Any, Callable, Dict, Generic, Iterable, Iterator,
+    List, Sequence, Tuple, TypeVar)
+
+# seconds
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0
+)
+# how long a scraper gets to send us its request
+REQUEST_TIMEOUT = 10.0
+
+# ((label values), value) pairs, from a callback at scrape time
+Samples = Iterable[Tuple[Tuple[str, ...], float]]
+
+def _escape(value: str) -> str:
+    return (value.replace("\\", "\\\\")
+        .replace("\n", "\\n").replace('"', '\\"'))
+
+def _labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)
+    )
+    return f"{{{pairs}}}"
+
+def _number(value: float) -> str:
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Counter(object):
+    def __init__(self):
+        self.value = 0.0
+    def inc(self, amount: float=1):
+        self.value += amount
+
+class _Histogram(object):
+    def __init__(self, buckets: Sequence[float]):
+        self._buckets = buckets
+        # per bucket, not cumulative; that's done at scrape time
+        self.counts = [0]*(len(buckets)+1)
+        self.sum    = 0.0
+        self.count  = 0
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.sum   += value
+        self.count += 1
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        # observe how long the block takes, however it's left
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.observe(monotonic()-start)
+
+C = TypeVar("C")
+class _Metric(ABC, Generic[C]):
+    kind = ""
+
+    def __init__(self,
+            name:       str,
+            help:       str,
+            labelnames: Sequence[str]):
+        self.name       = name
+        self.help       = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], C] = {}
+
+    @abstractmethod
+    def _child(self) -> C:
+        pass
+
+    def labels(self, *values: str) -> C:
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._child()
+        return child
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        pass
+
+class Counter(_Metric[_Counter]):
+    kind = "counter"
+
+    def _child(self) -> _Counter:
+        return _Counter()
+    def inc(self, amount: float=1):
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterator[str]:
+        for values, child in self._children.items():
+            labels = _labels(self.labelnames, values)
+            yield f"{self.name}{labels} {_number(child.value)}"
+
+class Histogram(_Metric[_Histogram]):
+    kind = "histogram"
+
+    def __init__(self,
+            name:       str,
+            help:       str,
+            labelnames: Sequence[str],
+            buckets:    Sequence[float]=BUCKETS):
+        super().__init__(name, help, labelnames)
+        self._buckets = tuple(sorted(buckets))
+
+    def _child(self) -> _Histogram:
+        return _Histogram(self._buckets)
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def samples(self) -> Iterator[str]:
+        names = self.labelnames+("le",)
+        for values, child in self._children.items():
+            total = 0
+            bounds = [_number(b) for b in self._buckets]+["+Inf"]
+            for bound, count in zip(bounds, child.counts):
+                total += count
+                labels = _labels(names, values+(bound,))
+                yield f"{self.name}_bucket{labels} {total}"
+            labels = _labels(self.labelnames, values)
+            yield f"{self.name}_sum{labels} {_number(child.sum)}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+class Callback(object):
+    # values that already exist elsewhere, only read when we're scraped
+    def __init__(self,
+            name:       str,
+            help:       str,
+            kind:       str,
+            labelnames: Sequence[str],
+            func:       Callable[[], Samples]):
+        self.name       = name
+        self.help       = help
+        self.kind       = kind
+        self.labelnames = tuple(labelnames)
+        self.func       = func
+
+    def samples(self) -> Iterator[str]:
+        for values, value in self.func():
+            labels = _labels(self.labelnames, values)
+            yield f"{self.name}{labels} {_number(value)}"
+
+class Registry(object):
+    def __init__(self):
+        self._metrics: Dict[str, Any] = {}
+
+    def _get(self, cls: type, name: str, *args: Any) -> Any:
+        # the same name always gets the same metric, so modules can declare
+        # theirs at import time
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args)
+        elif not isinstance(metric, cls):
+            raise ValueError(f"{name} is already a {metric.kind}")
+        return metric
+
+    def counter(self,
+            name:       str,
+            help:       str,
+            labelnames: Sequence[str]=()
+            ) -> Counter:
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self,
+            name:       str,
+            help:       str,
+            labelnames: Sequence[str]=(),
+            buckets:    Sequence[float]=BUCKETS
+            ) -> Histogram:
+        return self._get(Histogram, name, help, labelnames, buckets)
+
+    def callback(self,
+            name:       str,
+            help:       str,
+            kind:       str,
+            labelnames: Sequence[str],
+            func:       Callable[[], Samples]):
+        # (replaces any earlier callback of the same name)
+        self._metrics[name] = Callback(name, help, kind, labelnames, func)
+
+    def exposition(self) -> str:
+        # prometheus' text format
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines)+"\n"
+
+REGISTRY = Registry()
+
+async def serve(
+        listen:   str,
+        registry: Registry=REGISTRY
+        ) -> asyncio.AbstractServer:
+    # answer any GET on host:port with the registry's exposition
+    host, _, port = listen.rpartition(":")
+
+    async def _client(
+            reader: asyncio.StreamReader,
+            writer: asyncio.StreamWriter):
+        try:
+            await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"),
+                REQUEST_TIMEOUT)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError,
+                asyncio.LimitOverrunError):
+            writer.close()
+            return
+
+        data = registry.exposition().encode("utf8")
+        writer.write((
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: text/plain; version=0.0.4\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n"
+            "\r\n"
+        ).encode("ascii")+data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        writer.close()
+
+    return await asyncio.start_server(_client, host or "127.0.0.1", int(port))
@@ -0,0 +1,223 @@
+import cProfile, heapq, itertools, json, os, time
+from contextlib  import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from time        import perf_counter, thread_time
+from typing      import (Awaitable, Callable, Dict, Iterator, List, Optional,
+    Tuple)
+
+from irctokens import Line
+
+# how many of the slowest lines we keep
+SLOWEST = 20
+# per-line samples kept for the speedscope dump
+MAX_SAMPLES = 100_000
+
+# seconds spent in wait_for by the line being handled (and any tasks it
+# started), if one is
+_WAITED: ContextVar[Optional[List[float]]] = ContextVar(
+    "_WAITED", default=None
+)
+
+@dataclass
+class CommandStats(object):
+    lines:  int   = 0
+    wall:   float = 0.0
+    # on the event loop's thread; includes other tasks that ran while a
+    # handler was awaiting something
+    cpu:    float = 0.0
+    waited: float = 0.0
+    slowest: float = 0.0
+
+# (wall, tie breaker, command, wait_for seconds, line)
+_Slow = Tuple[float, int, str, float, str]
+
+class LineProfiler(object):
+    # opt-in timing of a bot's line handling, by command. costs one bool
+    # check per line until started; while running, cProfile watches the
+    # event loop's thread too
+    def __init__(self,
+            name:      str,
+            directory: str,
+            slowest:   int=SLOWEST):
+        self._name      = name
+        self.directory  = directory
+        self._keep      = slowest
+
+        self.running   = False
+        self._started  = 0.0
+        self._cprofile: Optional[cProfile.Profile] = None
+        self.commands: Dict[str, CommandStats] = {}
+        self._slowest: List[_Slow] = []
+        self._samples: List[Tuple[str, float, float]] = []
+        self._counter  = itertools.count()
+
+    def start(self):
+        self.commands.clear()
+        self._slowest.clear()
+        self._samples.clear()
+        self._started  = time.time()
+        self._cprofile = cProfile.Profile()
+        self._cprofile.enable()
+        self.running   = True
+
+    def stop(self) -> List[str]:
+        # stop, and write out what we've got. returns the files written
+        self.running = False
+        if self._cprofile is not None:
+            self._cprofile.disable()
+        return self.dump()
+
+    def toggle(self) -> str:
+        # for signal handlers and admin commands
+        if self.running:
+            files = self.stop()
+            return f"profiling stopped, written to {', '.join(files)}"
+        else:
+            self.start()
+            return "profiling started"
+
+    async def dispatch(self,
+            line:    Line,
+            handler: Callable[[Line], Awaitable[None]]):
+        if not self.running:
+            await handler(line)
+            return
+
+        waited = [0.0]
+        token  = _WAITED.set(waited)
+        wall   = perf_counter()
+        cpu    = thread_time()
+        try:
+            await handler(line)
+        finally:
+            wall = perf_counter()-wall
+            cpu  = thread_time()-cpu
+            _WAITED.reset(token)
+            self._record(line, wall, cpu, waited[0])
+
+    @contextmanager
+    def waiting(self) -> Iterator[None]:
+        # wrap a wait_for in this to put its time against the line that's
+        # waiting
+        waited = _WAITED.get()
+        if not self.running or waited is None:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            waited[0] += perf_counter()-start
+
+    def _record(self, line: Line, wall: float, cpu: float, waited: float):
+        stats = self.commands.get(line.command)
+        if stats is None:
+            stats = self.commands[line.command] = CommandStats()
+        stats.lines  += 1
+        stats.wall   += wall
+        stats.cpu    += cpu
+        stats.waited += waited
+        stats.slowest = max(stats.slowest, wall)
+
+        if len(self._samples) < MAX_SAMPLES:
+            self._samples.append((line.command, wall, waited))
+
+        slow: _Slow = (wall, next(self._counter), line.command, waited,
+            line.format())
+        if len(self._slowest) < self._keep:
+            heapq.heappush(self._slowest, slow)
+        elif wall > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, slow)
+
+    def slowest(self) -> List[_Slow]:
+        return sorted(self._slowest, reverse=True)
+
+    def summary(self, count: int=5) -> List[str]:
+        # the commands that took the most time overall, one per line
+        outs: List[str] = []
+        by_wall = sorted(self.commands.items(), key=lambda c: -c[1].wall)
+        for command, stats in by_wall[:count]:
+            outs.append(
+                f"{command}: {stats.lines} lines, "
+                f"{stats.wall*1000:.1f}ms wall, {stats.cpu*1000:.1f}ms cpu, "
+                f"{stats.waited*1000:.1f}ms in wait_for, "
+                f"slowest {stats.slowest*1000:.1f}ms"
+            )
+        return outs
+
+    def _speedscope(self) -> Dict:
+        # one "sample" per line handled, weighted by its wall time, with
+        # wait_for time as a child frame, so a flamegraph is by command
+        frames: List[Dict[str, str]] = []
+        indexes: Dict[str, int] = {}
+        def _frame(name: str) -> int:
+            if not name in indexes:
+                indexes[name] = len(frames)
+                frames.append({"name": name})
+            return indexes[name]
+
+        samples: List[List[int]] = []
+        weights: List[float] = []
+        for command, wall, waited in self._samples:
+            frame = _frame(command)
+            if waited > 0:
+                samples.append([frame, _frame("wait_for")])
+                weights.append(waited)
+            samples.append([frame])
+            weights.append(max(wall-waited, 0.0))
+
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "shared":  {"frames": frames},
+            "profiles": [{
+                "type":       "sampled",
+                "name":       f"{self._name} line handlers",
+                "unit":       "seconds",
+                "startValue": 0,
+                "endValue":   sum(weights),
+                "samples":    samples,
+                "weights":    weights
+            }],
+            "name": self._name,
+            "exporter": "irctoolkit.profile"
+        }
+
+    def dump(self) -> List[str]:
+        # {name}-{time}.pstats for cProfile (snakeviz, `python -m pstats`),
+        # {name}-{time}.speedscope.json for speedscope and
+        # {name}-{time}.json for per-command stats and the slowest lines
+        os.makedirs(self.directory, exist_ok=True)
+        prefix = os.path.join(
+            self.directory, f"{self._name}-{int(self._started)}"
+        )
+        files: List[str] = []
+
+        if self._cprofile is not None:
+            self._cprofile.dump_stats(f"{prefix}.pstats")
+            files.append(f"{prefix}.pstats")
+
+        with open(f"{prefix}.speedscope.json", "w") as file:
+            json.dump(self._speedscope(), file)
+        files.append(f"{prefix}.speedscope.json")
+
+        with open(f"{prefix}.json", "w") as file:
+            json.dump({
+                "started":  self._started,
+                "commands": {
+                    command: {
+                        "lines":   stats.lines,
+                        "wall":    stats.wall,
+                        "cpu":     stats.cpu,
+                        "waited":  stats.waited,
+                        "slowest": stats.slowest
+                    } for command, stats in self.commands.items()
+                },
+                "slowest": [
+                    {"wall": wall, "command": command, "waited": waited,
+                        "line": line}
+                    for wall, _, command, waited, line in self.slowest()
+                ]
+            }, file, indent=2)
+        files.append(f"{prefix}.json")
+        return files
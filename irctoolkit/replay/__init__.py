@@ -0,0 +1,148 @@
+import asyncio, sqlite3, sys, threading, tracemalloc
+from time   import perf_counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from irctokens import Line
+from ircrobots import ConnectionParams
+from ircrobots import Server as BaseServer
+
+from .bots import NETWORK, ReplayBot
+from .ircd import FakeTransport, StandInIrcd
+
+# how long nothing has to arrive for before a bot's done with what we gave it
+IDLE = 0.25
+
+class QueryCounter(object):
+    # every SQL statement run on any sqlite connection opened after install()
+    # (bots open theirs on threads of their own, so this is shared)
+    def __init__(self):
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def _trace(self, statement: str):
+        with self._lock:
+            self.count += 1
+
+    def install(self):
+        connect = sqlite3.connect
+        def _connect(*args: Any, **kwargs: Any) -> sqlite3.Connection:
+            db = connect(*args, **kwargs)
+            db.set_trace_callback(self._trace)
+            return db
+        sqlite3.connect = _connect # type: ignore
+
+QUERIES = QueryCounter()
+
+def _percentile(timings: List[float], q: float) -> float:
+    if not timings:
+        return 0.0
+    return timings[min(len(timings)-1, int(q*len(timings)))]
+
+def _ms(seconds: float) -> float:
+    return round(seconds*1000, 4)
+
+async def _drain(
+        server:  BaseServer,
+        idle:    float,
+        timings: List[Tuple[str, float]]):
+    # ircrobots' read loop, minus its ping timeout, timing each line's
+    # handling (line_read and whatever it awaits) until the bot goes quiet
+    while True:
+        if server._process_queue:
+            line, emit = server._process_queue.popleft()
+        else:
+            next_line = await server._read_line(idle)
+            if next_line is None:
+                break
+            line = next_line
+            emit = server.parse_tokens(line)
+
+        start = perf_counter()
+        await server._on_read(line, emit)
+        timings.append((line.command, perf_counter()-start))
+
+async def replay(
+        bot:       ReplayBot,
+        lines:     Iterable[str],
+        nickname:  str="replay",
+        idle:      float=IDLE,
+        trace_malloc: bool=False
+        ) -> Dict[str, Any]:
+    ircd   = StandInIrcd()
+    params = ConnectionParams(nickname, "irc.replay.test", 6667, None)
+    server = await bot.bot.add_server(NETWORK, params, FakeTransport(ircd))
+    # we're measuring the bot, not ircrobots' flood protection
+    server.set_throttle(1_000_000, 1)
+    server.set_throttle = lambda rate, time: None # type: ignore
+    sender = asyncio.create_task(server._send_lines())
+
+    # registration, JOINs and whatever each bot does once it's in a channel
+    await _drain(server, idle, [])
+
+    lines    = list(lines)
+    received = dict(ircd.received)
+    queries  = QUERIES.count
+    blocks   = sys.getallocatedblocks()
+    if trace_malloc:
+        tracemalloc.start()
+
+    timings: List[Tuple[str, float]] = []
+    start = perf_counter()
+    ircd.replay(lines)
+    await _drain(server, idle, timings)
+    # (the last line was handled one idle timeout ago)
+    seconds = max(perf_counter()-start-idle, 1e-9)
+
+    memory: Optional[Tuple[int, int]] = None
+    if trace_malloc:
+        memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    blocks  = sys.getallocatedblocks()-blocks
+    queries = QUERIES.count-queries
+    sender.cancel()
+    await server.disconnect()
+
+    handled = max(len(timings), 1)
+    latencies = sorted(t for _, t in timings)
+    by_command: Dict[str, List[float]] = {}
+    for command, took in timings:
+        by_command.setdefault(command, []).append(took)
+
+    out: Dict[str, Any] = {
+        "replayed": len(lines),
+        # replayed lines, and everything the stand-in ircd said in answer
+        "lines":    len(timings),
+        "seconds":  round(seconds, 6),
+        "lines_per_second": round(len(timings)/seconds, 2),
+        "latency_ms": {
+            "p50":  _ms(_percentile(latencies, 0.50)),
+            "p99":  _ms(_percentile(latencies, 0.99)),
+            "max":  _ms(latencies[-1] if latencies else 0.0),
+            "mean": _ms(sum(latencies)/handled)
+        },
+        "commands": {
+            command: {
+                "lines":  len(took),
+                "p50_ms": _ms(_percentile(sorted(took), 0.50)),
+                "p99_ms": _ms(_percentile(sorted(took), 0.99))
+            } for command, took in sorted(by_command.items())
+        },
+        "db_statements": queries,
+        "db_statements_per_line": round(queries/handled, 4),
+        # how many more (or, if things were freed, fewer) blocks are live
+        # than before, per line; not a count of allocations, which
+        # --tracemalloc's bytes are
+        "net_block_delta_per_line": round(blocks/handled, 4),
+        "sent": {
+            command: count-received.get(command, 0)
+            for command, count in sorted(ircd.received.items())
+            if count > received.get(command, 0)
+        }
+    }
+    if memory is not None:
+        current, peak = memory
+        out["tracemalloc"] = {
+            "bytes_per_line": round(current/handled, 2),
+            "peak_bytes":     peak
+        }
+    return out
@@ -0,0 +1,76 @@
+import asyncio, json, platform, sys, tempfile, time
+from argparse import ArgumentParser
+from typing   import Any, Dict, List, Optional
+
+from .          import IDLE, QUERIES, replay
+from .bots      import BOTS
+from .scenarios import SCENARIOS, recorded, recorded_nickname
+
+async def _run(
+        bot_name: str,
+        source:   str,
+        count:    int,
+        nickname: Optional[str],
+        idle:     float,
+        trace_malloc: bool
+        ) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory() as data:
+        bot = await BOTS[bot_name](data)
+        if source in SCENARIOS:
+            lines = SCENARIOS[source](bot.channel, count)
+        else:
+            lines    = recorded(source)
+            nickname = nickname or recorded_nickname(source)
+
+        out = await replay(bot, lines, nickname or "replay", idle,
+            trace_malloc)
+    return {"bot": bot_name, "scenario": source, **out}
+
+def _main():
+    parser = ArgumentParser(
+        description="Replay IRC traffic through our bots, offline")
+    parser.add_argument("bot", nargs="+", choices=sorted(BOTS))
+    parser.add_argument("--scenario", "-s", action="append",
+        choices=sorted(SCENARIOS), help="synthetic traffic (default: all)")
+    parser.add_argument("--log", "-l", action="append", default=[],
+        help="a recording of raw lines, or a bot's JSON line log")
+    parser.add_argument("--count", "-c", type=int, default=1000,
+        help="how many users synthetic traffic involves")
+    parser.add_argument("--nick", "-n",
+        help="who to be (default: whoever a recording was made as)")
+    parser.add_argument("--idle", type=float, default=IDLE,
+        help="seconds of quiet that means a bot's done")
+    parser.add_argument("--tracemalloc", action="store_true",
+        help="also trace allocations (slow; skews latency)")
+    parser.add_argument("--output", "-o", help="file to write JSON to")
+    args = parser.parse_args()
+
+    sources: List[str] = list(args.scenario or [])+args.log
+    if not sources:
+        sources = sorted(SCENARIOS)
+
+    QUERIES.install()
+    runs: List[Dict[str, Any]] = []
+    for bot_name in args.bot:
+        for source in sources:
+            run = asyncio.run(_run(bot_name, source, args.count, args.nick,
+                args.idle, args.tracemalloc))
+            runs.append(run)
+            print(f"{bot_name} {source}: {run['lines_per_second']} lines/s, "
+                f"p99 {run['latency_ms']['p99']}ms", file=sys.stderr)
+
+    results = {
+        "time":   int(time.time()),
+        "python": platform.python_version(),
+        "count":  args.count,
+        "runs":   runs
+    }
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    _main()
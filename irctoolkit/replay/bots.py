@@ -0,0 +1,99 @@
+import os, re, sys
+from dataclasses import dataclass
+from typing      import Awaitable, Callable, Dict
+
+from ircrobots import Bot as BaseBot
+from ircrobots import ConnectionParams
+from ircrobots.glob import compile as glob_compile
+
+from irctoolkit.log     import Level, LineLog
+from irctoolkit.profile import LineProfiler
+
+ROOT    = os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)
+)))
+CHANNEL = "#replay"
+# what replay() calls the server it adds
+NETWORK = "replay"
+# how many masks vidar has to check everyone against
+WATCH_MASKS = 500
+
+def _path(*parts: str):
+    # the bots aren't installed anywhere, they're run from their directories
+    path = os.path.join(ROOT, *parts)
+    if not path in sys.path:
+        sys.path.insert(0, path)
+
+def _log(name: str) -> LineLog:
+    # we're timing the bot, not its log file
+    return LineLog(name, level=Level.OFF)
+
+@dataclass
+class ReplayBot(object):
+    bot:      BaseBot
+    # the channel our synthetic traffic goes to
+    channel:  str
+
+async def bantracker(data: str) -> ReplayBot:
+    _path("bantracker")
+    os.makedirs(os.path.join(data, "channels"), exist_ok=True)
+    import bantracker as bt
+    from bantracker.config   import BotConfig, ChannelConfigs, NetworkConfig
+    from bantracker.database.aio import AsyncBanDatabase
+    from bantracker.expiry   import ExpiryScheduler
+
+    network = NetworkConfig(
+        NETWORK, ConnectionParams("replay", "irc.replay.test", 6667, None),
+        [CHANNEL], chanserv=True, enforce=True, extbans=[], trigger="!",
+        quiet="q"
+    )
+    bt.CONFIG = BotConfig(
+        data, {NETWORK: network}, NETWORK,
+        # (we're measuring the bot, not its flood protection)
+        flood_burst=1_000_000, flood_rate=1_000_000.0
+    )
+    bt.LOG          = _log("bantracker")
+    bt.PROFILE      = LineProfiler("bantracker", data)
+    bt.CHAN_CONFIGS = {
+        NETWORK: ChannelConfigs(os.path.join(data, "channels"), bt.LOG)
+    }
+    bt.DB           = AsyncBanDatabase(
+        os.path.join(data, "bantracker.db"), log=bt.LOG
+    )
+    bt.EXPIRY       = ExpiryScheduler()
+    return ReplayBot(bt.Bot(), CHANNEL)
+
+async def vidar(data: str) -> ReplayBot:
+    _path("freenode")
+    import vidar
+
+    vidar.LOG     = _log("vidar")
+    vidar.PROFILE = LineProfiler("vidar", data)
+    bot = vidar.Bot(os.path.join(data, "vidar.db"), "#replay-log", CHANNEL)
+    # nothing we replay should match these, so everyone's checked against
+    # all of them
+    for i in range(WATCH_MASKS):
+        bot._watch.add(f"$m:*!*@watched{i}.example", None)
+    return ReplayBot(bot, CHANNEL)
+
+async def vpncn(data: str) -> ReplayBot:
+    _path("freenode", "vpncn")
+    import vpncn
+    from vpncn.config import Config
+
+    vpncn.CONFIG = Config(
+        "irc.replay.test", "vpncn", ("", ""), [glob_compile("*@replay/*")],
+        # (no bad ports, so a scan is everything but the network)
+        [(re.compile(r"^(?P<ip>[0-9.]+)$"), "*!*@{IP}")],
+        {"kick": [(True, "KICK {CHAN} {NICK} :{REASON}")]}, ["kick"],
+        {CHANNEL: None}, {}, {}, None
+    )
+    vpncn.CONFIG_PATH = os.devnull
+    vpncn.LOG         = _log("vpncn")
+    return ReplayBot(vpncn.Bot(), CHANNEL)
+
+BOTS: Dict[str, Callable[[str], Awaitable[ReplayBot]]] = {
+    "bantracker": bantracker,
+    "vidar":      vidar,
+    "vpncn":      vpncn
+}
@@ -0,0 +1,369 @@
+import asyncio, time
+from dataclasses import dataclass, field
+from typing      import Dict, List, Optional, Set, Tuple
+
+from irctokens import build, Hostmask, Line, tokenise
+from ircrobots.interface import ITCPReader, ITCPTransport, ITCPWriter
+
+SERVER   = "irc.replay.test"
+CHANSERV = "ChanServ!ChanServ@services.replay.test"
+ISUPPORT = [
+    "CHANTYPES=#", "PREFIX=(ov)@+", "CHANMODES=beIq,k,l,imnpst", "MODES=4",
+    "CASEMAPPING=rfc1459", "NETWORK=Replay", "WHOX", "EXTBAN=$,ajrxz",
+    "NICKLEN=16"
+]
+# list mode: (list numeric, end of list numeric)
+LIST_NUMERICS = {
+    "b": ("367", "368"),
+    "e": ("348", "349"),
+    "I": ("346", "347"),
+    "q": ("728", "729")
+}
+# the order WHOX fields come back in, whatever order they were asked for in
+WHOX_ORDER = "tcuihsnfdlaor"
+
+def _fold(s: str) -> str:
+    return s.lower().translate(str.maketrans("[]\\~", "{}|^"))
+
+@dataclass
+class FakeUser(object):
+    nickname: str
+    username: str
+    hostname: str
+    realname: str = "replay"
+    account:  Optional[str] = None
+
+    def hostmask(self) -> str:
+        return f"{self.nickname}!{self.username}@{self.hostname}"
+    def ip(self) -> str:
+        # (as good a guess as we can make from a recording)
+        if self.hostname.replace(".", "").isdigit() or ":" in self.hostname:
+            return self.hostname
+        return "255.255.255.255"
+
+@dataclass
+class FakeChannel(object):
+    name:  str
+    users: Dict[str, str] = field(default_factory=dict)
+    # mode: [(mask, set_by, set_at)]
+    lists: Dict[str, List[Tuple[str, str, int]]] = field(
+        default_factory=dict
+    )
+
+class StandInIrcd(object):
+    # just enough of an ircd to get a bot registered and answer what it asks
+    # about (JOIN, NAMES, WHO, list modes, ChanServ OP), keeping track of who
+    # is where from both what the bot sends and what we replay at it
+    def __init__(self):
+        self.users:    Dict[str, FakeUser] = {}
+        self.channels: Dict[str, FakeChannel] = {}
+        self._me: Optional[FakeUser] = None
+        self._registered = False
+        self._cap_pending = False
+        self._got_user = False
+
+        # lines for the bot. answers jump the queue of replayed lines, like a
+        # server answering between everything else it's relaying
+        self._answers  = bytearray()
+        self._replayed = bytearray()
+        self._readable = asyncio.Event()
+
+        # lines the bot has sent us, by command
+        self.received: Dict[str, int] = {}
+
+    def _send(self, line: str):
+        self._answers += f"{line}\r\n".encode("utf8")
+        self._readable.set()
+    def _numeric(self, numeric: str, *params: str):
+        nick = self._me.nickname if self._me else "*"
+        line = build(numeric, [nick, *params]).with_source(SERVER)
+        self._send(line.format())
+
+    def replay(self, lines: List[str]):
+        # lines "from the network", in the order given
+        for line in lines:
+            self.track(tokenise(line))
+        data = "".join(f"{line}\r\n" for line in lines).encode("utf8")
+        self._replayed += data
+        if data:
+            self._readable.set()
+
+    def pending(self) -> int:
+        return len(self._answers)+len(self._replayed)
+
+    async def read(self, byte_count: int) -> bytes:
+        while not (self._answers or self._replayed):
+            self._readable.clear()
+            await self._readable.wait()
+        buffer = self._answers or self._replayed
+        # (whole lines only, so answers never land mid-line)
+        end = buffer.rfind(b"\n", 0, byte_count)+1 or len(buffer)
+        data = bytes(buffer[:end])
+        del buffer[:end]
+        return data
+
+    def _user(self, hostmask: Hostmask) -> FakeUser:
+        folded = _fold(hostmask.nickname)
+        user = self.users.get(folded)
+        if user is None:
+            user = self.users[folded] = FakeUser(
+                hostmask.nickname,
+                hostmask.username or "user",
+                hostmask.hostname or "replay.test"
+            )
+        return user
+
+    def _channel(self, name: str) -> FakeChannel:
+        folded = _fold(name)
+        channel = self.channels.get(folded)
+        if channel is None:
+            channel = self.channels[folded] = FakeChannel(name)
+        return channel
+
+    def track(self, line: Line):
+        # keep our state in line with something that's happened
+        if line.source is None:
+            return
+        hostmask = line.hostmask
+        folded   = _fold(hostmask.nickname)
+
+        if line.command == "JOIN":
+            user = self._user(hostmask)
+            if len(line.params) > 2:
+                # extended-join
+                account = line.params[1]
+                user.account  = None if account == "*" else account
+                user.realname = line.params[2]
+            for name in line.params[0].split(","):
+                self._channel(name).users[folded] = ""
+        elif line.command == "PART":
+            for name in line.params[0].split(","):
+                self._channel(name).users.pop(folded, None)
+        elif line.command == "KICK":
+            self._channel(line.params[0]).users.pop(
+                _fold(line.params[1]), None
+            )
+        elif line.command == "QUIT":
+            for channel in self.channels.values():
+                channel.users.pop(folded, None)
+            self.users.pop(folded, None)
+        elif line.command == "NICK" and folded in self.users:
+            user = self.users.pop(folded)
+            user.nickname = line.params[0]
+            new = _fold(user.nickname)
+            self.users[new] = user
+            for channel in self.channels.values():
+                if folded in channel.users:
+                    channel.users[new] = channel.users.pop(folded)
+        elif line.command == "ACCOUNT" and folded in self.users:
+            account = line.params[0]
+            self.users[folded].account = None if account == "*" else account
+        elif line.command == "MODE" and line.params[0].startswith("#"):
+            self._modes(hostmask, line.params[0], line.params[1:])
+
+    def _modes(self, source: Hostmask, name: str, args: List[str]):
+        channel = self._channel(name)
+        modes, args = args[0], list(args[1:])
+        add = True
+        for char in modes:
+            if char in "+-":
+                add = char == "+"
+            elif char in LIST_NUMERICS and args:
+                masks = channel.lists.setdefault(char, [])
+                mask  = args.pop(0)
+                masks[:] = [m for m in masks if not m[0] == mask]
+                if add:
+                    masks.append((mask, str(source), int(time.time())))
+            elif char in "ov" and args:
+                nick = _fold(args.pop(0))
+                if nick in channel.users:
+                    prefixes = channel.users[nick].replace(char, "")
+                    channel.users[nick] = prefixes+(char if add else "")
+            elif char in "kl" and args and add:
+                args.pop(0)
+            elif char == "k" and args:
+                args.pop(0)
+
+    def _from_me(self, line: Line):
+        # echo something the bot did back at it, as a server would
+        line = line.with_source(self._me.hostmask())
+        self.track(line)
+        self._send(line.format())
+
+    def _welcome(self):
+        self._registered = True
+        self._numeric("001", "Welcome to the replay network")
+        self._numeric("005", *ISUPPORT, "are supported by this server")
+        self._numeric("375", "- MOTD -")
+        self._numeric("376", "End of /MOTD")
+
+    def receive(self, line: Line):
+        # something the bot has sent us
+        self.received[line.command] = self.received.get(line.command, 0)+1
+        command = line.command
+
+        if command == "CAP":
+            subcommand = line.params[0].upper()
+            if subcommand == "LS":
+                self._cap_pending = True
+                self._send(f":{SERVER} CAP * LS :")
+            elif subcommand == "END":
+                self._cap_pending = False
+        elif command == "NICK":
+            if self._me is None:
+                self._me = FakeUser(line.params[0], "bot", "replay.test")
+            elif self._registered:
+                self._from_me(line)
+            else:
+                self._me.nickname = line.params[0]
+        elif command == "USER":
+            self._got_user = True
+            if self._me is not None:
+                self._me.username = line.params[0]
+                self._me.realname = line.params[3]
+        elif command == "PING":
+            self._send(f":{SERVER} PONG {SERVER} :{line.params[0]}")
+
+        if (not self._registered and
+                self._me is not None and
+                self._got_user and
+                not self._cap_pending):
+            self.users[_fold(self._me.nickname)] = self._me
+            self._welcome()
+            return
+        elif not self._registered:
+            return
+
+        if   command == "JOIN":
+            for name in line.params[0].split(","):
+                self._join(name)
+        elif command in ["PART", "KICK"]:
+            self._from_me(line)
+        elif command == "MODE":
+            self._mode(line)
+        elif command == "WHO":
+            self._who(line)
+        elif (command == "PRIVMSG" and
+                _fold(line.params[0]) == "chanserv"):
+            argv = line.params[1].split()
+            if len(argv) > 1 and argv[0].upper() == "OP":
+                mode = build("MODE", [argv[1], "+o", self._me.nickname])
+                mode = mode.with_source(CHANSERV)
+                self.track(mode)
+                self._send(mode.format())
+
+    def _join(self, name: str):
+        channel = self._channel(name)
+        self._from_me(build("JOIN", [channel.name]))
+
+        names: List[str] = []
+        for folded, prefixes in channel.users.items():
+            prefix = "@" if "o" in prefixes else ("+" if prefixes else "")
+            names.append(prefix+self.users[folded].nickname)
+        for i in range(0, len(names), 50):
+            self._numeric("353", "=", channel.name, " ".join(names[i:i+50]))
+        self._numeric("366", channel.name, "End of /NAMES list")
+
+    def _mode(self, line: Line):
+        target = line.params[0]
+        if not target.startswith("#"):
+            return
+        channel = self._channel(target)
+
+        if len(line.params) == 1:
+            self._numeric("324", channel.name, "+nt")
+            self._numeric("329", channel.name, "0")
+        elif (len(line.params) == 2 and
+                all(c in LIST_NUMERICS for c in line.params[1].lstrip("+"))):
+            for char in line.params[1].lstrip("+"):
+                numeric, end = LIST_NUMERICS[char]
+                for mask, set_by, set_at in channel.lists.get(char, []):
+                    if char == "q":
+                        self._numeric(numeric, channel.name, "q", mask,
+                            set_by, str(set_at))
+                    else:
+                        self._numeric(numeric, channel.name, mask, set_by,
+                            str(set_at))
+                self._numeric(end, channel.name, "End of list")
+        else:
+            self._from_me(line)
+
+    def _who(self, line: Line):
+        target = line.params[0]
+        fields = ""
+        token  = "0"
+        if len(line.params) > 1 and "%" in line.params[1]:
+            fields, _, token = line.params[1].split("%", 1)[1].partition(",")
+
+        folded  = _fold(target)
+        matches: List[Tuple[str, FakeUser]] = []
+        if target.startswith("#"):
+            channel = self._channel(target)
+            for nick in channel.users:
+                matches.append((channel.name, self.users[nick]))
+        elif folded in self.users:
+            matches.append(("*", self.users[folded]))
+
+        for channel_name, user in matches:
+            if fields:
+                values = {
+                    "t": token,
+                    "c": channel_name,
+                    "u": user.username,
+                    "i": user.ip(),
+                    "h": user.hostname,
+                    "s": SERVER,
+                    "n": user.nickname,
+                    "f": "H",
+                    "d": "0",
+                    "l": "0",
+                    "a": user.account or "0",
+                    "o": "n/a",
+                    "r": user.realname
+                }
+                self._numeric("354",
+                    *[values[f] for f in WHOX_ORDER if f in fields])
+            else:
+                self._numeric("352", channel_name, user.username,
+                    user.hostname, SERVER, user.nickname, "H",
+                    f"0 {user.realname}")
+        self._numeric("315", target, "End of /WHO list")
+
+class FakeReader(ITCPReader):
+    def __init__(self, ircd: StandInIrcd):
+        self._ircd = ircd
+    async def read(self, byte_count: int) -> bytes:
+        return await self._ircd.read(byte_count)
+
+class FakeWriter(ITCPWriter):
+    def __init__(self, ircd: StandInIrcd):
+        self._ircd   = ircd
+        self._buffer = b""
+
+    def get_peer(self) -> Tuple[str, int]:
+        return ("127.0.0.1", 6667)
+
+    def write(self, data: bytes):
+        self._buffer += data
+        *lines, self._buffer = self._buffer.split(b"\r\n")
+        for line in lines:
+            if line:
+                self._ircd.receive(tokenise(line.decode("utf8")))
+
+    async def drain(self):
+        pass
+    async def close(self):
+        pass
+
+class FakeTransport(ITCPTransport):
+    # "connects" a bot to a StandInIrcd instead of a network
+    def __init__(self, ircd: StandInIrcd):
+        self._ircd = ircd
+
+    async def connect(self,
+            hostname: str,
+            port:     int,
+            tls,
+            bindhost: Optional[str]=None
+            ) -> Tuple[ITCPReader, ITCPWriter]:
+        return FakeReader(self._ircd), FakeWriter(self._ircd)
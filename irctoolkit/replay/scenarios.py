@@ -0,0 +1,76 @@
+import json
+from typing import Callable, Dict, Iterator, List, Optional
+
+from irctokens import tokenise
+
+OP = "replay-op!op@replay/staff/op"
+
+def _user(i: int) -> str:
+    return f"user{i}!~u{i}@{10+i//65536}.{i//256%256}.{i%256}.1"
+
+def _op(channel: str) -> List[str]:
+    return [
+        f":{OP} JOIN {channel}",
+        f":ChanServ!ChanServ@services.replay.test MODE {channel} +o replay-op"
+    ]
+
+def join_flood(channel: str, count: int) -> Iterator[str]:
+    # a lot of people joining at once, none of them leaving
+    for i in range(count):
+        yield f":{_user(i)} JOIN {channel}"
+
+def mass_ban(channel: str, count: int, per_line: int=4) -> Iterator[str]:
+    # an op setting a lot of bans (with their targets already in the
+    # channel), per_line modes to a MODE
+    yield from _op(channel)
+    yield from join_flood(channel, count)
+    masks = [f"*!*@{_user(i).split('@')[1]}" for i in range(count)]
+    for i in range(0, count, per_line):
+        batch = masks[i:i+per_line]
+        yield f":{OP} MODE {channel} +{'b'*len(batch)} {' '.join(batch)}"
+
+def netsplit(channel: str, count: int) -> Iterator[str]:
+    # everyone splits off and then comes back
+    yield from join_flood(channel, count)
+    for i in range(count):
+        yield f":{_user(i)} QUIT :*.net *.split"
+    yield from join_flood(channel, count)
+
+SCENARIOS: Dict[str, Callable[[str, int], Iterator[str]]] = {
+    "join-flood": join_flood,
+    "mass-ban":   mass_ban,
+    "netsplit":   netsplit
+}
+
+# lines from a recording's own connection that our stand-in ircd says again
+REGISTRATION = {
+    "CAP", "AUTHENTICATE", "001", "002", "003", "004", "005", "375", "372",
+    "376", "422", "900", "903", "904"
+}
+
+def recorded(path: str) -> Iterator[str]:
+    # raw lines, one per line, or the JSON lines of irctoolkit.log.LineLog
+    # (where we only want what the bot read)
+    with open(path) as file:
+        for raw in file:
+            raw = raw.rstrip("\r\n")
+            if not raw:
+                continue
+            if raw.startswith("{"):
+                record = json.loads(raw)
+                if not record.get("direction") == "<":
+                    continue
+                raw = record["line"]
+            if not tokenise(raw).command in REGISTRATION:
+                yield raw
+
+def recorded_nickname(path: str) -> Optional[str]:
+    # who the recording was made as, from its 001
+    with open(path) as file:
+        for raw in file:
+            if raw.startswith("{"):
+                raw = json.loads(raw).get("line", "")
+            line = tokenise(raw.rstrip("\r\n")) if raw.strip() else None
+            if line is not None and line.command == "001" and line.params:
+                return line.params[0]
+    return None
@@ -0,0 +1,247 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from time        import monotonic
+from typing      import Deque, Dict, List, Optional, Tuple
+
+from irctokens import build, Line
+from ircrobots.interface import IServer
+
+from .metrics import REGISTRY
+
+# seconds to wait for more JOINs before asking about who's joined so far
+WINDOW    = 0.1
+# this many people joining a channel in one window get one WHO #channel
+# (which the server answers with a line for everyone in it)
+THRESHOLD = 20
+# nicknames per WHO. not every ircd takes a list (some only look at the
+# first target), so one unless we know better
+TARGETS   = 1
+# a WHO line's targets, in bytes
+TARGETS_LENGTH = 400
+# seconds we wait on an answer before giving up on it
+TIMEOUT   = 60.0
+# people queued or waiting on an answer; past this, we give up on whoever's
+# been waiting longest
+LIMIT     = 10_000
+# the order WHOX fields come back in, whatever order they were asked for in
+WHOX_ORDER = "tcuihsnfdlaor"
+
+WHOX_SECONDS = REGISTRY.histogram(
+    "whox_seconds",
+    "Time from someone joining to their WHOX being sent, and answered",
+    ["bot", "stage"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+)
+WHOX_LINES = REGISTRY.counter(
+    "whox_lines_total",
+    "WHO lines sent by batchers, by what they asked about",
+    ["bot", "target"]
+)
+WHOX_DROPPED = REGISTRY.counter(
+    "whox_dropped_total",
+    "People queued for WHOX who we gave up on, by why",
+    ["bot", "reason"]
+)
+
+@dataclass
+class WhoxRequest(object):
+    nickname: str
+    channels: List[str] = field(default_factory=list)
+    queued:   float = field(default_factory=monotonic)
+    sent:     Optional[float] = None
+
+class WhoxBatcher(object):
+    # one WHOX per JOIN floods us off the server on a netsplit rejoin.
+    # instead, people who join are queued for WINDOW seconds, then asked
+    # about THRESHOLD-or-more-a-channel with a channel WHO, or otherwise
+    # TARGETS at a time. answers (and end-of-WHOs) are handed back here to
+    # pair them up with who asked, by token. so are the lines we send, so
+    # that an end-of-WHO for someone else's WHO (e.g. ircrobots' own, when
+    # we join a channel) doesn't end one of ours
+    def __init__(self,
+            server:    IServer,
+            bot:       str,
+            token:     str,
+            fields:    str,
+            window:    float=WINDOW,
+            threshold: int=THRESHOLD,
+            targets:   int=TARGETS,
+            timeout:   float=TIMEOUT,
+            limit:     int=LIMIT):
+        self._server    = server
+        self._bot       = bot
+        self.token      = token
+        # e.g. "%int" or, with flags, "n%afhinrstu"
+        self._fields    = fields
+        self._window    = window
+        self._threshold = threshold
+        self._targets   = targets
+        self._timeout   = timeout
+        self.limit      = limit
+
+        # which parameter of an answer is the nickname
+        wanted = fields.partition("%")[2]
+        order  = [f for f in WHOX_ORDER if f in wanted or f == "t"]
+        self._nick_param = order.index("n")+1
+
+        self._queued: Dict[str, WhoxRequest] = {}
+        self._sent:   Dict[str, WhoxRequest] = {}
+        # WHOs we've queued but that haven't been sent yet, by id(line):
+        # (line, who it asks about)
+        self._unsent: Dict[int, Tuple[Line, List[WhoxRequest]]] = {}
+        # WHO target: (when, who it asked about) for every WHO that's been
+        # sent it and not yet ended, oldest first. None for WHOs not ours
+        self._batches: Dict[
+            str, Deque[Tuple[float, Optional[List[WhoxRequest]]]]
+        ] = {}
+        self._flushing: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._queued)+len(self._sent)
+
+    def add(self, nickname: str, channel: str):
+        # `nickname` (casefolded) joined `channel` (casefolded)
+        request = self._sent.get(nickname) or self._queued.get(nickname)
+        if request is None:
+            if len(self) >= self.limit:
+                self._drop_oldest()
+            request = self._queued[nickname] = WhoxRequest(nickname)
+        if not channel in request.channels:
+            request.channels.append(channel)
+
+        if self._queued and self._flushing is None:
+            self._flushing = asyncio.create_task(self._flush_later())
+
+    def _drop_oldest(self):
+        # (dicts are in the order people were added)
+        if self._sent:
+            del self._sent[next(iter(self._sent))]
+        elif self._queued:
+            del self._queued[next(iter(self._queued))]
+        else:
+            return
+        WHOX_DROPPED.labels(self._bot, "limit").inc()
+
+    def sizes(self) -> Dict[str, int]:
+        return {
+            "queued":  len(self._queued),
+            "sent":    len(self._sent),
+            "batches": len(self._unsent)+sum(
+                1 for b in self._batches.values() for _, r in b
+                if r is not None
+            )
+        }
+
+    async def _flush_later(self):
+        await asyncio.sleep(self._window)
+        self._flushing = None
+        await self.flush()
+
+    def _expire(self, now: float):
+        for nickname, request in list(self._sent.items()):
+            if request.sent is not None and now-request.sent > self._timeout:
+                del self._sent[nickname]
+                WHOX_DROPPED.labels(self._bot, "timeout").inc()
+        for key, (_, requests) in list(self._unsent.items()):
+            # (nobody in them is waiting on an answer any more)
+            if not any(self._sent.get(r.nickname) is r for r in requests):
+                del self._unsent[key]
+        for target, batches in list(self._batches.items()):
+            # (only from the oldest, so the rest still line up with their
+            # end-of-WHOs)
+            while batches and now-batches[0][0] > self._timeout:
+                batches.popleft()
+            if not batches:
+                del self._batches[target]
+
+    def _who(self, target: str, requests: List[WhoxRequest]) -> Line:
+        now = monotonic()
+        for request in requests:
+            request.sent = now
+            self._sent[request.nickname] = request
+            WHOX_SECONDS.labels(self._bot, "sent").observe(
+                now-request.queued
+            )
+        kind = "nicknames"
+        if target[:1] in self._server.isupport.chantypes:
+            kind = "channel"
+        WHOX_LINES.labels(self._bot, kind).inc()
+        line = build("WHO", [target, f"{self._fields},{self.token}"])
+        self._unsent[id(line)] = (line, requests)
+        return line
+
+    async def flush(self):
+        self._expire(monotonic())
+        queued, self._queued = self._queued, {}
+
+        # by the first channel we saw them join
+        by_channel: Dict[str, List[WhoxRequest]] = {}
+        for request in queued.values():
+            by_channel.setdefault(request.channels[0], []).append(request)
+
+        lines: List[Line] = []
+        rest:  List[WhoxRequest] = []
+        for channel, requests in by_channel.items():
+            if len(requests) >= self._threshold:
+                lines.append(self._who(channel, requests))
+            else:
+                rest.extend(requests)
+
+        chunk: List[WhoxRequest] = []
+        length = 0
+        for request in rest:
+            if chunk and (len(chunk) == self._targets or
+                    length+len(request.nickname)+1 > TARGETS_LENGTH):
+                lines.append(self._who(",".join(r.nickname for r in chunk),
+                    chunk))
+                chunk  = []
+                length = 0
+            chunk.append(request)
+            length += len(request.nickname)+1
+        if chunk:
+            lines.append(self._who(",".join(r.nickname for r in chunk),
+                chunk))
+
+        for line in lines:
+            await self._server.send(line)
+
+    def answer(self, line: Line) -> Optional[WhoxRequest]:
+        # a WHOX reply (354); who it answers for, if it's one of ours
+        if (len(line.params) <= self._nick_param or
+                not line.params[1] == self.token):
+            return None
+        nickname = self._server.casefold(line.params[self._nick_param])
+        request  = self._sent.pop(nickname, None)
+        if request is not None:
+            WHOX_SECONDS.labels(self._bot, "answered").observe(
+                monotonic()-request.queued
+            )
+        return request
+
+    def sent(self, line: Line):
+        # a line that's been sent to the server, whoever sent it. a server
+        # ends WHOs in the order they were sent
+        if not (line.command == "WHO" and line.params):
+            return
+        unsent   = self._unsent.pop(id(line), None)
+        requests = None if unsent is None else unsent[1]
+        target   = self._server.casefold(line.params[0])
+        batches  = self._batches.setdefault(target, deque())
+        batches.append((monotonic(), requests))
+
+    def end(self, line: Line):
+        # an end of WHO (315); anyone in the batch it ends who we didn't get
+        # an answer for has gone, or was never there
+        target  = self._server.casefold(line.params[1])
+        batches = self._batches.get(target)
+        if not batches:
+            return
+        _, requests = batches.popleft()
+        if not batches:
+            del self._batches[target]
+        for request in requests or []:
+            # (unless they've joined again since, and been asked about again)
+            if self._sent.get(request.nickname) is request:
+                del self._sent[request.nickname]
+                WHOX_DROPPED.labels(self._bot, "unanswered").inc()